@@ -0,0 +1,168 @@
+import itertools
+import datetime as dt
+from tables.record import parse_date, format_date
+
+# Places applicants on parking spaces in one pass, without prompts
+# Each applicant is checked against every lease on a space for their whole term, not just the move-in date,
+# and each placement is added to the timeline so later applicants see it
+#
+# Preference, the same order sf_move has always used:
+# 1. Quarters spaces with nothing booked from the move-in date on, by building (KN, GR, NU)
+# 2. Otherwise any space of an allowed contractor that is free for the whole term,
+#    by building, then contractor, then the soonest next lease (tightest fit first)
+#    These are marked for review, since the space is either another contractor's or already booked later on
+#
+# The plan is written to logs/move_plan.csv, which can be edited and applied with sf_move -a --plan-file
+
+BUILDINGS = ('KN', 'GR', 'NU')
+QUARTERS = 'The Quarters on Campus'
+# Contractors whose spaces applicants can be placed on, in order of preference
+CONTRACTORS = (QUARTERS, '2215')
+
+ASSIGNED = 'assigned'
+REVIEW = 'review'
+UNASSIGNED = 'unassigned'
+
+# One applicant's place in the plan
+class Assignment():
+    def __init__(self, applicant, space=None, status=UNASSIGNED, note=''):
+        self.applicant = applicant
+        self.space = space
+        self.status = status
+        self.note = note
+
+    def start(self):
+        return parse_date(self.applicant['Start_Date__c'])
+
+    def end(self):
+        return parse_date(self.applicant['End_Date__c'])
+
+    def to_row(self):
+        return {
+            'Applicant Id': self.applicant['Id'],
+            'Name': self.applicant.get('Full_Name__c') or self.applicant.get('Lessee_Name__c'),
+            'Email': self.applicant.get('Email__c'),
+            'Start Date': format_date(self.start()),
+            'End Date': format_date(self.end()),
+            'Pass Number': self.applicant.get('Pass_Number__c'),
+            'Building': self.space.building if self.space else '',
+            'Space': self.space.name if self.space else '',
+            'Contractor': self.space.contractor if self.space else '',
+            'Status': self.status,
+            'Note': self.note,
+        }
+
+    def __str__(self):
+        row = self.to_row()
+        place = f"{row['Space']} ({row['Building']}, {row['Contractor']})" if self.space else 'no space'
+        return f"{row['Name']}: {row['Start Date']} - {row['End Date']} -> {place} [{self.status}{': ' + self.note if self.note else ''}]"
+
+class Planner():
+    def __init__(self, timeline):
+        self.timeline = timeline
+        spaces = [s for s in timeline.spaces if s.contractor in CONTRACTORS and s.building in BUILDINGS]
+        self.spaces = sorted(spaces, key=lambda s: (BUILDINGS.index(s.building), CONTRACTORS.index(s.contractor), s.name))
+        self.quarters = [s for s in self.spaces if s.contractor == QUARTERS]
+        self.by_name = {s.name: s for s in timeline.spaces}
+
+    # First Quarters space with nothing on it from start on
+    def find_open(self, start):
+        for space in self.quarters:
+            if self.timeline.is_free(space.id, start):
+                return space
+
+        return None
+
+    # Free space for start through end in the first building and contractor that has one,
+    # the one whose next lease starts soonest
+    def find_fit(self, start, end):
+        key = lambda s: (s.building, s.contractor)
+        for _, group in itertools.groupby(self.spaces, key=key):
+            fits = [s for s in group if self.timeline.is_free(s.id, start, end)]
+            if fits:
+                return min(fits, key=lambda s: self.next_start(s, end))
+
+        return None
+
+    def next_start(self, space, d):
+        lease = self.timeline.next_lease(space.id, d)
+        return parse_date(lease['Start_Date__c']) if lease else dt.date.max
+
+    def place(self, assignment, space, status, note=''):
+        assignment.space = space
+        assignment.status = status
+        assignment.note = note
+        self.timeline.add(space.id, assignment.start(), assignment.end(), assignment.applicant)
+
+    def assign(self, applicant):
+        assignment = Assignment(applicant)
+        if not applicant.get('Pass_Number__c'):
+            assignment.note = 'no parking pass'
+            return assignment
+
+        start, end = assignment.start(), assignment.end()
+        if not start or not end or end < start:
+            assignment.note = 'missing or invalid dates'
+            return assignment
+
+        space = self.find_open(start)
+        if space:
+            self.place(assignment, space, ASSIGNED)
+            return assignment
+
+        space = self.find_fit(start, end)
+        if not space:
+            assignment.note = 'no space free for the whole term'
+            return assignment
+
+        reasons = []
+        if space.contractor != QUARTERS:
+            reasons.append(f'{space.contractor} space')
+        lease = self.timeline.next_lease(space.id, end)
+        if lease:
+            reasons.append(f"next lease starts {format_date(parse_date(lease['Start_Date__c']))}")
+        self.place(assignment, space, REVIEW, ', '.join(reasons))
+        return assignment
+
+    # Re-check a row of a reviewed plan against the current leases
+    def check(self, applicant, space_name):
+        assignment = Assignment(applicant)
+        space = self.by_name.get(space_name)
+        if not space:
+            assignment.note = f'unknown space {space_name}'
+            return assignment
+
+        if not self.timeline.is_free(space.id, assignment.start(), assignment.end()):
+            assignment.note = f'{space_name} is no longer free for the whole term'
+            return assignment
+
+        self.place(assignment, space, ASSIGNED)
+        return assignment
+
+# Earliest move-ins are placed first, so they get the first pick of spaces
+def sort_applicants(applicants):
+    return sorted(applicants, key=lambda a: (a['Start_Date__c'] or '', a['End_Date__c'] or '', a.get('Full_Name__c') or '', a['Id']))
+
+# Assignment for every applicant, in move-in order
+def plan(applicants, timeline):
+    planner = Planner(timeline)
+    return [planner.assign(applicant) for applicant in sort_applicants(applicants)]
+
+# Assignments from a reviewed plan file's rows (Applicant Id and Space)
+# Rows without a space, or for applicants that are no longer waiting, are left out
+def from_rows(rows, applicants, timeline):
+    planner = Planner(timeline)
+    by_id = {applicant['Id']: applicant for applicant in applicants}
+    assignments = []
+    for row in rows:
+        if not row.get('Space'):
+            continue
+
+        applicant = by_id.get(row['Applicant Id'])
+        if not applicant:
+            print(f"{row['Applicant Id']} ({row.get('Name')}) is no longer a paid applicant, skipping.")
+            continue
+
+        assignments.append(planner.check(applicant, row['Space']))
+
+    return assignments
@@ -1,26 +1,130 @@
 import os
-from simple_salesforce import Salesforce
-from dotenv import load_dotenv
+import json
+import time
+import metrics
+import governor
+
+# Access token and instance URL from the last login, reused until the session expires
+TOKEN_FILE = 'cache/session.json'
+
+# Salesforce's default session timeout is 2 hours, override with SF_SESSION_TTL (seconds)
+DEFAULT_TTL = 2 * 60 * 60
+# Log in again a little before the session actually times out
+TTL_MARGIN = 60
+
+def get_ttl():
+    return int(os.getenv("SF_SESSION_TTL", DEFAULT_TTL)) - TTL_MARGIN
+
+# Cached session for this user, or None if there isn't one or it has expired
+def read_token(username, path=TOKEN_FILE):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            token = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if token.get('username') != username or time.time() > token['issued_at'] + get_ttl():
+        return None
+
+    return token
+
+# Only readable by the current user, since the token is as good as a password until it expires
+def save_token(sf, username, path=TOKEN_FILE):
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    token = {
+        'username': username,
+        'session_id': sf.session_id,
+        'instance_url': f'https://{sf.sf_instance}',
+        'issued_at': time.time()
+    }
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(token, f)
+
+    return token
+
+def clear_token(path=TOKEN_FILE):
+    if os.path.exists(path):
+        os.remove(path)
 
 # Authenticate to Salesforce
-def auth():
+# Reuses the cached session if it hasn't expired, otherwise logs in and caches the new one
+# The session's issued_at is when it was logged in, not when it was read from the cache
+def auth(use_cache=True):
+    # simple_salesforce and dotenv are slow to import, so only pay for them when connecting
+    from simple_salesforce import Salesforce
+    from dotenv import load_dotenv
+
     # Authenticate with username, password, and security token
     load_dotenv()
+    username = os.getenv("SF_USERNAME")
+
+    token = read_token(username) if use_cache else None
+    if token:
+        sf = Salesforce(instance_url=token['instance_url'], session_id=token['session_id'])
+        sf.issued_at = token['issued_at']
+        metrics.install(sf.session)
+        governor.install(sf.session)
+        return sf
 
     try:
         sf = Salesforce(
-            username=os.getenv("SF_USERNAME"),
+            username=username,
             password=os.getenv("SF_PASSWORD"),
             security_token=os.getenv("SF_SECURITY_TOKEN"),
             consumer_key=os.getenv("SF_CONSUMER_KEY"),
             consumer_secret=os.getenv("SF_SECRET")
         )
 
+        sf.issued_at = save_token(sf, username)['issued_at']
+        metrics.install(sf.session)
+        governor.install(sf.session)
         return sf
     except Exception as e:
         print(f"Error connecting to Salesforce: {e}")
 
     return None
 
+# Stands in for the Salesforce session until it is first used
+# Commands can import sf freely, and --help or bad arguments never log in
+class LazySession():
+    def __init__(self):
+        self._sf = None
+
+    def connect(self, use_cache=True):
+        self._sf = auth(use_cache=use_cache)
+        return self._sf
+
+    # Drops the cached session and logs in again, for a session that was revoked or timed out early
+    def reconnect(self):
+        clear_token()
+        return self.connect(use_cache=False)
+
+    def get(self):
+        # Long-running processes outlive the session, so reconnect once it's expired
+        # A session from the cache can be close to expiring already, so this counts from when it was issued
+        if self._sf is None or time.time() > self._sf.issued_at + get_ttl():
+            self.connect()
+
+        return self._sf
+
+    # Calls made directly on the session (query_all, restful, ...) are retried once
+    # with a fresh login if the cached session was revoked or timed out early
+    def __getattr__(self, name):
+        attr = getattr(self.get(), name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            from simple_salesforce.exceptions import SalesforceExpiredSession
+            governor.check()
+            try:
+                return attr(*args, **kwargs)
+            except SalesforceExpiredSession:
+                return getattr(self.reconnect(), name)(*args, **kwargs)
+
+        return call
+
 
-sf = auth()
\ No newline at end of file
+sf = LazySession()
@@ -0,0 +1,560 @@
+import io
+import re
+import time
+import threading
+import csv
+import json
+import datetime as dt
+from json import dumps
+from functools import lru_cache
+
+# In-process stand-in for the simple_salesforce session, for benchmarks
+# Covers what the commands use: query_all with simple SOQL, sObject Collections,
+# and Bulk API 2.0 ingest jobs through session.request
+
+# Relationship name -> object it points to
+RELATIONSHIPS = {
+    'parking_space__r': 'Parking_Space__c',
+    'lease_contract_owner__r': 'Contractor__c',
+    'contractor_name__r': 'Contractor__c',
+    'lease_id__r': 'Leases__c',
+}
+
+ID_PREFIXES = {
+    'Contractor__c': 'a00',
+    'Parking_Space__c': 'a01',
+    'Leases__c': 'a02',
+    'Pooled_Lease__c': 'a03',
+    'Applicant__c': 'a04',
+    'Task': '00T',
+}
+
+NUMBER_FIELDS = {'Monthly_Rate__c', 'TT15_Share__c', 'TT15_Share_Amt__c'}
+BOOLEAN_FIELDS = {'Is_Resident__c', 'IsDeleted'}
+
+SOQL = re.compile(
+    r'^\s*SELECT\s+(?P<cols>.+?)\s+FROM\s+(?P<table>\w+)'
+    r'(?:\s+WHERE\s+(?P<where>.+?))?'
+    r'(?:\s+GROUP\s+BY\s+(?P<group>.+?))?'
+    r'(?:\s+ORDER\s+BY\s+(?P<order>.+?))?'
+    r'(?:\s+LIMIT\s+(?P<limit>\d+))?\s*$',
+    re.IGNORECASE | re.DOTALL
+)
+CONDITION = re.compile(r'^\s*([\w.]+)\s*(<=|>=|!=|=|<|>|NOT\s+IN\b|IN\b)\s*(.+?)\s*$', re.IGNORECASE)
+LITERAL = re.compile(r"'(?:\\.|[^'\\])*'|[^,\s()]+")
+DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}T')
+AGGREGATE = re.compile(r'^(COUNT|SUM|MAX|MIN|AVG)\(([\w.]*)\)\s*(\w*)$', re.IGNORECASE)
+
+# Aggregate functions over the values of one field, nulls are skipped like in SOQL
+AGGREGATES = {
+    'count': len,
+    'sum': sum,
+    'max': lambda values: max(values) if values else None,
+    'min': lambda values: min(values) if values else None,
+    'avg': lambda values: sum(values) / len(values) if values else None,
+}
+
+@lru_cache(maxsize=None)
+def parse_datetime(value):
+    value = value.replace('Z', '+0000')
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z'):
+        try:
+            return dt.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+
+    return value
+
+def parse_literal(text):
+    if text.startswith("'") and text.endswith("'"):
+        return text[1:-1]
+
+    lowered = text.lower()
+    if lowered in ('true', 'false'):
+        return lowered == 'true'
+
+    if lowered == 'null':
+        return None
+
+    if DATETIME.match(text):
+        return parse_datetime(text)
+
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def comparable(value, literal):
+    if isinstance(literal, dt.datetime) and isinstance(value, str):
+        return parse_datetime(value)
+
+    if isinstance(literal, str) and isinstance(value, str):
+        return value.lower()
+
+    return value
+
+def compare(value, op, literal):
+    if op in ('IN', 'NOT IN'):
+        found = value is not None and any(compare(value, '=', item) for item in literal)
+        return found == (op == 'IN')
+
+    if value is None or literal is None:
+        if op == '=':
+            return value is literal
+        if op == '!=':
+            return value is not literal
+        return False
+
+    value = comparable(value, literal)
+    if isinstance(literal, str):
+        literal = literal.lower()
+
+    return {
+        '=': lambda: value == literal,
+        '!=': lambda: value != literal,
+        '<': lambda: value < literal,
+        '<=': lambda: value <= literal,
+        '>': lambda: value > literal,
+        '>=': lambda: value >= literal,
+    }[op]()
+
+class FakeRequest():
+    def __init__(self, body=None):
+        self.body = body
+
+class FakeResponse():
+    def __init__(self, data=None, text=None, status_code=200, body=None):
+        self.data = data
+        self.text = text if text is not None else json.dumps(data)
+        self.content = self.text.encode('utf-8')
+        self.status_code = status_code
+        self.headers = {}
+        self.request = FakeRequest(body)
+
+    def json(self):
+        return self.data
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f'HTTP {self.status_code}: {self.text}')
+
+# Streamed download (stream=True), the body is only produced as iter_content reads it
+class FakeStreamResponse(FakeResponse):
+    def __init__(self, lines):
+        super().__init__(text='')
+        self.lines = lines
+        self.stream = True
+
+    def iter_content(self, chunk_size=1):
+        chunk = []
+        size = 0
+        for line in self.lines:
+            data = line.encode('utf-8')
+            chunk.append(data)
+            size += len(data)
+            if size >= chunk_size:
+                yield b''.join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield b''.join(chunk)
+
+# Bulk API 2.0 ingest and query endpoints; jobs complete as soon as they are closed
+class FakeSession():
+    def __init__(self, sf):
+        self.sf = sf
+        self.jobs = {}
+        # Same shape as requests.Session.hooks, so metrics.install() works on the fake
+        self.hooks = {'response': []}
+
+    def request(self, method, url, headers=None, json=None, data=None, params=None, **kwargs):
+        body = data if data is not None else (dumps(json) if json is not None else None)
+        return self.sf.respond(self.handle(method, url, json, data, params), body)
+
+    # Query jobs run as soon as they are created, results are pages of csv with a locator to the next one
+    def handle_query(self, method, parts, json, params):
+        if method == 'POST':
+            job_id = f'750{len(self.jobs):015}'
+            _, table, cols, rows = self.sf.filter_rows(json['query'], include_deleted=json['operation'] == 'queryAll')
+            self.jobs[job_id] = {'id': job_id, 'state': 'JobComplete', 'table': table, 'cols': cols, 'rows': rows}
+            return FakeResponse({'id': job_id, 'state': 'UploadComplete'})
+
+        job = self.jobs[parts[2]]
+        if len(parts) == 3:
+            return FakeResponse({'id': job['id'], 'state': job['state'], 'numberRecordsProcessed': len(job['rows'])})
+
+        start = int((params or {}).get('locator') or 0)
+        size = int((params or {}).get('maxRecords') or 50000)
+        page = job['rows'][start:start + size]
+        response = FakeStreamResponse(self.sf.csv_lines(job['table'], job['cols'], page))
+        response.headers['Sforce-NumberOfRecords'] = str(len(page))
+        response.headers['Sforce-Locator'] = str(start + size) if start + size < len(job['rows']) else 'null'
+        return response
+
+    def handle(self, method, url, json, data, params=None):
+        path = url[len(self.sf.base_url):].rstrip('/')
+        parts = path.split('/')
+        if parts[:2] == ['jobs', 'query']:
+            return self.handle_query(method, parts, json, params)
+        if parts[:2] != ['jobs', 'ingest']:
+            return FakeResponse({'error': f'Unsupported path {path}'}, status_code=404)
+
+        if method == 'POST':
+            job_id = f'750{len(self.jobs):015}'
+            self.jobs[job_id] = {'id': job_id, 'state': 'Open', **json, 'data': b''}
+            return FakeResponse({'id': job_id, 'state': 'Open'})
+
+        job = self.jobs[parts[2]]
+        if method == 'PUT':
+            job['data'] += data
+            return FakeResponse({})
+
+        if method == 'PATCH':
+            self.sf.process_job(job)
+            return FakeResponse({})
+
+        if len(parts) == 4 and parts[3] in ('failedResults', 'successfulResults'):
+            return FakeResponse(text=job[parts[3]])
+
+        return FakeResponse({
+            'id': job['id'],
+            'state': job['state'],
+            'numberRecordsProcessed': job['processed'],
+            'numberRecordsFailed': job['failed'],
+        })
+
+class FakeSalesforce():
+    def __init__(self, clock=None):
+        self.tables = {name: {} for name in ID_PREFIXES}
+        self.deleted = {name: {} for name in ID_PREFIXES}
+        self.clock = clock or dt.datetime.now(dt.timezone.utc).replace(microsecond=0)
+        self.base_url = 'https://fake.my.salesforce.com/services/data/v59.0/'
+        self.headers = {'Authorization': 'Bearer fake', 'Content-Type': 'application/json'}
+        self.session = FakeSession(self)
+        self.calls = 0
+        self.api_limit = 15000
+        # Seconds each call takes, to model round trips
+        self.latency = 0
+        self.lock = threading.Lock()
+        self.counter = 0
+        # lower case field name -> field name as stored, per table
+        self.fields = {name: {} for name in ID_PREFIXES}
+
+    # Every API call goes through here, like a real response through the session's hooks
+    def respond(self, response, body=None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        response.request = FakeRequest(body)
+        response.headers['Sforce-Limit-Info'] = f'api-usage={calls}/{self.api_limit}'
+        for hook in self.session.hooks['response']:
+            hook(response, stream=getattr(response, 'stream', False))
+        return response
+
+    def tick(self):
+        self.clock += dt.timedelta(seconds=1)
+        return self.clock.strftime('%Y-%m-%dT%H:%M:%S.000+0000')
+
+    def new_id(self, table):
+        self.counter += 1
+        return f'{ID_PREFIXES[table]}{self.counter:015}'
+
+    def insert(self, table, record):
+        record = {key: value for key, value in record.items() if key != 'attributes'}
+        record['Id'] = self.new_id(table)
+        record['SystemModstamp'] = self.tick()
+        record['LastModifiedDate'] = record['SystemModstamp']
+        record.setdefault('CreatedDate', record['SystemModstamp'])
+        record['IsDeleted'] = False
+        self.add_fields(table, record)
+        self.tables[table][record['Id']] = record
+        return record['Id']
+
+    def update(self, table, record):
+        existing = self.tables[table].get(record['Id'])
+        if not existing:
+            return False
+
+        existing.update({key: value for key, value in record.items() if key != 'attributes'})
+        existing['SystemModstamp'] = existing['LastModifiedDate'] = self.tick()
+        self.add_fields(table, existing)
+        return True
+
+    def delete(self, table, record_id):
+        record = self.tables[table].pop(record_id, None)
+        if not record:
+            return False
+
+        record['IsDeleted'] = True
+        record['SystemModstamp'] = record['LastModifiedDate'] = self.tick()
+        self.deleted[table][record_id] = record
+        return True
+
+    # Load the output of synthetic.Garage.salesforce_records, resolving names to Ids
+    def load(self, records):
+        contractors = {c['Name']: self.insert('Contractor__c', c) for c in records['contractors']}
+        spaces = {}
+        for space in records['spaces']:
+            space = dict(space, Contractor_Name__c=contractors[space['Contractor_Name__c']])
+            spaces[space['Name']] = self.insert('Parking_Space__c', space)
+
+        lease_ids = []
+        for lease in records['leases']:
+            lease = dict(
+                lease,
+                Parking_Space__c=spaces[lease['Parking_Space__c']],
+                Lease_Contract_Owner__c=contractors[lease['Lease_Contract_Owner__c']]
+            )
+            lease_ids.append(self.insert('Leases__c', lease))
+
+        for pooled in records['pool']:
+            lease = self.tables['Leases__c'][lease_ids[pooled['Lease_ID__c']]]
+            self.insert('Pooled_Lease__c', dict(
+                pooled,
+                Lease_ID__c=lease['Id'],
+                TT15_Share_Amt__c=round(lease['Monthly_Rate__c'] * pooled['TT15_Share__c'], 2)
+            ))
+
+    def add_fields(self, table, record):
+        for key in record:
+            self.fields[table].setdefault(key.lower(), key)
+
+    def field_name(self, table, name):
+        return self.fields[table].get(name.lower(), name)
+
+    def get_field(self, table, record, path):
+        if record is None:
+            return None
+
+        name, _, rest = path.partition('.')
+        if not rest:
+            return record.get(self.field_name(table, name))
+
+        return self.get_field(RELATIONSHIPS[name.lower()], self.related(table, record, name), rest)
+
+    def related(self, table, record, relationship):
+        target = RELATIONSHIPS[relationship.lower()]
+        foreign_key = relationship[:-3] + '__c'
+        return self.tables[target].get(self.get_field(table, record, foreign_key))
+
+    def project(self, table, record, cols):
+        result = {'attributes': {'type': table}}
+        for col in cols:
+            name, _, rest = col.partition('.')
+            if not rest:
+                key = self.field_name(table, name)
+                result[key] = record.get(key)
+                continue
+
+            related = self.related(table, record, name)
+            target = RELATIONSHIPS[name.lower()]
+            # Salesforce names the relationship as it is defined, whatever case the query used
+            name = self.field_name(table, name[:-3] + '__c')[:-3] + '__r'
+            if related is None:
+                result[name] = None
+                continue
+
+            result.setdefault(name, {'attributes': {'type': target}})
+            field = self.field_name(target, rest)
+            result[name][field] = related.get(field)
+
+        return result
+
+    # One AggregateResult row, grouped columns are read from the group's first row
+    def aggregate(self, table, rows, cols):
+        result = {'attributes': {'type': 'AggregateResult'}}
+        for n, col in enumerate(cols):
+            if not AGGREGATE.match(col):
+                result[col.split('.')[-1]] = self.get_field(table, rows[0], col)
+                continue
+
+            function, field, alias = AGGREGATE.match(col).groups()
+            values = [self.get_field(table, row, field) for row in rows] if field else rows
+            values = [value for value in values if value is not None]
+            result[alias or f'expr{n}'] = AGGREGATES[function.lower()](values)
+
+        return result
+
+    def matches(self, table, record, conditions):
+        for field, op, literal in conditions:
+            if not compare(self.get_field(table, record, field), op, literal):
+                return False
+
+        return True
+
+    def parse_where(self, where):
+        if not where:
+            return []
+
+        conditions = []
+        for condition in re.split(r'\s+AND\s+', where, flags=re.IGNORECASE):
+            field, op, literal = CONDITION.match(condition).groups()
+            op = ' '.join(op.upper().split())
+            if op in ('IN', 'NOT IN'):
+                conditions.append((field, op, [parse_literal(item) for item in LITERAL.findall(literal)]))
+            else:
+                conditions.append((field, op, parse_literal(literal)))
+
+        return conditions
+
+    def query_all(self, query, include_deleted=False, **kwargs):
+        result = self.select(query, include_deleted)
+        # query_all pages through 2000 records per call
+        for _ in range(max(1, -(-len(result['records']) // 2000))):
+            self.respond(FakeResponse(text=''), query)
+        return result
+
+    def select(self, query, include_deleted=False):
+        match, table, cols, rows = self.filter_rows(query, include_deleted)
+        if cols == ['COUNT()']:
+            records = []
+            result = {'totalSize': len(rows), 'done': True, 'records': records}
+        elif match['group']:
+            groups = {}
+            for row in rows:
+                groups.setdefault(self.get_field(table, row, match['group'].strip()), []).append(row)
+            records = [self.aggregate(table, group, cols) for group in groups.values()]
+            result = {'totalSize': len(records), 'done': True, 'records': records}
+        elif all(AGGREGATE.match(col) for col in cols):
+            records = [self.aggregate(table, rows, cols)]
+            result = {'totalSize': 1, 'done': True, 'records': records}
+        else:
+            records = [self.project(table, row, cols) for row in rows]
+            result = {'totalSize': len(records), 'done': True, 'records': records}
+        return result
+
+    # Stored rows matching the query, in order, before projection
+    def filter_rows(self, query, include_deleted=False):
+        match = SOQL.match(query)
+        table = match['table']
+        cols = [col.strip() for col in match['cols'].split(',')]
+        rows = list(self.tables[table].values())
+        if include_deleted:
+            rows.extend(self.deleted[table].values())
+
+        conditions = self.parse_where(match['where'])
+        rows = [row for row in rows if self.matches(table, row, conditions)]
+        if match['order']:
+            field, *direction = match['order'].split()
+            descending = bool(direction) and direction[0].upper() == 'DESC'
+            rows.sort(key=lambda row: self.get_field(table, row, field) or '', reverse=descending)
+        if match['limit']:
+            rows = rows[:int(match['limit'])]
+
+        return match, table, cols, rows
+
+    # Bulk API csv header for a query column, relationship columns as Parking_Space__r.Name
+    def column_name(self, table, col):
+        name, _, rest = col.partition('.')
+        if not rest:
+            return self.field_name(table, name)
+
+        relationship = self.field_name(table, name[:-3] + '__c')[:-3] + '__r'
+        return f'{relationship}.{self.field_name(RELATIONSHIPS[name.lower()], rest)}'
+
+    # Result csv for a page of rows, written a line at a time as it is read
+    def csv_lines(self, table, cols, rows):
+        fields = [self.column_name(table, col) for col in cols]
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator='\n')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(flatten(self.project(table, row, cols)))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    # Only sObject Collections are supported
+    def restful(self, path, params=None, method='GET', json=None, **kwargs):
+        results = self.collections(path, params, method, json)
+        self.respond(FakeResponse(results), dumps(json) if json else None)
+        return results
+
+    def collections(self, path, params, method, json):
+        if path != 'composite/sobjects':
+            raise NotImplementedError(path)
+
+        results = []
+        if method == 'DELETE':
+            for record_id in params['ids'].split(','):
+                table = next(t for t, p in ID_PREFIXES.items() if record_id.startswith(p))
+                success = self.delete(table, record_id)
+                results.append({'id': record_id, 'success': success, 'errors': [] if success else [{'message': 'not found'}]})
+            return results
+
+        for record in json['records']:
+            table = record['attributes']['type']
+            if method == 'POST':
+                results.append({'id': self.insert(table, record), 'success': True, 'errors': []})
+            else:
+                success = self.update(table, record)
+                results.append({'id': record['Id'], 'success': success, 'errors': [] if success else [{'message': 'not found'}]})
+
+        return results
+
+    def process_job(self, job):
+        table = job['object']
+        rows = list(csv.DictReader(io.StringIO(job['data'].decode('utf-8'))))
+        failed = []
+        successful = []
+        for row in rows:
+            record = {key: self.convert(key, value) for key, value in row.items() if value != ''}
+            if job['operation'] == 'insert':
+                successful.append({'sf__Id': self.insert(table, record), 'sf__Created': 'true', **row})
+                continue
+
+            if job['operation'] == 'update':
+                ok = self.update(table, record)
+            else:
+                ok = self.delete(table, record.get('Id'))
+
+            if ok:
+                successful.append({'sf__Id': record['Id'], 'sf__Created': 'false', **row})
+            else:
+                failed.append({'sf__Id': record.get('Id', ''), 'sf__Error': 'ENTITY_IS_DELETED', **row})
+
+        job['state'] = 'JobComplete'
+        job['processed'] = len(rows)
+        job['failed'] = len(failed)
+        job['failedResults'] = to_csv(failed, ['sf__Id', 'sf__Error'] + list(rows[0].keys() if rows else []))
+        job['successfulResults'] = to_csv(successful, ['sf__Id', 'sf__Created'] + list(rows[0].keys() if rows else []))
+
+    def convert(self, key, value):
+        if key in NUMBER_FIELDS:
+            return float(value)
+        if key in BOOLEAN_FIELDS:
+            return value.lower() == 'true'
+        return value
+
+# query_all record -> Bulk API csv row: dotted relationship columns, text values, '' for null
+def flatten(record, prefix=''):
+    row = {}
+    for key, value in record.items():
+        if key == 'attributes':
+            continue
+        if isinstance(value, dict):
+            row.update(flatten(value, f'{prefix}{key}.'))
+        elif value is None and key.endswith('__r'):
+            continue
+        elif value is None:
+            row[f'{prefix}{key}'] = ''
+        elif isinstance(value, bool):
+            row[f'{prefix}{key}'] = 'true' if value else 'false'
+        else:
+            row[f'{prefix}{key}'] = str(value)
+
+    return row
+
+def to_csv(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import contextlib
+import datetime as dt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import bulk
+import utils
+import metrics
+import governor
+import mirror
+import query_cache
+import sf_add
+import read_entrata_csv
+import get_available_spaces
+from occupancy import get_timeline
+from synthetic import Garage
+from fake_sf import FakeSalesforce
+
+# Times each pipeline stage against FakeSalesforce at several garage sizes
+# Results are saved as JSON in bench/results, compare two runs with --compare
+
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+REPORT_NAME = 'Rentable Items Availability.csv'
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the Entrata to SF pipeline on synthetic data')
+    parser.add_argument('-s', '--scales', type=int, nargs='+', default=[1, 10], help='Garage sizes (1 = 933 spaces)')
+    parser.add_argument('-o', '--output', type=str, required=False, help='Results file (default bench/results/<time>_<commit>.json)')
+    parser.add_argument('-c', '--compare', type=str, required=False, help='Earlier results file to compare against')
+    parser.add_argument('--no-memory', action='store_true', help='Skip peak memory tracking (it slows every stage down)')
+    parser.add_argument('--latency', type=float, default=0, help='Milliseconds each fake API call takes')
+    return parser.parse_args()
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return 'unknown'
+
+# Point every command module at the fake and forget any state from the last scale
+def install(sf):
+    for module in (sf_add, get_available_spaces):
+        module.sf = sf
+
+    utils.download_from_drive = lambda refresh=False: True
+    metrics.install(sf.session)
+    governor.install(sf.session)
+    governor.reset()
+    bulk.POLL_INTERVAL = 0
+    query_cache.clear()
+    reset_mirror()
+
+# Runs a command's main() as if from the command line
+def run_command(module, *argv):
+    saved = sys.argv
+    sys.argv = [module.__name__, *argv]
+    try:
+        return module.main()
+    finally:
+        sys.argv = saved
+
+def reset_mirror():
+    if mirror._conn:
+        mirror._conn.close()
+    mirror._conn = None
+    mirror._records.clear()
+    mirror._fresh.clear()
+
+class Stage():
+    def __init__(self, scale, name, memory=True):
+        self.result = {'scale': scale, 'stage': name}
+        self.memory = memory
+
+    def __enter__(self):
+        if self.memory:
+            tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.result['seconds'] = round(time.perf_counter() - self.start, 4)
+        if self.memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.result['peak_mb'] = round(peak / 1024 / 1024, 2)
+        return False
+
+def run_scale(scale, memory=True, latency=0):
+    results = []
+    workdir = tempfile.mkdtemp(prefix=f'bench_{scale}x_')
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        for folder in ('csvs', 'logs', 'logs/diffs', 'cache'):
+            os.makedirs(folder, exist_ok=True)
+
+        garage = Garage(scale)
+        report = garage.write_report(f'csvs/{dt.date.today():%Y-%m-%d}_{REPORT_NAME}')
+        sf = FakeSalesforce()
+        sf.load(garage.salesforce_records())
+        sf.latency = latency / 1000
+        install(sf)
+
+        def stage(name, fn):
+            calls = sf.calls
+            with Stage(scale, name, memory) as s, contextlib.redirect_stdout(open(os.devnull, 'w')):
+                count = fn()
+            s.result['records'] = count
+            s.result['api_calls'] = sf.calls - calls
+            results.append(s.result)
+            print(f'{scale:>4}x  {name:<32} {s.result["seconds"]:>9.3f}s  {s.result["api_calls"]:>5} calls' +
+                  (f'  {s.result["peak_mb"]:>8.1f} MB' if memory else ''))
+
+        stage('read_csv', lambda: len(read_entrata_csv.read_csv(report)))
+        stage('lease pull (serial)', lambda: len(utils.query_table(sf, 'lease', cache=False)['records']))
+        stage('lease export (bulk query)', lambda: sum(1 for _ in utils.export_table(sf, 'lease')))
+        stage('lease pull (by quarter)', lambda: len(utils.query_table(sf, 'lease', cache=False, partition_by='quarter')['records']))
+        stage('sf_add.main (cold mirror)', lambda: run_command(sf_add, '--full') or len(sf_add.people))
+        reset_mirror()
+        stage('sf_add.main (warm mirror)', lambda: run_command(sf_add, '--full') or len(sf_add.people))
+        stage('sf_add.main (delta, no changes)', lambda: run_command(sf_add) or len(sf_add.people))
+
+        month_end = get_available_spaces.get_date(argparse.Namespace(future=True, date=None))
+        stage('get_open_spaces', lambda: sum(len(v) for v in get_available_spaces.get_open_spaces(month_end).values()))
+
+        def calendar():
+            timeline = get_timeline(sf)
+            return sum(len(timeline.open_spaces(d)) for d in get_available_spaces.get_calendar_dates(month_end))
+        stage('availability calendar', calendar)
+
+        old, new = garage.write_log_pair('logs/added.csv', 'logs/added(1).csv')
+        stage('log_csv_diff', lambda: utils.log_csv_diff(old, new, 'diffs/added') or len(garage.reservations))
+    finally:
+        reset_mirror()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+def compare(results, old_file):
+    with open(old_file, 'r', encoding='utf-8') as f:
+        old = {(r['scale'], r['stage']): r for r in json.load(f)['results']}
+
+    print(f'\nCompared to {old_file}:')
+    for r in results:
+        before = old.get((r['scale'], r['stage']))
+        if not before or not before['seconds']:
+            continue
+        ratio = r['seconds'] / before['seconds']
+        flag = '  <-- slower' if ratio > 1.2 else ''
+        print(f'{r["scale"]:>4}x  {r["stage"]:<32} {before["seconds"]:>9.3f}s -> {r["seconds"]:>9.3f}s ({ratio:.2f}x){flag}')
+
+def main():
+    args = parse_args()
+    results = []
+    for scale in args.scales:
+        results.extend(run_scale(scale, memory=not args.no_memory, latency=args.latency))
+
+    commit = get_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f'{dt.datetime.now():%Y-%m-%d_%H%M%S}_{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'commit': commit,
+            'python': sys.version.split()[0],
+            'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+            'results': results
+        }, f, indent=2)
+    print(f'Results written to {output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import csv
+import random
+import datetime as dt
+
+# Synthetic garage data for the benchmarks
+# Scale 1 is the real garage: 933 spaces, 4 terms a year over 2 years (7464 leases)
+
+SPACES = 933
+TERMS = 8
+TERM_DAYS = 91
+BUILDINGS = ('NU', 'GR', 'KN')
+QUARTERS = 'The Quarters on Campus'
+CONTRACTORS = (QUARTERS, '2215', 'Hardin House', 'Callaway House')
+
+# Same columns as the real "Rentable Items Availability" report (see csvs/example.csv)
+REPORT_HEADER = [
+    'Inventory Name', 'Status', 'Hold Until', 'Pricing - Charge Type', 'Pricing - Charge Timing',
+    'Pricing - Charge Code', 'Pricing - Amount', 'Current Reservation - Reserved By',
+    'Current Reservation - Email', 'Current Reservation - Lease Id', 'Current Reservation - Lease Status',
+    'Current Reservation - Agent', 'Current Reservation - Reservation Dates',
+    'Current Reservation - Available On', 'Current Reservation - Rate', 'Current Reservation - Move Out Date',
+    'Future Reservation - Reserved By', 'Future Reservation - Email', 'Future Reservation - Lease Id',
+    'Future Reservation - Lease Status', 'Future Reservation - Agent',
+    'Future Reservation - Reservation Dates', 'Future Reservation - Rate'
+]
+
+FIRST_NAMES = ('Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn')
+LAST_NAMES = ('Garcia', 'Smith', 'Nguyen', 'Patel', 'Johnson', 'Lee', 'Brown', 'Davis', 'Lopez', 'Kim')
+
+# One reservation on one space, shared by the Entrata report and the Salesforce records
+class Reservation():
+    __slots__ = ('space', 'entrata_id', 'first', 'last', 'email', 'start', 'end', 'rate', 'pass_num')
+
+    def __init__(self, space, entrata_id, first, last, start, end, rate, pass_num):
+        self.space = space
+        self.entrata_id = entrata_id
+        self.first = first
+        self.last = last
+        self.email = f'{first}.{last}{entrata_id}@example.com'.lower()
+        self.start = start
+        self.end = end
+        self.rate = rate
+        self.pass_num = pass_num
+
+    def report_name(self):
+        pass_part = f' #{self.pass_num}' if self.pass_num else ''
+        return f'{self.last}{pass_part}, {self.first} (Building House-{self.entrata_id % 500}-A1)'
+
+    def report_dates(self):
+        return f'{self.start:%m/%d/%Y} - {self.end:%m/%d/%Y}'
+
+# Everything generated for one scale
+class Garage():
+    def __init__(self, scale=1, seed=1, today=None):
+        self.scale = scale
+        self.today = today or dt.date.today()
+        self.random = random.Random(seed)
+        self.spaces = []
+        self.reservations = []
+        self.generate()
+
+    def generate(self):
+        count = SPACES * self.scale
+        # Entrata only shows the current and next reservation, so every other term is history
+        first_start = self.today - dt.timedelta(days=TERM_DAYS * (TERMS - 2) + TERM_DAYS // 2)
+        entrata_id = 100000
+        for n in range(count):
+            contractor = QUARTERS if self.random.random() < 0.7 else self.random.choice(CONTRACTORS[1:])
+            space = {'name': f'G{n:05}', 'building': BUILDINGS[n * len(BUILDINGS) // count], 'contractor': contractor}
+            self.spaces.append(space)
+
+            for term in range(TERMS):
+                # Some terms are never leased
+                if self.random.random() < 0.15:
+                    continue
+
+                start = first_start + dt.timedelta(days=TERM_DAYS * term)
+                end = start + dt.timedelta(days=TERM_DAYS - 1)
+                entrata_id += 1
+                self.reservations.append(Reservation(
+                    space,
+                    entrata_id,
+                    self.random.choice(FIRST_NAMES),
+                    self.random.choice(LAST_NAMES),
+                    start,
+                    end,
+                    self.random.choice((125.0, 150.0, 175.0)),
+                    str(self.random.randint(1000, 9999)) if self.random.random() < 0.5 else ''
+                ))
+
+    # Current and future reservation for each Quarters space, as Entrata reports them
+    def report_rows(self):
+        by_space = {}
+        for r in self.reservations:
+            if r.space['contractor'] == QUARTERS and r.end >= self.today:
+                by_space.setdefault(r.space['name'], []).append(r)
+
+        for space in self.spaces:
+            found = sorted(by_space.get(space['name'], []), key=lambda r: r.start)
+            current = next((r for r in found if r.start <= self.today), None)
+            future = next((r for r in found if r.start > self.today), None)
+            row = dict.fromkeys(REPORT_HEADER, '')
+            row['Inventory Name'] = space['name']
+            row['Status'] = 'Rented' if current else 'Available'
+            if current:
+                row['Current Reservation - Reserved By'] = current.report_name()
+                row['Current Reservation - Email'] = current.email
+                row['Current Reservation - Lease Id'] = current.entrata_id
+                row['Current Reservation - Reservation Dates'] = current.report_dates()
+                row['Current Reservation - Rate'] = f'{current.rate:.2f}'
+            if future:
+                row['Future Reservation - Reserved By'] = future.report_name()
+                row['Future Reservation - Email'] = future.email
+                row['Future Reservation - Lease Id'] = future.entrata_id
+                row['Future Reservation - Reservation Dates'] = future.report_dates()
+                row['Future Reservation - Rate'] = f'{future.rate:.2f}'
+            yield row
+
+    def write_report(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_HEADER)
+            writer.writeheader()
+            writer.writerows(self.report_rows())
+
+        return path
+
+    # Salesforce side of the same garage
+    # drift is the share of Entrata reservations that Salesforce disagrees with
+    # (missing from Salesforce or with a different end date), so sf_add has work to do
+    def salesforce_records(self, drift=0.05):
+        contractors = [{'Name': name} for name in CONTRACTORS]
+        spaces = [
+            {'Name': s['name'], 'Building__c': s['building'], 'Contractor_Name__c': s['contractor']}
+            for s in self.spaces
+        ]
+
+        leases = []
+        for r in self.reservations:
+            roll = self.random.random()
+            quarters = r.space['contractor'] == QUARTERS
+            if quarters and roll < drift / 3:
+                continue
+
+            end = r.end
+            if quarters and roll < drift * 2 / 3:
+                end = end - dt.timedelta(days=30)
+
+            leases.append({
+                'Entrata_Id__c': str(r.entrata_id) if quarters else None,
+                'Email__c': r.email,
+                'Start_Date__c': f'{r.start:%Y-%m-%d}',
+                'End_Date__c': f'{end:%Y-%m-%d}',
+                'Parking_Space__c': r.space['name'],
+                'Lessee_Name__c': f'{r.first} {r.last}',
+                'Monthly_Rate__c': r.rate,
+                'Pool_Quarter__c': None,
+                'Is_Resident__c': True,
+                'Lease_Contract_Owner__c': r.space['contractor'],
+            })
+
+        pool = [
+            {'Lease_ID__c': i, 'TT15_Share__c': 0.1}
+            for i, lease in enumerate(leases) if lease['Entrata_Id__c'] and self.random.random() < 0.05
+        ]
+
+        return {'contractors': contractors, 'spaces': spaces, 'leases': leases, 'pool': pool}
+
+    # Two sf_add log files (added.csv / added(1).csv) that differ by drift
+    def write_log_pair(self, old_path, new_path, drift=0.05):
+        fields = ['Parking_Space__c', 'Entrata_Id__c', 'Start_Date__c', 'End_Date__c',
+                  'Lessee_Name__c', 'Email__c', 'Pass_Number__c', 'Monthly_Rate__c']
+        with open(old_path, 'w', newline='', encoding='utf-8') as f_old, \
+             open(new_path, 'w', newline='', encoding='utf-8') as f_new:
+            old_writer = csv.writer(f_old)
+            new_writer = csv.writer(f_new)
+            old_writer.writerow(fields)
+            new_writer.writerow(fields)
+            for r in self.reservations:
+                row = [r.space['name'], r.entrata_id, f'{r.start:%Y-%m-%d}', f'{r.end:%Y-%m-%d}',
+                       f'{r.first} {r.last}', r.email, r.pass_num, r.rate]
+                roll = self.random.random()
+                if roll >= drift / 2:
+                    old_writer.writerow(row)
+                if roll < drift / 4 or roll >= drift / 2:
+                    new_writer.writerow(row)
+
+        return old_path, new_path
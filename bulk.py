@@ -0,0 +1,379 @@
+import io
+import re
+import csv
+import time
+import itertools
+import codecs
+import metrics
+import governor
+from concurrent.futures import ThreadPoolExecutor
+
+# Bulk API 2.0 ingest jobs, run straight against the REST endpoints
+# Payloads are built in memory, and every job is submitted before any of them is polled,
+# so a run takes as long as its slowest job instead of the sum of all of them
+#
+# Small jobs skip Bulk API and go through sObject Collections, 200 records per call:
+# no queueing or status polls, and results come back with the response
+# Either way a job ends up with the same state, counts and sf__Id/sf__Error result rows
+
+INGEST = 'jobs/ingest/'
+QUERY = 'jobs/query/'
+# Seconds between status checks, backing off up to MAX_POLL_INTERVAL
+POLL_INTERVAL = 2
+MAX_POLL_INTERVAL = 15
+MAX_WORKERS = 4
+TERMINAL_STATES = ('JobComplete', 'Failed', 'Aborted')
+# Rows per query results page, and bytes read from the download at a time
+QUERY_PAGE_SIZE = 50000
+CHUNK_SIZE = 64 * 1024
+# Numbers collections jobs' result files, so jobs with the same name in one run don't overwrite each other
+_collection_runs = itertools.count(1)
+
+BULK = 'bulk'
+COLLECTIONS = 'collections'
+# sObject Collections take at most 200 records per request
+COLLECTION_SIZE = 200
+# Jobs up to this many records use sObject Collections, 5 calls is about what
+# a bulk job's create, upload, close, status and results calls come to
+COLLECTIONS_MAX_RECORDS = 1000
+COLLECTION_METHODS = {'insert': 'POST', 'update': 'PATCH', 'delete': 'DELETE'}
+
+# One ingest job (insert, update or delete) and its outcome
+class BulkJob():
+    def __init__(self, table, operation, records, name=None):
+        self.table = table
+        self.operation = operation
+        self.records = records
+        self.name = name or f'{table} {operation}'
+        # BULK or COLLECTIONS, set by run()
+        self.api = None
+        self.id = None
+        self.state = None
+        self.processed = 0
+        self.failed = 0
+        self.error = None
+        self.failed_records = []
+        self.successful_records = []
+
+    # CSV payload, built in memory
+    def payload(self):
+        fields = list(dict.fromkeys(key for record in self.records for key in record.keys()))
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(self.records)
+        return buffer.getvalue().encode('utf-8')
+
+    def done(self):
+        return self.error is not None or self.state in TERMINAL_STATES
+
+    def ok(self):
+        return self.state == 'JobComplete' and self.failed == 0
+
+    def __str__(self):
+        if self.error:
+            return f'{self.name}: error - {self.error}'
+
+        return f'{self.name} ({self.id or self.api}): {self.state}, {self.processed} processed, {self.failed} failed'
+
+# Combined outcome of the jobs from one run()
+class BulkResult():
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def ok(self):
+        return all(job.ok() for job in self.jobs)
+
+    def __getitem__(self, name):
+        for job in self.jobs:
+            if job.name == name:
+                return job
+
+        raise KeyError(name)
+
+    def __iter__(self):
+        return iter(self.jobs)
+
+    def __str__(self):
+        return '\n'.join(str(job) for job in self.jobs)
+
+# Requests go straight to sf.session, so an expired session (401) is retried once here
+# with a fresh login, like auth.LazySession does for calls made on the session
+def request(sf, method, path, content_type='application/json', **kwargs):
+    governor.check()
+    headers = {**sf.headers, 'Content-Type': content_type}
+    response = sf.session.request(method, f'{sf.base_url}{path}', headers=headers, **kwargs)
+    if response.status_code == 401 and hasattr(sf, 'reconnect'):
+        sf.reconnect()
+        headers = {**sf.headers, 'Content-Type': content_type}
+        response = sf.session.request(method, f'{sf.base_url}{path}', headers=headers, **kwargs)
+
+    response.raise_for_status()
+    return response
+
+def read_results(sf, job, kind):
+    text = request(sf, 'GET', f'{INGEST}{job.id}/{kind}/').text
+    return list(csv.DictReader(io.StringIO(text)))
+
+# Create the job, upload its CSV and mark it ready for processing
+# A job that fails after it was created is aborted, so it doesn't stay Open against the org's open job limit
+def submit(sf, job):
+    try:
+        info = request(sf, 'POST', INGEST, json={
+            'object': job.table,
+            'operation': job.operation,
+            'contentType': 'CSV',
+            'lineEnding': 'LF'
+        }).json()
+        job.id = info['id']
+        job.state = info['state']
+        try:
+            request(sf, 'PUT', f'{INGEST}{job.id}/batches', content_type='text/csv', data=job.payload())
+            request(sf, 'PATCH', f'{INGEST}{job.id}', json={'state': 'UploadComplete'})
+        except Exception:
+            abort(sf, job)
+            raise
+        job.state = 'UploadComplete'
+    except Exception as e:
+        job.error = str(e)
+
+# The original error is what gets reported, so a failed abort is only printed
+def abort(sf, job):
+    try:
+        request(sf, 'PATCH', f'{INGEST}{job.id}', json={'state': 'Aborted'})
+        job.state = 'Aborted'
+    except Exception as e:
+        print(f'Could not abort bulk job {job.id}: {e}')
+
+# Poll every unfinished job in the same loop until all of them are done
+def wait(sf, jobs):
+    interval = POLL_INTERVAL
+    pending = [job for job in jobs if not job.done()]
+    while pending:
+        time.sleep(governor.poll_interval(interval))
+        for job in pending:
+            try:
+                info = request(sf, 'GET', f'{INGEST}{job.id}').json()
+            except Exception as e:
+                job.error = str(e)
+                continue
+
+            job.state = info['state']
+            job.processed = info.get('numberRecordsProcessed', 0)
+            job.failed = info.get('numberRecordsFailed', 0)
+            if job.state == 'Failed':
+                job.error = info.get('errorMessage')
+
+        pending = [job for job in pending if not job.done()]
+        interval = min(interval * 1.5, MAX_POLL_INTERVAL)
+
+def use_collections(job):
+    return job.operation in COLLECTION_METHODS and len(job.records) <= COLLECTIONS_MAX_RECORDS
+
+# Insert, update or delete records through sObject Collections, COLLECTION_SIZE per call
+# Returns a list of {'id', 'success', 'errors'}, in the same order as records
+def write_collection(sf, table, operation, records):
+    results = []
+    for i in range(0, len(records), COLLECTION_SIZE):
+        batch = records[i:i + COLLECTION_SIZE]
+        with metrics.stage('collections'):
+            if operation == 'delete':
+                params = {'ids': ','.join(record['Id'] for record in batch), 'allOrNone': 'false'}
+                results.extend(sf.restful('composite/sobjects', method='DELETE', params=params))
+            else:
+                batch = [{'attributes': {'type': table}, **record} for record in batch]
+                results.extend(sf.restful(
+                    'composite/sobjects',
+                    method=COLLECTION_METHODS[operation],
+                    json={'allOrNone': False, 'records': batch}
+                ))
+
+    return results
+
+# Collections error -> the sf__Error text Bulk API writes, STATUS_CODE:message:fields
+def format_errors(errors):
+    return '; '.join(f"{e.get('statusCode', '')}:{e.get('message', '')}:{','.join(e.get('fields') or [])}" for e in errors)
+
+# Runs a small job through sObject Collections, leaving it as if it were a finished bulk job
+# Successful rows are only kept if save_success, like read_results
+# Blank values are left out, the same as an empty csv cell, and result rows hold the record as its csv row
+def run_collection(sf, job, save_success=False):
+    records = [{key: value for key, value in record.items() if value is not None and value != ''} for record in job.records]
+    try:
+        results = write_collection(sf, job.table, job.operation, records)
+    except Exception as e:
+        job.error = str(e)
+        return
+
+    fields = list(dict.fromkeys(key for record in job.records for key in record.keys()))
+    for record, result in zip(job.records, results):
+        row = {field: '' if record.get(field) is None else str(record[field]) for field in fields}
+        if result['success']:
+            if not save_success:
+                continue
+            created = 'true' if job.operation == 'insert' else 'false'
+            job.successful_records.append({'sf__Id': result['id'], 'sf__Created': created, **row})
+        else:
+            job.failed_records.append({'sf__Id': result.get('id') or '', 'sf__Error': format_errors(result['errors']), **row})
+
+    job.state = 'JobComplete'
+    job.processed = len(results)
+    job.failed = len(job.failed_records)
+
+# Writes failed records to {job_id}_failed.csv (and successes to {job_id}_success.csv if asked)
+# Collections jobs have no id, their files are named after the job, the time and a per-process number
+# ({name}_{YYYYmmdd-HHMMSS}_{n}_failed.csv), so no two jobs share a file
+def collect_results(sf, job, save_success=False):
+    if job.state != 'JobComplete':
+        return
+
+    name = job.id or results_name(job)
+    if job.failed:
+        if job.api == BULK:
+            job.failed_records = read_results(sf, job, 'failedResults')
+        write_results(f'{name}_failed.csv', job.failed_records)
+
+    if save_success:
+        if job.api == BULK:
+            job.successful_records = read_results(sf, job, 'successfulResults')
+        write_results(f'{name}_success.csv', job.successful_records)
+
+def results_name(job):
+    return f"{re.sub(r'[^A-Za-z0-9_-]+', '_', job.name)}_{time.strftime('%Y%m%d-%H%M%S')}_{next(_collection_runs)}"
+
+def write_results(name, rows):
+    if not rows:
+        return
+
+    with open(name, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+# Submit independent jobs concurrently, poll them together and return a BulkResult
+# Jobs of up to COLLECTIONS_MAX_RECORDS records are written through sObject Collections
+# while the bulk jobs are processing
+# Jobs with no records are skipped
+@metrics.timed('bulk')
+def run(sf, jobs, save_success=False):
+    import utils
+    jobs = [job for job in jobs if job.records]
+    if not jobs:
+        return BulkResult([])
+
+    for job in jobs:
+        job.api = COLLECTIONS if use_collections(job) else BULK
+
+    bulk_jobs = [job for job in jobs if job.api == BULK]
+    if bulk_jobs:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(bulk_jobs))) as pool:
+            list(pool.map(lambda job: submit(sf, job), bulk_jobs))
+
+    for job in jobs:
+        if job.api == COLLECTIONS:
+            run_collection(sf, job, save_success=save_success)
+
+    wait(sf, bulk_jobs)
+
+    for job in jobs:
+        collect_results(sf, job, save_success=save_success)
+        utils.invalidate_table(job.table)
+        metrics.count(f'{job.api}_jobs')
+        metrics.count('records_written', len(job.records))
+
+    return BulkResult(jobs)
+
+# Bulk API 2.0 query jobs
+# The result csv is read as it downloads and handed out a row at a time,
+# so a full table export never holds more than one chunk of text in memory
+
+# Start a query job and wait until Salesforce has the results ready, returns the job id
+def start_query(sf, query, include_deleted=False):
+    info = request(sf, 'POST', QUERY, json={
+        'operation': 'queryAll' if include_deleted else 'query',
+        'query': query,
+        'contentType': 'CSV',
+        'lineEnding': 'LF'
+    }).json()
+
+    interval = POLL_INTERVAL
+    while info['state'] not in TERMINAL_STATES:
+        time.sleep(governor.poll_interval(interval))
+        info = request(sf, 'GET', f'{QUERY}{info["id"]}').json()
+        interval = min(interval * 1.5, MAX_POLL_INTERVAL)
+
+    if info['state'] != 'JobComplete':
+        raise RuntimeError(f'Bulk query {info["id"]} {info["state"]}: {info.get("errorMessage")}')
+
+    metrics.count('bulk_queries')
+    return info['id']
+
+# Lines of a streamed response, with their line endings so quoted values can span lines
+def iter_lines(response):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        metrics.count('bulk_query_bytes', len(chunk))
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+# csv row -> the shape query_all returns, paths are the header's columns split on '.'
+# Empty values are null, and Parking_Space__r.Name columns are nested under Parking_Space__r
+# (None if every field of the relationship is empty)
+def parse_row(paths, values):
+    record = {}
+    nested = False
+    for path, value in zip(paths, values):
+        if len(path) == 1:
+            record[path[0]] = value or None
+            continue
+
+        # Nested relationships (Lease_ID__r.Parking_Space__r.Name) nest all the way down
+        nested = True
+        target = record
+        for name in path[:-1]:
+            target = target.setdefault(name, {})
+        target[path[-1]] = value or None
+
+    if nested:
+        prune(record)
+    return record
+
+# Empty relationships -> None, returns whether everything in record is null
+def prune(record):
+    empty = True
+    for key, value in record.items():
+        if isinstance(value, dict) and prune(value):
+            record[key] = value = None
+        if value is not None:
+            empty = False
+
+    return empty
+
+# Every row of a SOQL query, parsed from the result csv as each page downloads
+# Values are text as Salesforce writes them, see tables.record.Record.convert
+def query(sf, query, include_deleted=False, page_size=None):
+    job_id = start_query(sf, query, include_deleted=include_deleted)
+    locator = None
+    while True:
+        params = {'maxRecords': page_size or governor.page_size(QUERY_PAGE_SIZE)}
+        if locator:
+            params['locator'] = locator
+
+        response = request(sf, 'GET', f'{QUERY}{job_id}/results', params=params, stream=True)
+        reader = csv.reader(iter_lines(response))
+        paths = [column.split('.') for column in next(reader, [])]
+        for values in reader:
+            metrics.count('records_read')
+            yield parse_row(paths, values)
+
+        locator = response.headers.get('Sforce-Locator')
+        if not locator or locator == 'null':
+            break
@@ -0,0 +1,162 @@
+import os
+import csv
+import heapq
+import hashlib
+import tempfile
+import itertools
+
+# Streaming field-level diff between two csv files (log rotation, daily Entrata reports)
+# Rows are matched on a composite key and compared by fingerprint, so only rows that
+# actually changed have their fields compared
+# Files are sorted in chunks of CHUNK_ROWS and merged from temp files, so neither file
+# has to fit in memory
+
+CHUNK_ROWS = 100000
+SEPARATOR = '\x1f'
+
+# A space can hold more than one reservation, so the space alone isn't a key
+REPORT_KEY = ('Inventory Name', 'Current Reservation - Lease Id')
+LOG_KEY = ('Entrata_Id__c', 'Parking_Space__c', 'Start_Date__c')
+
+NEW = 'New Entry'
+REMOVED = 'Removed Entry'
+CHANGED = 'Changed Entry'
+
+# Hash of a row's values, equal rows have equal fingerprints
+def fingerprint(values):
+    return hashlib.blake2b(SEPARATOR.join(values).encode('utf-8'), digest_size=16).digest()
+
+# Key columns for a file, based on which known key columns its header has
+# Files without any (e.g. update_failed.csv) are keyed on the whole row
+def get_key_columns(header):
+    for key in (REPORT_KEY, LOG_KEY):
+        found = [col for col in key if col in header]
+        if found:
+            return found
+
+    return list(header)
+
+def read_header(path):
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        return next(csv.reader(f), [])
+
+# Rows as lists of values in the order of fields, missing columns are blank
+def read_rows(path, fields):
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        index = {col: i for i, col in enumerate(next(reader, []))}
+        positions = [index.get(col) for col in fields]
+        for line in reader:
+            if not line:
+                continue
+            yield [line[i] if i is not None and i < len(line) else '' for i in positions]
+
+# Rows sorted by key columns, small files are sorted in memory
+# Bigger ones are sorted a chunk at a time into temp files, then merged
+def sort_rows(rows, key_index, chunk_rows=CHUNK_ROWS):
+    def key(row):
+        return tuple(row[i] for i in key_index)
+
+    with tempfile.TemporaryDirectory(prefix='diff_') as tmp:
+        runs = []
+        while True:
+            chunk = list(itertools.islice(rows, chunk_rows))
+            if not chunk:
+                break
+
+            chunk.sort(key=key)
+            if not runs and len(chunk) < chunk_rows:
+                yield from chunk
+                return
+
+            path = os.path.join(tmp, f'{len(runs)}.csv')
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerows(chunk)
+            runs.append(path)
+
+        files = [open(path, 'r', newline='', encoding='utf-8') for path in runs]
+        try:
+            # Stable across runs, so duplicate keys keep their order in the file
+            yield from heapq.merge(*(csv.reader(f) for f in files), key=key)
+        finally:
+            for f in files:
+                f.close()
+
+# (key, fingerprint, row) for sorted rows
+# Rows with the same key are numbered in file order, so duplicates pair up instead of colliding
+def keyed(rows, key_index):
+    last = None
+    n = 0
+    for row in rows:
+        key = tuple(row[i] for i in key_index)
+        n = n + 1 if key == last else 0
+        last = key
+        yield key + (n,), fingerprint(row), row
+
+def get_changes(fields, old, new):
+    return '; '.join(
+        f'{field}: {old_value} -> {new_value}'
+        for field, old_value, new_value in zip(fields, old, new)
+        if old_value != new_value
+    )
+
+def entry(fields, row, change_type, changed=''):
+    result = dict(zip(fields, row))
+    result['Change_Type'] = change_type
+    result['Changed_Fields'] = changed
+    return result
+
+# Merge join of two keyed, sorted row streams
+def diff_rows(fields, old_rows, new_rows):
+    old = next(old_rows, None)
+    new = next(new_rows, None)
+    while old or new:
+        if new is None or (old is not None and old[0] < new[0]):
+            yield entry(fields, old[2], REMOVED)
+            old = next(old_rows, None)
+        elif old is None or new[0] < old[0]:
+            yield entry(fields, new[2], NEW)
+            new = next(new_rows, None)
+        else:
+            if old[1] != new[1]:
+                yield entry(fields, new[2], CHANGED, get_changes(fields, old[2], new[2]))
+            old = next(old_rows, None)
+            new = next(new_rows, None)
+
+# New, removed and changed rows between two csv files
+# Changed rows have the new values, with the fields that changed in Changed_Fields
+def diff_files(old_file, new_file, key=None, chunk_rows=CHUNK_ROWS):
+    old_header = read_header(old_file)
+    new_header = read_header(new_file)
+    fields = new_header + [col for col in old_header if col not in new_header]
+    if set(old_header) != set(new_header):
+        print(f'{old_file} and {new_file} have different columns, missing columns compare as blank.')
+
+    key_index = [fields.index(col) for col in (key or get_key_columns(new_header))]
+    old_rows = keyed(sort_rows(read_rows(old_file, fields), key_index, chunk_rows), key_index)
+    new_rows = keyed(sort_rows(read_rows(new_file, fields), key_index, chunk_rows), key_index)
+    return diff_rows(fields, old_rows, new_rows)
+
+# Writes changes to path as they come, replacing any earlier diff
+# Nothing is written if there are no changes; returns the count of each change type
+def write_diff(changes, path):
+    counts = {NEW: 0, REMOVED: 0, CHANGED: 0}
+    if os.path.exists(path):
+        os.remove(path)
+
+    f = writer = None
+    try:
+        for change in changes:
+            if not writer:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                f = open(path, 'w', newline='', encoding='utf-8')
+                writer = csv.DictWriter(f, fieldnames=list(change.keys()))
+                writer.writeheader()
+
+            writer.writerow(change)
+            counts[change['Change_Type']] += 1
+    finally:
+        if f:
+            f.close()
+
+    return counts
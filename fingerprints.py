@@ -0,0 +1,60 @@
+import os
+import json
+import diff
+
+# Fingerprint of every reservation in the last Entrata report that sf_add fully processed
+# Keyed by space and reservation slot (current/future), so the next run can find which
+# spaces changed and only reconcile those. Kept from the last successful run rather than
+# yesterday's file, so a missed day is caught up on the next run
+STORE_FILE = 'cache/fingerprints.json'
+
+def get_key(person):
+    return f'{person.parking_space}|{person.slot}'
+
+def get_fingerprint(person):
+    return diff.fingerprint([str(person[col]) for col in person.keys()]).hex()
+
+# Fingerprints for people from read_entrata_csv, a list or the iter_people stream
+# A space listed on more than one line gets a numbered key per reservation
+def get_fingerprints(people):
+    result = {}
+    for person in people:
+        key = get_key(person)
+        n = 1
+        while key in result:
+            key = f'{get_key(person)}#{n}'
+            n += 1
+        result[key] = get_fingerprint(person)
+
+    return result
+
+def space_of(key):
+    return key.split('|')[0]
+
+# Spaces with a reservation added, removed or changed between two sets of fingerprints
+def changed_spaces(old, new):
+    spaces = set()
+    for key in old.keys() | new.keys():
+        if old.get(key) != new.get(key):
+            spaces.add(space_of(key))
+
+    return spaces
+
+# Fingerprints from the last successful run, or None if there hasn't been one
+def load(path=STORE_FILE):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+# Spaces in skip are left out, so they count as changed and are retried next run
+def save(fingerprints, skip=(), path=STORE_FILE):
+    skip = set(skip)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({key: val for key, val in fingerprints.items() if space_of(key) not in skip}, f)
+
+def clear(path=STORE_FILE):
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,5 +1,5 @@
 from auth import sf
-from utils import query_table
+from occupancy import get_timeline
 import argparse
 from datetime import date as dt_date
 from datetime import timedelta
@@ -41,6 +41,13 @@ def parse_args():
         help='Use all buildings'
     )
 
+    parser.add_argument(
+        '-c',
+        '--calendar',
+        action='store_true',
+        help='Print available spaces at the end of each month for a year'
+    )
+
     return parser.parse_args()
 
 # Determine the query date based on args
@@ -69,40 +76,36 @@ def date_of_last_day_of_month(year, month):
         last_day = first_of_next_month - timedelta(days=1)
         return last_day.strftime("%Y-%m-%d")
 
-def query_date(d):
-    where= f"WHERE Start_Date__c <= {d} AND End_Date__c >= {d}"
-    try:
-        results = query_table(sf, 'lease', where)['records']
-    except Exception as e:
-        return set()
-
-    return set((r['Parking_Space__c'] for r in results))
-
 # Returns every available parking space for each building on a given date
-def get_open_spaces(d):
-    leased_spaces = query_date(d)
-    next_lease_date = get_all_leases_after(d)
-    spaces = query_table(sf, 'parking')['records']
-
-    buildings = {'NU':[], 'GR':[], 'KN':[]}
-
-    for space in spaces:
-        if space['Id'] not in leased_spaces:
-            if space['Id'] not in next_lease_date:
-                buildings[space['Building__c']].append((space['Contractor_Name__r']['Name'], space['Name'], "OPEN"))
-            else:
-                buildings[space['Building__c']].append((space['Contractor_Name__r']['Name'], space['Name'],next_lease_date[space['Id']]['Start_Date__c']))
-
-    return buildings
-
-def get_all_leases_after(d):
-    where= f"WHERE Start_Date__c >= {d}"
-    try:
-        results = query_table(sf, 'lease', where)['records']
-    except Exception as e:
-        return {}
-
-    return {r['Parking_Space__c']: r for r in results}
+# Pass a timeline to answer several dates from the same pull
+def get_open_spaces(d, timeline=None):
+    if not timeline:
+        timeline = get_timeline(sf)
+
+    return timeline.open_spaces(d)
+
+# Last day of each month for a year, starting with the month of d
+def get_calendar_dates(d, months=12):
+    year, month, _ = (int(x) for x in d.split('-'))
+    for _ in range(months):
+        yield date_of_last_day_of_month(year, month)
+        month += 1
+        if month > 12:
+            month = 1
+            year += 1
+
+# Available spaces per building at the end of every month for a year
+def print_calendar(d, buildings):
+    timeline = get_timeline(sf)
+
+    print(f'Availability calendar from {d}')
+    print('===================')
+    print('Date        ' + ''.join(f'{b:>6}' for b in buildings) + '  Quarters')
+    for month_end in get_calendar_dates(d):
+        open_spaces = timeline.open_spaces(month_end)
+        counts = [len(open_spaces[b]) for b in buildings]
+        quarters = sum(1 for b in buildings for space in open_spaces[b] if space[0] == 'The Quarters on Campus')
+        print(f'{month_end}  ' + ''.join(f'{c:>6}' for c in counts) + f'{quarters:>10}')
 
 l = {'T':0, '2':1, 'H':2, 'C':3}
 # To sort contractors
@@ -156,14 +159,18 @@ def main():
     args = parse_args()
     date = get_date(args)
 
-    print(f'Available parking spaces for date: {date}')
-    print('===================')
-
     if args.all:
         buildings = ['NU', 'GR', 'KN']
     else:
         buildings = ['KN']
 
+    if args.calendar:
+        print_calendar(date, buildings)
+        return
+
+    print(f'Available parking spaces for date: {date}')
+    print('===================')
+
     tot = 0
     quarters_tot = 0
     for key, val in get_open_spaces(date).items():
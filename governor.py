@@ -0,0 +1,141 @@
+import os
+import re
+import threading
+import metrics
+
+# Keeps commands from using up the org's daily Salesforce API requests
+# Every response carries Sforce-Limit-Info: api-usage=<used>/<limit>, read by a session hook
+# installed next to metrics' in auth.auth, along with the calls this process made per command
+#
+# As the org's remaining requests drop below SF_API_LOW of the limit, callers save calls:
+#   query_cache serves expired results for up to CACHE_GRACE more seconds
+#   partitioned pulls run as one query, without the COUNT() and boundary queries
+#   bulk jobs are polled less often, bulk exports read bigger pages
+# Below SF_API_RESERVE (or past SF_API_COMMAND_BUDGET calls for one command) the next call raises
+# ApiLimitError with a report of where the calls went, leaving the rest of the limit for everything else
+
+NORMAL = 'normal'
+LOW = 'low'
+CRITICAL = 'critical'
+
+# Defaults, override with SF_API_LOW, SF_API_RESERVE and SF_API_COMMAND_BUDGET
+DEFAULT_LOW_SHARE = 0.2
+DEFAULT_RESERVE_SHARE = 0.05
+# Most calls a single command may make, 0 for no cap
+DEFAULT_COMMAND_BUDGET = 0
+CACHE_GRACE = 30 * 60
+# Bulk polls wait this much longer, and bulk export pages are this much bigger, while low
+BACKOFF = 3
+
+# api-usage, not per-app-api-usage, which can come in the same header
+LIMIT_INFO = re.compile(r'(?:^|[\s,])api-usage=(\d+)/(\d+)')
+
+_lock = threading.Lock()
+# Latest org-wide usage from Sforce-Limit-Info, None until the first response
+used = None
+limit = None
+# Calls made by this process per command
+calls = {}
+_warned = False
+_env_loaded = False
+
+class ApiLimitError(RuntimeError):
+    pass
+
+# Settings are read when they're used, so values from .env count even though
+# this module is imported before auth loads it; .env is only read once, check() runs before every call
+def get_setting(name, default):
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+    return os.getenv(name, default)
+
+def get_low_share():
+    return float(get_setting('SF_API_LOW', DEFAULT_LOW_SHARE))
+
+def get_reserve_share():
+    return float(get_setting('SF_API_RESERVE', DEFAULT_RESERVE_SHARE))
+
+def get_command_budget():
+    return int(get_setting('SF_API_COMMAND_BUDGET', DEFAULT_COMMAND_BUDGET))
+
+def on_response(response, *args, **kwargs):
+    global used, limit
+    match = LIMIT_INFO.search(response.headers.get('Sforce-Limit-Info', ''))
+    with _lock:
+        command = metrics.current() or 'other'
+        calls[command] = calls.get(command, 0) + 1
+        if match:
+            used, limit = int(match[1]), int(match[2])
+
+    warn()
+
+def install(session):
+    hooks = session.hooks.setdefault('response', [])
+    if on_response not in hooks:
+        hooks.append(on_response)
+
+def reset():
+    global used, limit, _warned
+    with _lock:
+        used = limit = None
+        calls.clear()
+        _warned = False
+
+def remaining():
+    return None if limit is None else limit - used
+
+def level():
+    if limit is None:
+        return NORMAL
+    if remaining() <= limit * get_reserve_share():
+        return CRITICAL
+    if remaining() <= limit * get_low_share():
+        return LOW
+    return NORMAL
+
+def is_low():
+    return level() != NORMAL
+
+def warn():
+    global _warned
+    if is_low() and not _warned:
+        _warned = True
+        print(f'Salesforce API requests are running low ({remaining()} of {limit} left), saving calls where possible.')
+
+def report(reason):
+    command = metrics.current() or 'other'
+    lines = [
+        f'Stopped {command}: {reason}.',
+        f'Org API usage: {used} of {limit} requests today ({remaining()} left, {int(limit * get_reserve_share())} kept in reserve).'
+        if limit is not None else 'Org API usage: unknown',
+        f'This process made {calls.get(command, 0)} calls in {command}.',
+    ]
+    stages = sorted(metrics.api_calls_by_stage().items(), key=lambda item: -item[1])
+    if stages:
+        lines.append('Calls by stage: ' + ', '.join(f'{name} {count}' for name, count in stages if count))
+
+    return '\n'.join(lines)
+
+# Called before each request, raises once the org is down to its reserve or the command is over budget
+def check():
+    if level() == CRITICAL:
+        raise ApiLimitError(report('the org is down to its reserve of API requests'))
+
+    command = metrics.current() or 'other'
+    budget = get_command_budget()
+    if budget and calls.get(command, 0) >= budget:
+        raise ApiLimitError(report(f'{command} used its budget of {budget} API calls'))
+
+# Seconds an expired query_cache entry can still be served
+def cache_grace():
+    return CACHE_GRACE if is_low() else 0
+
+# Seconds between bulk status checks
+def poll_interval(interval):
+    return interval * BACKOFF if is_low() else interval
+
+def page_size(size):
+    return size * BACKOFF if is_low() else size
@@ -0,0 +1,108 @@
+import bisect
+
+# Sorted lease intervals for a single parking space
+# Dates are inclusive on both ends, any comparable type works (datetime.date, YYYY-MM-DD strings)
+# as long as one index doesn't mix them
+#
+# Build it once from every lease with from_intervals (one sort), then each lookup is a bisect:
+# every interval starting on or before a range's end overlaps it if the latest end among them reaches its start
+class SpaceIntervals():
+    def __init__(self):
+        self.starts = []
+        self.intervals = []
+        # max_end[i] is the latest end date among intervals[:i + 1], max_at[i] the index of the interval it's from
+        self.max_end = []
+        self.max_at = []
+
+    # intervals are (start, end, lease)
+    @classmethod
+    def from_intervals(cls, intervals):
+        space = cls()
+        space.intervals = sorted(intervals, key=lambda interval: interval[0])
+        space.starts = [interval[0] for interval in space.intervals]
+        latest = None
+        at = 0
+        for i, (start, end, lease) in enumerate(space.intervals):
+            if latest is None or end > latest:
+                latest, at = end, i
+            space.max_end.append(latest)
+            space.max_at.append(at)
+
+        return space
+
+    # For the few intervals added after the index is built (rows of the batch being written), O(n) per call
+    def add(self, start, end, lease):
+        i = bisect.bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.intervals.insert(i, (start, end, lease))
+        self.max_end.insert(i, end)
+        self.max_at.insert(i, i)
+        self.rebuild_max(i)
+
+    # Recomputes max_end and max_at from i on, after an insert shifted everything after it
+    def rebuild_max(self, i):
+        for j in range(i, len(self.intervals)):
+            end = self.intervals[j][1]
+            if j and self.max_end[j - 1] >= end:
+                self.max_end[j] = self.max_end[j - 1]
+                self.max_at[j] = self.max_at[j - 1]
+            else:
+                self.max_end[j] = end
+                self.max_at[j] = j
+
+    # Returns the lease of an interval overlapping [start, end], or None
+    # Only intervals starting on or before end can overlap, and of those the one ending last is the one to check
+    def find_overlap(self, start, end):
+        j = bisect.bisect_right(self.starts, end) - 1
+        if j >= 0 and self.max_end[j] >= start:
+            return self.intervals[self.max_at[j]][2]
+
+        return None
+
+    # Returns the lease of the first interval starting on or after d, or None
+    def next_start(self, d):
+        i = bisect.bisect_left(self.starts, d)
+        if i < len(self.intervals):
+            return self.intervals[i][2]
+
+        return None
+
+    def __len__(self):
+        return len(self.intervals)
+
+# Parking space -> SpaceIntervals
+class IntervalIndex():
+    def __init__(self):
+        self.spaces = {}
+
+    # items are (space, start, end, lease), each space's intervals are sorted once
+    @classmethod
+    def from_leases(cls, items):
+        grouped = {}
+        for space, start, end, lease in items:
+            grouped.setdefault(space, []).append((start, end, lease))
+
+        index = cls()
+        index.spaces = {space: SpaceIntervals.from_intervals(intervals) for space, intervals in grouped.items()}
+        return index
+
+    def add(self, space, start, end, lease):
+        if space not in self.spaces:
+            self.spaces[space] = SpaceIntervals()
+
+        self.spaces[space].add(start, end, lease)
+
+    def find_overlap(self, space, start, end):
+        if space not in self.spaces:
+            return None
+
+        return self.spaces[space].find_overlap(start, end)
+
+    def next_start(self, space, d):
+        if space not in self.spaces:
+            return None
+
+        return self.spaces[space].next_start(d)
+
+    def __contains__(self, space):
+        return space in self.spaces
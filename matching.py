@@ -0,0 +1,179 @@
+import re
+import difflib
+from tables.record import parse_date
+
+# Matches Entrata rows to Salesforce leases that have no Entrata_Id__c (contractor leases,
+# leases entered by hand), since there is no key that is unique in both systems
+#
+# Leases are hashed into blocks, and a row is only compared with the leases in its own blocks,
+# so thousands of rows match in linear time instead of row x lease:
+#   (name, email, space, start month)  exact, matched without scoring
+#   (space, start month), (email, start month), (name, start month)  scored near-matches
+# Each row also checks the month before and after its start, so a lease entered
+# a few days off still shares a block with it
+#
+# Names are compared lowercased, without pass numbers, (Resident) or punctuation,
+# with the words sorted, so "Smith #1234, Jane" and "Jane Smith" are the same name
+
+# Points a scored pair needs to be matched, out of NAME + EMAIL + SPACE + START + END (11)
+MATCH_SCORE = 6
+NAME = 3
+EMAIL = 3
+# Two different emails count against a match, so a common name on the same dates isn't enough
+EMAIL_MISMATCH = -1.5
+SPACE = 2
+START = 2
+END = 1
+# Names less alike than this (difflib ratio) score nothing
+NAME_RATIO = 0.8
+# START points fall off to nothing this many days apart
+START_DAYS = 31
+# Blocks bigger than this are too common to tell leases apart (a shared office email, a blank name)
+MAX_BLOCK = 50
+
+EXACT = 'exact'
+SCORED = 'scored'
+
+def normalize_name(name):
+    if not name:
+        return ''
+    name = re.sub(r'\(.*?\)|#\S*', ' ', name.lower())
+    return ' '.join(sorted(re.findall(r'[a-z]+', name)))
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+# Months since year 0, so the months either side of a date are one apart
+def get_bucket(d):
+    return d.year * 12 + d.month - 1 if d else None
+
+# Normalized (name, email, space, start) of an Entrata row or a Salesforce lease
+def person_key(person):
+    return normalize_name(person.name), normalize_email(person.email), person.parking_space, parse_date(person.start)
+
+def lease_key(lease):
+    return normalize_name(lease.person), normalize_email(lease.email), lease.parking_space, lease.start
+
+def score(person, lease):
+    name, email, space, start = person_key(person)
+    lease_name, lease_email, lease_space, lease_start = lease_key(lease)
+
+    points = 0.0
+    if name and lease_name:
+        ratio = 1.0 if name == lease_name else difflib.SequenceMatcher(None, name, lease_name).ratio()
+        if ratio >= NAME_RATIO:
+            points += NAME * ratio
+    if email and lease_email:
+        points += EMAIL if email == lease_email else EMAIL_MISMATCH
+    if space == lease_space:
+        points += SPACE
+    if start and lease_start:
+        days = abs((start - lease_start).days)
+        points += START * max(0, 1 - days / START_DAYS)
+    if lease.end and parse_date(person.end) == lease.end:
+        points += END
+
+    return round(points, 2)
+
+# One Entrata row paired with the keyless lease it matched
+class Match():
+    def __init__(self, person, lease, score, how):
+        self.person = person
+        self.lease = lease
+        self.score = score
+        self.how = how
+
+    def to_row(self):
+        return {
+            'Entrata_Id__c': self.person.e_id,
+            'Lessee_Name__c': self.person.name,
+            'Email__c': self.person.email,
+            'Parking_Space__c': self.person.parking_space,
+            'Start_Date__c': self.person.start,
+            'End_Date__c': self.person.end,
+            'Lease Id': self.lease.id,
+            'Lease Name': self.lease.person,
+            'Lease Email': self.lease.email,
+            'Lease Space': self.lease.parking_space,
+            'Lease Start': str(self.lease.start),
+            'Lease End': str(self.lease.end),
+            'Score': self.score,
+            'Match': self.how,
+        }
+
+class KeylessIndex():
+    def __init__(self, leases):
+        self.exact = {}
+        self.blocks = {}
+        for lease in leases:
+            if lease.entrata_id or not lease.start:
+                continue
+
+            name, email, space, start = lease_key(lease)
+            bucket = get_bucket(start)
+            self.exact.setdefault((name, email, space, bucket), []).append(lease)
+            for key in self.block_keys(name, email, space, bucket):
+                self.blocks.setdefault(key, []).append(lease)
+
+    # Blank names and emails don't say anything, so they aren't blocked on
+    def block_keys(self, name, email, space, bucket):
+        keys = [('space', space, bucket)]
+        if email:
+            keys.append(('email', email, bucket))
+        if name:
+            keys.append(('name', name, bucket))
+        return keys
+
+    # Keyless leases sharing a block with the row, each once
+    def candidates(self, person):
+        name, email, space, start = person_key(person)
+        bucket = get_bucket(start)
+        if bucket is None:
+            return []
+
+        seen = {}
+        for b in (bucket - 1, bucket, bucket + 1):
+            for key in self.block_keys(name, email, space, b):
+                block = self.blocks.get(key, ())
+                if len(block) > MAX_BLOCK:
+                    continue
+                for lease in block:
+                    seen[lease.id] = lease
+
+        return list(seen.values())
+
+    # Pairs rows with keyless leases, each lease is matched at most once
+    # Exact matches are taken first, then scored pairs from the highest score down
+    # Returns (matches, rows that matched nothing)
+    def match(self, people):
+        matches = []
+        used = set()
+        unmatched = []
+        for person in people:
+            name, email, space, start = person_key(person)
+            leases = [l for l in self.exact.get((name, email, space, get_bucket(start)), ()) if l.id not in used]
+            if name and email and leases:
+                lease = min(leases, key=lambda l: abs((l.start - start).days))
+                used.add(lease.id)
+                matches.append(Match(person, lease, score(person, lease), EXACT))
+            else:
+                unmatched.append(person)
+
+        pairs = []
+        for i, person in enumerate(unmatched):
+            for lease in self.candidates(person):
+                if lease.id in used:
+                    continue
+                points = score(person, lease)
+                if points >= MATCH_SCORE:
+                    pairs.append((points, i, lease))
+
+        matched = set()
+        for points, i, lease in sorted(pairs, key=lambda p: -p[0]):
+            if i in matched or lease.id in used:
+                continue
+            matched.add(i)
+            used.add(lease.id)
+            matches.append(Match(unmatched[i], lease, points, SCORED))
+
+        return matches, [person for i, person in enumerate(unmatched) if i not in matched]
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import threading
+import functools
+import contextlib
+import datetime as dt
+
+# Per-stage timing, API call and payload counts for a single command run
+# Written as logs/run_report_<command>.json and logs/metrics_<command>.prom (OpenMetrics),
+# so cron monitoring can alert on slow runs and API usage growth
+#
+# Usage:
+#   @metrics.command('sf_add')
+#   def main(): ...
+#       with metrics.stage('parse'): ...
+
+# Override with METRICS_DIR
+DEFAULT_METRICS_DIR = 'logs'
+PREFIX = 'entrata_sf'
+
+_lock = threading.Lock()
+_run = None
+
+class Run():
+    def __init__(self, name):
+        self.name = name
+        self.started = dt.datetime.now()
+        self.start = time.perf_counter()
+        self.seconds = 0
+        self.status = 'running'
+        # Stage names in the order they were first entered
+        self.stages = {}
+        self.stack = []
+        self.stage('total')
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {
+                'seconds': 0.0,
+                'api_calls': 0,
+                'bytes_sent': 0,
+                'bytes_received': 0,
+                'counters': {}
+            }
+
+        return self.stages[name]
+
+    # Stages a call or count is attributed to: everything on the stack, plus the total
+    def active(self):
+        return set(self.stack) | {'total'}
+
+# Count something (rows read, jobs submitted, ...) against the running stages
+def count(name, n=1):
+    if not _run:
+        return
+
+    with _lock:
+        for stage_name in _run.active():
+            counters = _run.stage(stage_name)['counters']
+            counters[name] = counters.get(name, 0) + n
+
+# Record one HTTP round trip against the running stages
+def record_call(sent=0, received=0):
+    if not _run:
+        return
+
+    with _lock:
+        for stage_name in _run.active():
+            stage = _run.stage(stage_name)
+            stage['api_calls'] += 1
+            stage['bytes_sent'] += sent
+            stage['bytes_received'] += received
+
+# Streamed responses (bulk query results) are only sized from Content-Length,
+# reading the body here would pull the whole download into memory
+def response_size(response, stream=False):
+    length = response.headers.get('Content-Length')
+    if length:
+        return int(length)
+    if stream:
+        return 0
+
+    return len(response.content or b'')
+
+# requests response hook, counts every call made through the Salesforce session
+def on_response(response, *args, **kwargs):
+    body = response.request.body if response.request is not None else None
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    record_call(sent=len(body or b''), received=response_size(response, kwargs.get('stream', False)))
+
+# Name of the command running, or None
+def current():
+    return _run.name if _run else None
+
+# API calls made so far in each stage of the running command
+def api_calls_by_stage():
+    if not _run:
+        return {}
+
+    with _lock:
+        return {name: values['api_calls'] for name, values in _run.stages.items() if name != 'total'}
+
+def install(session):
+    hooks = session.hooks.setdefault('response', [])
+    if on_response not in hooks:
+        hooks.append(on_response)
+
+# Time a block as a named stage, stages can be nested
+# Stages entered from worker threads add up their time, so they can exceed wall clock time
+@contextlib.contextmanager
+def stage(name):
+    if not _run:
+        yield
+        return
+
+    with _lock:
+        _run.stage(name)
+        _run.stack.append(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _run.stack.remove(name)
+            _run.stages[name]['seconds'] += elapsed
+
+# Decorator version of stage()
+def timed(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Wraps a command's main(), writing the report when it returns or raises
+# Nested commands (e.g. one main() calling another) report under the outer one
+def command(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            global _run
+            if _run:
+                with stage(name):
+                    return fn(*args, **kwargs)
+
+            _run = Run(name)
+            try:
+                result = fn(*args, **kwargs)
+                _run.status = 'ok'
+                return result
+            except SystemExit:
+                # --help and argument errors aren't runs worth reporting
+                _run = None
+                raise
+            except BaseException:
+                _run.status = 'error'
+                raise
+            finally:
+                finish()
+        return wrapper
+    return decorator
+
+def report():
+    _run.seconds = time.perf_counter() - _run.start
+    _run.stages['total']['seconds'] = _run.seconds
+    return {
+        'command': _run.name,
+        'started': _run.started.isoformat(timespec='seconds'),
+        'seconds': round(_run.seconds, 4),
+        'status': _run.status,
+        'stages': [
+            {'stage': name, **values, 'seconds': round(values['seconds'], 4)}
+            for name, values in _run.stages.items()
+        ]
+    }
+
+def openmetrics(data):
+    command = data['command']
+    lines = []
+
+    def metric(name, help_text, values):
+        lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}_{name} gauge')
+        for labels, value in values:
+            label_text = ','.join(f'{key}="{val}"' for key, val in {'command': command, **labels}.items())
+            lines.append(f'{PREFIX}_{name}{{{label_text}}} {value}')
+
+    stages = data['stages']
+    metric('run_seconds', 'Wall clock time of the last run.', [({}, data['seconds'])])
+    metric('run_success', '1 if the last run finished without an error.', [({}, int(data['status'] == 'ok'))])
+    metric('run_timestamp_seconds', 'Start time of the last run.',
+           [({}, int(dt.datetime.fromisoformat(data['started']).timestamp()))])
+    metric('stage_seconds', 'Time spent in each stage.', [({'stage': s['stage']}, s['seconds']) for s in stages])
+    metric('stage_api_calls', 'Salesforce API calls made in each stage.', [({'stage': s['stage']}, s['api_calls']) for s in stages])
+    metric('stage_bytes_sent', 'Request bytes sent to Salesforce in each stage.', [({'stage': s['stage']}, s['bytes_sent']) for s in stages])
+    metric('stage_bytes_received', 'Response bytes received from Salesforce in each stage.', [({'stage': s['stage']}, s['bytes_received']) for s in stages])
+    metric('stage_count', 'Rows and jobs counted in each stage.', [
+        ({'stage': s['stage'], 'name': name}, value)
+        for s in stages for name, value in s['counters'].items()
+    ])
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+# Read when the run finishes, so a METRICS_DIR in .env counts even if the command never logged in
+def get_metrics_dir():
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.getenv('METRICS_DIR', DEFAULT_METRICS_DIR)
+
+def finish(directory=None):
+    global _run
+    if not _run:
+        return None
+
+    data = report()
+    directory = directory or get_metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    report_file = os.path.join(directory, f'run_report_{data["command"]}.json')
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+
+    with open(os.path.join(directory, f'metrics_{data["command"]}.prom'), 'w', encoding='utf-8') as f:
+        f.write(openmetrics(data))
+
+    _run = None
+    return report_file
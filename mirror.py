@@ -0,0 +1,182 @@
+import os
+import json
+import sqlite3
+import argparse
+import datetime as dt
+import soql
+import utils
+
+# Local copy of the Salesforce tables that every command reads
+# Refreshed incrementally on SystemModstamp, so a warm run only pulls changed rows
+MIRROR_FILE = 'cache/mirror.db'
+
+# Keys of utils.tables that are kept in the mirror
+mirrored = ('lease', 'parking', 'contractor')
+
+# Deleted rows can only be seen through queryAll while they are in the recycle bin (15 days)
+# If the last refresh is older than this, do a full pull so nothing deleted is missed
+max_refresh_age = dt.timedelta(days=14)
+
+# Lease rows carry Parking_Space__r / Lease_Contract_Owner__r names,
+# which don't bump the lease's SystemModstamp when the parent changes
+dependents = {
+    'parking': 'lease',
+    'contractor': 'lease',
+}
+
+# Full pulls of the big tables are split into ranges fetched concurrently (see partition.py)
+partitions = {
+    'lease': 'quarter',
+    'parking': 'building',
+}
+
+_conn = None
+# Decoded records per table, kept for the life of the process
+_records = {}
+# Tables already refreshed by this process, cleared by invalidate() after a write
+_fresh = set()
+
+def connect(path=MIRROR_FILE):
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _conn = sqlite3.connect(path)
+        _conn.execute('CREATE TABLE IF NOT EXISTS records (tbl TEXT, id TEXT, data TEXT, PRIMARY KEY (tbl, id))')
+        _conn.execute('CREATE TABLE IF NOT EXISTS watermarks (tbl TEXT PRIMARY KEY, modstamp TEXT, refreshed TEXT)')
+    return _conn
+
+# 2025-10-17T06:00:00.000+0000 -> datetime, written as 2025-10-17T06:00:00Z in SOQL
+def parse_modstamp(modstamp):
+    return dt.datetime.strptime(modstamp, '%Y-%m-%dT%H:%M:%S.%f%z')
+
+def get_watermark(table):
+    row = connect().execute('SELECT modstamp, refreshed FROM watermarks WHERE tbl = ?', (table,)).fetchone()
+    if not row or not row[0]:
+        return None
+
+    refreshed = dt.datetime.fromisoformat(row[1])
+    if dt.datetime.now(dt.timezone.utc) - refreshed > max_refresh_age:
+        return None
+
+    return row[0]
+
+def set_watermark(table, modstamp):
+    connect().execute(
+        'INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)',
+        (table, modstamp, dt.datetime.now(dt.timezone.utc).isoformat())
+    )
+
+def clear_watermark(table):
+    connect().execute('DELETE FROM watermarks WHERE tbl = ?', (table,))
+
+# Typed record class for a table (tables.lease.Lease, ...)
+def get_type(table):
+    return utils.tables[table]['object']
+
+# Rows are stored as query_all JSON and kept in memory as typed records
+def load(table):
+    if table not in _records:
+        rows = connect().execute('SELECT data FROM records WHERE tbl = ?', (table,))
+        record_type = get_type(table)
+        _records[table] = {}
+        for (data,) in rows:
+            record = record_type(json.loads(data))
+            _records[table][record.id] = record
+
+    return _records[table]
+
+# Pull rows changed since the watermark (or everything on a cold/full refresh)
+# bulk rebuilds from a Bulk API export, streamed into the mirror as it downloads
+# Returns the number of rows that changed
+# Always goes to Salesforce, never the query cache
+def refresh(sf, table, full=False, bulk=False):
+    conn = connect()
+    watermark = None if full or bulk else get_watermark(table)
+    cols = f"{utils.tables[table]['columns']}, SystemModstamp, IsDeleted"
+
+    if watermark:
+        where = soql.ge('SystemModstamp', parse_modstamp(watermark))
+        rows = utils.query_table(sf, table, where, cols=cols, order_by='SystemModstamp', cache=False, include_deleted=True)['records']
+    elif bulk:
+        rows = utils.export_table(sf, table, cols=f"{utils.tables[table]['columns']}, SystemModstamp", raw=True)
+    else:
+        rows = utils.query_table(sf, table, cols=cols, cache=False, partition_by=partitions.get(table))['records']
+
+    records = load(table)
+    if not watermark:
+        records.clear()
+        conn.execute('DELETE FROM records WHERE tbl = ?', (table,))
+
+    # The watermark is truncated to seconds, so rows at the watermark come back again
+    latest = watermark
+    changed = 0
+    try:
+        for record in rows:
+            record.pop('attributes', None)
+            if not latest or record['SystemModstamp'] > latest:
+                latest = record['SystemModstamp']
+            if not watermark or record['SystemModstamp'] > watermark:
+                changed += 1
+
+            if record.get('IsDeleted'):
+                records.pop(record['Id'], None)
+                conn.execute('DELETE FROM records WHERE tbl = ? AND id = ?', (table, record['Id']))
+                continue
+
+            records[record['Id']] = get_type(table)(record)
+            conn.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?)', (table, record['Id'], json.dumps(record)))
+    except Exception:
+        # A half-read export would look like every row after it was deleted, so keep the mirror as it was
+        conn.rollback()
+        _records.pop(table, None)
+        raise
+
+    if watermark and changed and table in dependents:
+        clear_watermark(dependents[table])
+        _fresh.discard(dependents[table])
+
+    set_watermark(table, latest)
+    conn.commit()
+    _fresh.add(table)
+    return changed
+
+# Records from the mirror, filtered by an optional predicate on each record
+# (a soql predicate, or any function of the record)
+# Records are typed (tables.lease.Lease, ...), returned in the same shape as sf.query_all
+# so callers can keep using ['records']
+def select(sf, table, where=None):
+    if table not in _fresh:
+        # Parents first, so a renamed space or contractor is picked up by the lease refresh
+        for parent, child in dependents.items():
+            if child == table and parent not in _fresh:
+                refresh(sf, parent)
+        refresh(sf, table)
+
+    records = [r for r in load(table).values() if where is None or where(r)]
+    return {'totalSize': len(records), 'done': True, 'records': records}
+
+# Mark a table as stale after a write, so the next select pulls the changes
+# Accepts either a utils.tables key or the Salesforce object name
+def invalidate(table):
+    for key, value in utils.tables.items():
+        if table in (key, value['name']):
+            _fresh.discard(key)
+
+# Mark every table stale, so a long-running process picks up other writers' changes on the next select
+# The decoded records stay in memory, so that select only pulls what changed
+def expire():
+    _fresh.clear()
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh the local Salesforce mirror')
+    parser.add_argument('-f', '--full', action='store_true', help='Rebuild from a full pull')
+    parser.add_argument('-b', '--bulk', action='store_true', help='Rebuild from a Bulk API export (for large backfills)')
+    args = parser.parse_args()
+
+    from auth import sf
+    for table in mirrored:
+        pulled = refresh(sf, table, full=args.full, bulk=args.bulk)
+        print(f'{utils.tables[table]["name"]}: {pulled} changed, {len(load(table))} in mirror')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import datetime as dt
+import mirror
+from intervals import IntervalIndex
+from tables.record import parse_date
+
+# Every lease on every parking space, built from one pull of the mirror
+# Answers "is this space leased on D" and "when does the next lease start" for any date
+# Dates can be given as YYYY-MM-DD or datetime.date
+class OccupancyTimeline():
+    def __init__(self, leases, spaces):
+        self.spaces = spaces
+        self.index = IntervalIndex.from_leases(
+            (lease.parking_space_ref, lease.start, lease.end, lease) for lease in leases if lease.start and lease.end
+        )
+
+    # Used to reserve spaces that are assigned before they exist in Salesforce
+    def add(self, space_id, start, end, lease):
+        self.index.add(space_id, parse_date(start), parse_date(end), lease)
+
+    def is_leased(self, space_id, d):
+        d = parse_date(d)
+        return self.index.find_overlap(space_id, d, d) is not None
+
+    # No lease on the space overlaps start through end (or anything from start on, without an end)
+    def is_free(self, space_id, start, end=None):
+        end = parse_date(end) if end else dt.date.max
+        return self.index.find_overlap(space_id, parse_date(start), end) is None
+
+    # Nearest lease starting on or after d
+    def next_lease(self, space_id, d):
+        return self.index.next_start(space_id, parse_date(d))
+
+    # Space Ids leased on d
+    def leased_on(self, d):
+        return set(space.id for space in self.spaces if self.is_leased(space.id, d))
+
+    # Returns every available parking space for each building on a given date
+    # (contractor, space name, 'OPEN' or the start date of the next lease)
+    def open_spaces(self, d):
+        buildings = {'NU':[], 'GR':[], 'KN':[]}
+        d = parse_date(d)
+
+        for space in self.spaces:
+            if self.is_leased(space.id, d):
+                continue
+
+            next_lease = self.next_lease(space.id, d)
+            if not next_lease:
+                buildings[space.building].append((space.contractor, space.name, "OPEN"))
+            else:
+                buildings[space.building].append((space.contractor, space.name, next_lease['Start_Date__c']))
+
+        return buildings
+
+def get_timeline(sf):
+    leases = mirror.select(sf, 'lease')['records']
+    spaces = mirror.select(sf, 'parking')['records']
+    return OccupancyTimeline(leases, spaces)
@@ -0,0 +1,186 @@
+import math
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+import soql
+import metrics
+import governor
+
+# Partitioned fetch for utils.query_table
+# query_all follows nextRecordsUrl one page at a time, so a big pull is one long chain of round trips
+# Splitting the query into disjoint ranges and fetching them on a small pool runs several chains at once
+#
+# Usage:
+#   utils.query_table(sf, 'lease', where, partition_by='quarter')  # Start_Date__c quarters
+#   utils.query_table(sf, 'lease', partition_by='building')       # one range per building
+#   utils.query_table(sf, 'pool', partition_by='id')              # Id ranges
+#
+# Every partition set covers the whole query: the first and last ranges are open-ended and
+# nulls get a range of their own, so rows written after the bounds were read are still returned
+
+# Rows per query_all page
+PAGE_SIZE = 2000
+MAX_WORKERS = 4
+# Most Id ranges to split a query into
+MAX_ID_PARTITIONS = 8
+
+# Field each kind of partition splits on, per utils.tables key
+fields = {
+    'quarter': {
+        'lease': 'Start_Date__c',
+        'pool': 'Lease_ID__r.Start_Date__c',
+    },
+    'building': {
+        'parking': 'Building__c',
+        'lease': 'Parking_Space__r.Building__c',
+        'pool': 'Lease_ID__r.Parking_Space__r.Building__c',
+    },
+}
+
+# Salesforce Ids are base 62 in ASCII order, so they compare as plain strings
+ID_DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+# 18 character Ids end in a case checksum, ranges only use the 15 character Id
+ID_LENGTH = 15
+
+def get_field(table, kind):
+    if kind == 'id':
+        return 'Id'
+
+    if table not in fields.get(kind, {}):
+        raise ValueError(f'No {kind} partition field for {table}')
+    return fields[kind][table]
+
+def quarter_start(d):
+    return dt.date(d.year, 3 * ((d.month - 1) // 3) + 1, 1)
+
+def next_quarter(d):
+    return dt.date(d.year + 1, 1, 1) if d.month > 9 else dt.date(d.year, d.month + 3, 1)
+
+# Ranges between consecutive bounds, open on both ends
+def ranges(field, bounds):
+    parts = [soql.lt(field, bounds[0])]
+    for low, high in zip(bounds, bounds[1:]):
+        parts.append(soql.and_(soql.ge(field, low), soql.lt(field, high)))
+    parts.append(soql.ge(field, bounds[-1]))
+    return parts
+
+# One range per calendar quarter between the earliest and latest date, plus one for no date
+def by_quarter(sf, table, field, where):
+    import utils
+    # FIRST and LAST are reserved words in SOQL, so they can't be aliases
+    aggregates = {'min_start': f'MIN({field})', 'max_start': f'MAX({field})'}
+    row = utils.aggregate_table(sf, table, aggregates, where)[0]
+    if not row['min_start']:
+        return [soql.eq(field, None)]
+
+    bounds = []
+    quarter = next_quarter(quarter_start(dt.date.fromisoformat(row['min_start'][:10])))
+    last = dt.date.fromisoformat(row['max_start'][:10])
+    while quarter <= last:
+        bounds.append(quarter)
+        quarter = next_quarter(quarter)
+
+    parts = ranges(field, bounds) if bounds else [soql.ne(field, None)]
+    return parts + [soql.eq(field, None)]
+
+# One range per building on the garage, plus one for anything else (including no building)
+def by_building(sf, table, field, where):
+    import utils
+    rows = utils.aggregate_table(sf, 'parking', {}, group_by='Building__c')
+    buildings = sorted(row['Building__c'] for row in rows if row['Building__c'])
+    if not buildings:
+        return [None]
+    return [soql.eq(field, building) for building in buildings] + [soql.not_in(field, buildings)]
+
+def id_to_number(record_id):
+    number = 0
+    for c in record_id[:ID_LENGTH].ljust(ID_LENGTH, '0'):
+        number = number * 62 + ID_DIGITS.index(c)
+    return number
+
+def number_to_id(number):
+    digits = []
+    for _ in range(ID_LENGTH):
+        number, digit = divmod(number, 62)
+        digits.append(ID_DIGITS[digit])
+    return ''.join(reversed(digits))
+
+# Evenly spaced Id ranges between the lowest and highest Id, about a page or more each
+def by_id(sf, table, field, where, total):
+    import utils
+    name = utils.tables[table]['name']
+    low = utils.run_query(sf, soql.build(name, 'Id', where, order_by='Id', limit=1))['records']
+    high = utils.run_query(sf, soql.build(name, 'Id', where, order_by='Id DESC', limit=1))['records']
+    if not low:
+        return [None]
+
+    low, high = id_to_number(low[0]['Id']), id_to_number(high[0]['Id'])
+    count = min(MAX_ID_PARTITIONS, math.ceil(total / PAGE_SIZE))
+    step = (high - low) // count
+    if not step:
+        return [None]
+
+    bounds = [number_to_id(low + step * n) for n in range(1, count)]
+    return ranges(field, bounds)
+
+# Predicates that split where into disjoint ranges covering all of it
+def get_partitions(sf, table, kind, where, total):
+    field = get_field(table, kind)
+    if kind == 'quarter':
+        parts = by_quarter(sf, table, field, where)
+    elif kind == 'building':
+        parts = by_building(sf, table, field, where)
+    elif kind == 'id':
+        parts = by_id(sf, table, field, where, total)
+    else:
+        raise ValueError(f'Unknown partition {kind}')
+
+    return [soql.and_(where, part) for part in parts]
+
+# SOQL sorts nulls first ascending and last descending
+def sort_key(field):
+    def key(record):
+        value = soql.get_value(record, field)
+        return (value is not None, value)
+    return key
+
+# Sorted one key at a time from the last, which is the same as sorting on all of them at once
+def sort_records(records, order_by):
+    for col in reversed(soql.columns(order_by).split(',')):
+        field, *direction = col.split()
+        descending = bool(direction) and direction[0].upper() == 'DESC'
+        records.sort(key=sort_key(field), reverse=descending)
+
+    return records
+
+# query_table split into partitions and fetched concurrently
+# Falls back to a single query when the whole result fits on one page
+# Results are merged in partition order (then order_by), so the same data always comes back in the same order
+@metrics.timed('partitioned query')
+def query(sf, table, kind, where=None, cols=None, order_by=None, cache=True, workers=MAX_WORKERS, **kwargs):
+    import utils
+    if isinstance(where, str):
+        raise ValueError('Partitioned queries need a soql predicate, not a WHERE string')
+
+    # Low on API requests: one paged query costs fewer calls than the COUNT(), boundaries and partitions
+    if governor.is_low():
+        return utils.query_table(sf, table, where, cols=cols, order_by=order_by, cache=cache, **kwargs)
+
+    # Also logs a lazy session in before any worker threads use it
+    total = utils.count_table(sf, table, where, cache=cache, **kwargs)
+    if total <= PAGE_SIZE:
+        return utils.query_table(sf, table, where, cols=cols, order_by=order_by, cache=cache, **kwargs)
+
+    parts = get_partitions(sf, table, kind, where, total)
+    metrics.count('query_partitions', len(parts))
+
+    # requests sessions can be shared between threads for plain requests like these
+    def fetch(part):
+        return utils.query_table(sf, table, part, cols=cols, order_by=order_by, cache=cache, **kwargs)['records']
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(parts)))) as pool:
+        records = [record for page in pool.map(fetch, parts) for record in page]
+
+    if order_by:
+        sort_records(records, order_by)
+
+    return {'totalSize': len(records), 'done': True, 'records': records}
@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Process-wide cache of query_all results, under utils.query_table
+# Keyed on the normalized SOQL, so the same query written differently shares an entry
+# Entries expire after a per-object TTL, the least recently used are evicted past MAX_ENTRIES,
+# and writes through utils (bulk jobs, collections) drop every entry for the written object
+#
+# Set SOQL_CACHE_FILE (e.g. cache/soql.db) to also keep entries on disk between runs
+# Other processes' writes aren't seen on disk until the TTL runs out, so keep TTLs short
+
+MAX_ENTRIES = 256
+DEFAULT_TTL = 60
+
+# Seconds to keep results for each object, 0 never caches it
+ttls = {
+    'Parking_Space__c': 24 * 60 * 60,
+    'Contractor__c': 24 * 60 * 60,
+    'Leases__c': 5 * 60,
+    'Pooled_Lease__c': 10 * 60,
+    # Read once and deleted by the same command
+    'Task': 0,
+    'Applicant__c': 0,
+}
+
+# Queries on these objects also read the objects listed (Lease_Id__r.Start_Date__c, Parking_Space__r.Name, ...)
+# so a write to the key makes their results stale too
+dependents = {
+    'Leases__c': ('Pooled_Lease__c',),
+    'Parking_Space__c': ('Leases__c',),
+    'Contractor__c': ('Leases__c', 'Parking_Space__c'),
+}
+
+FROM = re.compile(r'\bFROM\s+(\w+)', re.IGNORECASE)
+# Quoted literals keep their case, everything else in SOQL is case-insensitive
+TOKENS = re.compile(r"'(?:\\.|[^'\\])*'|[^']+")
+
+_lock = threading.Lock()
+# key -> (object, expires, result json), in least to most recently used order
+_entries = OrderedDict()
+_conn = None
+
+def get_ttl(obj):
+    return ttls.get(obj, DEFAULT_TTL)
+
+def get_object(query):
+    match = FROM.search(query)
+    return match[1] if match else None
+
+# Whitespace collapsed and lowercased outside string literals, plus any query_all options
+def normalize(query, **kwargs):
+    parts = []
+    for token in TOKENS.findall(query):
+        parts.append(token if token.startswith("'") else re.sub(r'\s+', ' ', token).lower())
+
+    key = ''.join(parts).strip()
+    if kwargs:
+        key += ' ' + json.dumps(kwargs, sort_keys=True)
+    return key
+
+def connect():
+    global _conn
+    path = os.getenv('SOQL_CACHE_FILE')
+    if not path:
+        return None
+
+    if _conn is None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        _conn = sqlite3.connect(path, check_same_thread=False)
+        _conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, object TEXT, expires REAL, data TEXT)')
+    return _conn
+
+# Cached result for a query, or None if there isn't a live one
+# grace serves entries that expired up to that many seconds ago (see governor.py)
+# Each hit is a fresh copy, so callers can change records freely
+def get(query, grace=0, **kwargs):
+    key = normalize(query, **kwargs)
+    now = time.time() - grace
+    with _lock:
+        entry = _entries.get(key)
+        if entry and entry[1] > now:
+            _entries.move_to_end(key)
+            return json.loads(entry[2])
+        if entry and not grace:
+            del _entries[key]
+
+        conn = connect()
+        if not conn:
+            return None
+
+        row = conn.execute('SELECT object, expires, data FROM entries WHERE key = ?', (key,)).fetchone()
+        if not row or row[1] <= now:
+            return None
+
+        remember(key, *row)
+        return json.loads(row[2])
+
+def remember(key, obj, expires, data):
+    _entries[key] = (obj, expires, data)
+    _entries.move_to_end(key)
+    while len(_entries) > MAX_ENTRIES:
+        _entries.popitem(last=False)
+
+def put(query, result, **kwargs):
+    obj = get_object(query)
+    ttl = get_ttl(obj)
+    if not ttl:
+        return
+
+    key = normalize(query, **kwargs)
+    expires = time.time() + ttl
+    data = json.dumps(result)
+    with _lock:
+        remember(key, obj, expires, data)
+        conn = connect()
+        if conn:
+            conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', (key, obj, expires, data))
+            conn.commit()
+
+# Objects whose cached results go stale when obj is written, following dependents all the way down
+def get_stale(obj):
+    stale = {obj}
+    pending = [obj]
+    while pending:
+        for dependent in dependents.get(pending.pop(), ()):
+            if dependent not in stale:
+                stale.add(dependent)
+                pending.append(dependent)
+
+    return stale
+
+# Drop every entry for an object (and objects whose queries read it) after a write
+def invalidate(obj):
+    stale = get_stale(obj)
+    with _lock:
+        for key in [key for key, entry in _entries.items() if entry[0] in stale]:
+            del _entries[key]
+
+        conn = connect()
+        if conn:
+            conn.executemany('DELETE FROM entries WHERE object = ?', [(o,) for o in stale])
+            conn.commit()
+
+def clear():
+    with _lock:
+        _entries.clear()
+        conn = connect()
+        if conn:
+            conn.execute('DELETE FROM entries')
+            conn.commit()
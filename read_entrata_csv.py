@@ -1,8 +1,14 @@
 import os
 import csv
 from datetime import datetime
+from functools import lru_cache
 
 class Person:
+    __slots__ = (
+        'parking_space', 'e_id', 'start', 'end', 'name', 'email',
+        'pass_num', 'monthly_rate', 'is_resident', 'contractor', 'slot'
+    )
+
     attr_conversion = {
         'Parking_Space__c': 'parking_space',
         'Entrata_Id__c': 'e_id',
@@ -16,17 +22,19 @@ class Person:
         'Is_Resident__c': 'is_resident'
     }
 
-    def __init__(self, data):
-        self.parking_space = data['Parking_Space__c']
-        self.e_id = data['Entrata_Id__c']
-        self.start = data['Start_Date__c']
-        self.end = data['End_Date__c']
-        self.name = data['Lessee_Name__c'].strip()
-        self.email = data['Email__c'].strip()
-        self.pass_num = data['Pass_Number__c']
-        self.monthly_rate = data['Monthly_Rate__c']
-        self.is_resident = data['Is_Resident__c']
+    def __init__(self, parking_space, e_id, start, end, name, email, pass_num, monthly_rate, is_resident):
+        self.parking_space = parking_space
+        self.e_id = e_id
+        self.start = start
+        self.end = end
+        self.name = name.strip()
+        self.email = email.strip()
+        self.pass_num = pass_num
+        self.monthly_rate = monthly_rate
+        self.is_resident = is_resident
         self.contractor = None
+        # 'current' or 'future' reservation column in the report
+        self.slot = None
 
     def __setitem__(self, key, value):
         if key in Person.attr_conversion:
@@ -72,62 +80,87 @@ future_cols = {
 }
 
 # Most recently created file in csvs directory
-def get_most_recent(changed=False):
-    if changed:
-        return 'csvs/changed.csv'
-    
+# csvs/changed.csv is a diff (Change_Type, Changed_Fields, removed rows), not a report, so it's never read here
+def get_most_recent():
     data_path = 'csvs'
     tgt_name = datetime.now().strftime("%Y-%m-%d") + "_Rentable Items Availability.csv"
     return os.path.join(data_path, tgt_name)
 
-# Split each line in the csv into current and future reservations
-# Datetime format YYYY-MM-DD is comparable with >= as a string
-# Takes the pass number from the lessee name if it exists (Last #1234, First)
-# Only returns people with valid emails and end dates in the future
-def split_line(headerLine, line):
-    line_dict = {header:val for header, val in zip(headerLine, line)}
-    current_person = {current_cols[col]:line_dict[col] for col in current_cols}
-    future_person = {future_cols[col]:line_dict[col] for col in future_cols}
-    result = []
-    if len(current_person['Email__c']) > 3:
-        result.append(current_person)
-        if current_person['Moveout'] and len(current_person['Moveout']) > 0:
-            current_person['Dates'] = f'{current_person['Dates'].split("-")[0]} - {str(current_person['Moveout'])}'
-        del current_person['Moveout']
-    
-    if len(future_person['Email__c']) > 3:
-        result.append(future_person)
-
-    for person in result:
-        start, end = person['Dates'].split("-")
-        person['Start_Date__c'] = datetime.strptime(start.strip(), "%m/%d/%Y").strftime("%Y-%m-%d")
-        person['End_Date__c'] = datetime.strptime(end.strip(), "%m/%d/%Y").strftime("%Y-%m-%d")
-        del person['Dates']
-        try:
-            last, first = person['Lessee_Name__c'].split(", ")
-            first_split = first.split("(")
-            if len(first_split) > 1:
-                person['Is_Resident__c'] = True
-            else:
-                person['Is_Resident__c'] = False
-            first = first_split[0].strip()
-        except ValueError:
-            first = person['Lessee_Name__c']
-            last = ""
-        pass_num = ""
-        if '#' in last:
-            last, pass_num = last.split("#")
-            last = last.strip()
-            pass_num = pass_num.strip()
+# Every row repeats the same few dates, so each one is only parsed once
+@lru_cache(maxsize=None)
+def convert_date(d):
+    return datetime.strptime(d.strip(), "%m/%d/%Y").strftime("%Y-%m-%d")
 
-        
-        person['Lessee_Name__c'] = f'{first} {last}'
-        person['Pass_Number__c'] = pass_num.split("/")[0].strip()
+# Column positions for current_cols / future_cols, resolved once from the header
+def get_indexes(headerLine, cols):
+    indexes = {field: headerLine.index(col) for col, field in cols.items()}
+    indexes.setdefault('Moveout', None)
+    return indexes
 
-    dates = [i for i in result if i['End_Date__c'] >= datetime.now().strftime("%Y-%m-%d")]
-    return dates
+# Takes the pass number from the lessee name if it exists (Last #1234, First)
+# Returns (name, pass number, is resident)
+def split_name(lessee):
+    try:
+        last, first = lessee.split(", ")
+        first_split = first.split("(")
+        is_resident = len(first_split) > 1
+        first = first_split[0].strip()
+    except ValueError:
+        first = lessee
+        last = ""
+        is_resident = False
+
+    pass_num = ""
+    if '#' in last:
+        last, pass_num = last.split("#")
+        last = last.strip()
+        pass_num = pass_num.strip()
+
+    return f'{first} {last}', pass_num.split("/")[0].strip(), is_resident
+
+# Person for one reservation (current or future) on a line, or None if there isn't one
+# Current reservations end on the move out date if one is set
+def get_person(line, indexes):
+    email = line[indexes['Email__c']]
+    if len(email) <= 3:
+        return None
+
+    start, end = line[indexes['Dates']].split("-")
+    moveout = indexes['Moveout']
+    if moveout is not None and line[moveout]:
+        end = line[moveout]
+
+    name, pass_num, is_resident = split_name(line[indexes['Lessee_Name__c']])
+    return Person(
+        line[indexes['Parking_Space__c']],
+        line[indexes['Entrata_Id__c']],
+        convert_date(start),
+        convert_date(end),
+        name,
+        email,
+        pass_num,
+        line[indexes['Monthly_Rate__c']],
+        is_resident
+    )
 
-# Read CSV and return list of people dictionaries
+# Split each line in the csv into current and future reservations
+# Datetime format YYYY-MM-DD is comparable with >= as a string
+# Only yields people with valid emails and end dates in the future
+def iter_people(f):
+    today = datetime.now().strftime("%Y-%m-%d")
+    with open(f, mode = 'r', encoding='utf-8-sig') as file:
+        lines = csv.reader(file)
+        headerLine = next(lines)
+        slots = (('current', get_indexes(headerLine, current_cols)), ('future', get_indexes(headerLine, future_cols)))
+        for line in lines:
+            for slot, indexes in slots:
+                person = get_person(line, indexes)
+                if person and person.end >= today:
+                    person.slot = slot
+                    yield person
+
+# Read CSV and return list of people
+# Callers that only go through the rows once should use iter_people instead
 #
 # Each person will have:
 # 'Parking_Space__c', 'Monthly_Rate__c', 'Lessee_Name__c', 
@@ -136,19 +169,10 @@ def split_line(headerLine, line):
 #
 # __c indicates custom Salesforce field
 def read_csv(f):
-    temp_people = []
-    with open(f, mode = 'r', encoding='utf-8-sig') as file:
-        csvFile = csv.reader(file)
-        lines = iter(csvFile)
-        headerLine = next(lines)
-        for line in lines:
-            temp_people.extend(split_line(headerLine, line))
-    
-    people = [Person(p) for p in temp_people]
-    return people
+    return list(iter_people(f))
 
-def get_people(changed=False):
-    return read_csv(get_most_recent(changed=changed))
+def get_people():
+    return read_csv(get_most_recent())
 
 def main():
     people = get_people()
@@ -0,0 +1,190 @@
+import matching
+from intervals import IntervalIndex
+from tables.record import parse_date
+
+# Reconciles the report's rows with the Salesforce leases, joining the two once on tuple keys
+# Leases are hashed on (Entrata ID, space, start) in one pass, then each row is looked up once:
+#   same lease, same end date              unchanged
+#   same lease, new end date               Update (End_Date__c)
+#   Entrata ID not in Salesforce at all    matched to a lease without one (matching.py), Update to link it
+#   anything else                          Insert, or Overlap if the space is already leased for those dates
+# Rows that can't be written (no monthly rate, unknown space) are Conflicts, and leases with an
+# Entrata ID that no row claimed are Deletes (only on the spaces being reconciled)
+#
+# Rows are report rows (read_entrata_csv.Person), leases are typed mirror records (tables.lease.Lease)
+
+# Rows with no monthly rate are not actually signed leases
+def has_rate(person):
+    try:
+        float(person.monthly_rate)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def person_row(person):
+    return {col: person[col] for col in person.keys()}
+
+# Describes a lease for the overlap log
+# Salesforce leases are named by Id, rows from this batch by Entrata ID
+def describe_lease(lease):
+    dates = f"{lease['Start_Date__c']} - {lease['End_Date__c']}"
+    if lease.get('Id'):
+        return f"{lease['Id']} ({lease['Lessee_Name__c']}, {dates})"
+
+    return f"Entrata {lease['Entrata_Id__c']} ({lease['Lessee_Name__c']}, {dates})"
+
+class Insert():
+    def __init__(self, person):
+        self.person = person
+
+# fields are the values written to the lease, match is set when the lease was linked by matching.py
+class Update():
+    def __init__(self, lease, person, fields, match=None):
+        self.lease = lease
+        self.person = person
+        self.fields = fields
+        self.match = match
+
+    def to_record(self):
+        return {'Id': self.lease.id, **self.fields}
+
+    def to_row(self):
+        return self.match.to_row() if self.match else person_row(self.person)
+
+class Delete():
+    def __init__(self, lease):
+        self.lease = lease
+
+    def to_row(self):
+        return {
+            'Id': self.lease.id,
+            'Entrata_Id__c': self.lease.entrata_id,
+            'Start_Date__c': str(self.lease.start),
+            'End_Date__c': str(self.lease.end),
+            'Parking_Space__c': self.lease.parking_space_ref,
+            'Lessee_Name__c': self.lease.person,
+        }
+
+# A new row whose dates overlap a lease (or an earlier row of this batch) on its space
+class Overlap():
+    def __init__(self, person, lease):
+        self.person = person
+        self.lease = lease
+
+    def to_row(self):
+        return {**person_row(self.person), 'Conflicts_With': describe_lease(self.lease)}
+
+class Conflict():
+    def __init__(self, person, reason):
+        self.person = person
+        self.reason = reason
+
+    def to_row(self):
+        return {**person_row(self.person), 'Reason': self.reason}
+
+class Reconciliation():
+    def __init__(self):
+        self.inserts = []
+        self.updates = []
+        self.deletes = []
+        self.overlaps = []
+        self.conflicts = []
+        self.unchanged = 0
+
+    def __str__(self):
+        return (f'{len(self.inserts)} to insert, {len(self.updates)} to update, {len(self.deletes)} to delete, '
+                f'{len(self.overlaps)} overlapping, {len(self.conflicts)} conflicts, {self.unchanged} unchanged')
+
+# Values a linked lease needs so the next run matches it on (Entrata ID, space, start) like any other
+def link_fields(match, space_ref):
+    fields = {'Entrata_Id__c': match.person.e_id}
+    if match.lease.parking_space_ref != space_ref:
+        fields['Parking_Space__c'] = space_ref
+    if str(match.lease.start) != match.person.start:
+        fields['Start_Date__c'] = match.person.start
+    if str(match.lease.end) != match.person.end:
+        fields['End_Date__c'] = match.person.end
+    return fields
+
+# people are the rows being reconciled, leases every current lease in Salesforce
+# space_refs maps space names to Salesforce Ids, spaces limits deletes to those space Ids (None for all)
+def reconcile(people, leases, space_refs, spaces=None):
+    result = Reconciliation()
+
+    by_key = {}
+    entrata_ids = set()
+    for lease in leases:
+        if lease.entrata_id:
+            entrata_ids.add(lease.entrata_id)
+            by_key.setdefault((lease.entrata_id, lease.parking_space_ref, lease.start), []).append(lease)
+
+    claimed = set()
+    new = []
+    keyless = []
+    for person in people:
+        space_ref = space_refs.get(person.parking_space)
+        if space_ref is None:
+            result.conflicts.append(Conflict(person, 'unknown parking space'))
+            continue
+
+        start, end = parse_date(person.start), parse_date(person.end)
+        same_key = by_key.get((person.e_id, space_ref, start), ())
+        lease = next((l for l in same_key if l.person == person.name), None)
+        # A lease with the row's exact dates is kept even if the name differs (the row is then an Overlap)
+        claimed.update(l.id for l in same_key if l.end == end)
+        if lease and (lease.end == end or lease.id in claimed):
+            claimed.add(lease.id)
+            result.unchanged += 1
+        elif not has_rate(person):
+            # The lease it would update is left unclaimed, so it's deleted
+            result.conflicts.append(Conflict(person, 'no monthly rate'))
+        elif lease:
+            claimed.add(lease.id)
+            result.updates.append(Update(lease, person, {'End_Date__c': person.end}))
+        else:
+            new.append(person)
+            if person.e_id not in entrata_ids:
+                keyless.append(person)
+
+    if keyless:
+        matches, _ = matching.KeylessIndex(leases).match(keyless)
+        linked = set()
+        for match in matches:
+            linked.add(id(match.person))
+            claimed.add(match.lease.id)
+            fields = link_fields(match, space_refs[match.person.parking_space])
+            result.updates.append(Update(match.lease, match.person, fields, match))
+        new = [person for person in new if id(person) not in linked]
+
+    for lease in leases:
+        if lease.entrata_id and lease.id not in claimed and (spaces is None or lease.parking_space_ref in spaces):
+            result.deletes.append(Delete(lease))
+
+    # New rows are checked against every lease as it will be after the updates and deletes, and against each other,
+    # so two rows in the same batch can't double-book a space, and a reservation moved to a new start date
+    # doesn't overlap its own old lease
+    if new:
+        written = {update.lease.id: update.fields for update in result.updates}
+        deleted = {d.lease.id for d in result.deletes}
+        current = []
+        for lease in leases:
+            if lease.id in deleted:
+                continue
+            fields = written.get(lease.id, {})
+            start = parse_date(fields.get('Start_Date__c')) or lease.start
+            end = parse_date(fields.get('End_Date__c')) or lease.end
+            if start and end:
+                current.append((fields.get('Parking_Space__c', lease.parking_space_ref), start, end, lease))
+        index = IntervalIndex.from_leases(current)
+
+        for person in new:
+            space_ref = space_refs[person.parking_space]
+            start, end = parse_date(person.start), parse_date(person.end)
+            conflict = index.find_overlap(space_ref, start, end)
+            if conflict:
+                result.overlaps.append(Overlap(person, conflict))
+            else:
+                result.inserts.append(Insert(person))
+                index.add(space_ref, start, end, person)
+
+    return result
@@ -1,267 +1,309 @@
+import os
+import json
+import hashlib
+import argparse
 import utils
-from datetime import datetime
-from read_entrata_csv import get_people
+import bulk
+import metrics
+import fingerprints
+import soql
+import mirror
+import watch
+import reconcile
+from read_entrata_csv import read_csv, iter_people, get_most_recent
 from auth import sf
+from datetime import datetime
+
+# Set by setup() at the start of a run, not on import
+# people only holds rows on changed spaces unless the run is --full
+people = []
+parking_space_to_ref = {}
+lease_owner_to_ref = {}
+# Fingerprints of the whole report, saved once the run succeeds
+report_fingerprints = {}
+# Names of the spaces being reconciled, None for every space
+changed = None
+# Held while a run is reconciling, so --watch and a scheduled run never overlap
+LOCK_FILE = 'cache/sf_add.lock'
+PLAN_FILE = 'logs/sf_add_plan.json'
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Add new Entrata leases to Salesforce, update end dates and remove leases no longer in the report'
+    )
+
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='Reconcile every row of the report, not just spaces changed since the last successful run'
+    )
+
+    parser.add_argument(
+        '-w',
+        '--watch',
+        action='store_true',
+        help='Keep running, and reconcile as soon as a new report lands in DRIVE_DIR'
+    )
+
+    parser.add_argument(
+        '-p',
+        '--plan',
+        type=str,
+        nargs='?',
+        const=PLAN_FILE,
+        help=f'Write the changes to a plan file (default {PLAN_FILE}) instead of making them'
+    )
+
+    parser.add_argument(
+        '-a',
+        '--apply',
+        type=str,
+        nargs='?',
+        const=PLAN_FILE,
+        help='Make the changes in a plan file, if the leases it touches haven\'t changed since'
+    )
+
+    return parser.parse_args()
 
 # Make sure most recent csv is downloaded
-available = utils.download_from_drive()
-# Get people from most recent changed csv
-if available:
-    people = get_people(changed=False)
-else:
-    people = []
-
-# Find a match
-comparison_cols = [
-    'Lessee_Name__c',
-    'Start_Date__c',
-]
-
-parking_space_to_ref = utils.set_parking_spaces(sf)
-lease_owner_to_ref = utils.set_lease_owners(sf)
-
-# Creates a lookup of Entrata IDs to existing lease records
-# Used to see if a record already exists in the system
-def get_id_lookup(data):
-    id_lookup = {}
-    for record in data:
-        entrata_id = record['Entrata_Id__c']
-        if not entrata_id:
-            continue
-        
-        if entrata_id not in id_lookup:
-            id_lookup[entrata_id] = []
-
-        id_lookup[entrata_id].append(record)
-
-    return id_lookup
-
-# Returns new records and potential problem records
-# New records are those that do not exist in the system
-# Problem records are those that have matching Entrata ID but differ in other fields
-def get_new_records(id_lookup):
-    new_records = []
-    problems = []
-    for person in people:
-        entrata_id = person.e_id
-        # Entrata ID Not in the system - new Record
-        if person.e_id not in id_lookup:
-            new_records.append(person)
-            continue
-
-        records = id_lookup[entrata_id]
-        
-        for record in records:
-            temp_problem = {col:person[col]==record[col] for col in comparison_cols if col in record}
-
-            # Perfect match (Parking space and start date)
-            if all(val for val in temp_problem.values()) \
-                and parking_space_to_ref[person.parking_space] == record['Parking_Space__c']:
-                if not person.end == record['End_Date__c']:
-                    problems.append(person)
-                    break
-                else:
-                    break
-        else:
-            new_records.append(person)
-
-    return new_records, problems
-
-# Creates a lookup of parking spaces to existing lease date ranges
-def get_space_lookup(data):
-    space_lookup = {}
-    format_string = "%Y-%m-%d"
-    for record in data:
-        parking_space = record['Parking_Space__c']
-
-        if parking_space not in space_lookup:
-            space_lookup[parking_space] = []
-
-        space_lookup[parking_space].append(
-            (datetime.strptime(record['Start_Date__c'], format_string), 
-             datetime.strptime(record['End_Date__c'], format_string))
-        )
-
-    return space_lookup
-
-# Checks if a single lease record overlaps with existing leases
-def is_overlapping(res_list, record):
-    format_string = "%Y-%m-%d"
-    record_start = datetime.strptime(record['Start_Date__c'], format_string)
-    record_end = datetime.strptime(record['End_Date__c'], format_string)
-    overlap = False
-
-    for start, end in res_list:
-        overlap |= (record_end <= end and record_end >= start) \
-        or (record_start >= start and record_start <= end)
-
-    return overlap
-
-# Checks for overlapping leases in the new records
-# If any overlaps are found, they are returned in the invalid list
-def check_overlap(data, records):
-    spaces = get_space_lookup(data)
-    valid = []
-    invalid = []
-    for record in records:
-        try:
-            parking_space = parking_space_to_ref[record['Parking_Space__c']]
-        except Exception as e:
-            parking_space = record['Parking_Space__c']
-
-        # if record['Lessee_Name__c'].startswith('Builder'):
-        #     print(record)
-        #     print(spaces[parking_space])
-        
-        if parking_space not in spaces:
-            valid.append(record)
-            continue
-
-        if is_overlapping(spaces[parking_space], record):
-            invalid.append(record)
+# Get people from it and set up the Salesforce lookups
+# Unless full, people is cut down to spaces that changed since the last successful run
+# The report is streamed twice then: once for its fingerprints, once for the rows on changed spaces,
+# so only those rows are ever held in memory
+# Returns False if there is no csv for today
+# refresh copies today's csv again, for a report that was re-uploaded
+def setup(full=False, refresh=False):
+    global people, parking_space_to_ref, lease_owner_to_ref, report_fingerprints, changed
+    with metrics.stage('download'):
+        if not utils.download_from_drive(refresh=refresh):
+            return False
+
+    with metrics.stage('parse'):
+        report = get_most_recent()
+        report_fingerprints = fingerprints.get_fingerprints(iter_people(report))
+        metrics.count('people', len(report_fingerprints))
+
+        last_run = None if full else fingerprints.load()
+        if last_run is None:
+            changed = None
+            people = read_csv(report)
+            print(f'Reconciling all {len(people)} reservations.')
         else:
-            valid.append(record)
-
-    return valid, invalid
-
-# convert to valid object for upload
-def convert_record(record):
-    try:
-        record['Monthly_Rate__c'] = float(record['Monthly_Rate__c'])
-    except Exception as e:
-        return None, record
-
-    # Convert to Salesforce IDs
+            changed = fingerprints.changed_spaces(last_run, report_fingerprints)
+            people = [person for person in iter_people(report) if person.parking_space in changed]
+            metrics.count('changed_spaces', len(changed))
+            print(f'{len(changed)} spaces changed since the last run, reconciling {len(people)} reservations.')
+
+    # Nothing to look up on a quiet day
+    if changed is None or changed:
+        with metrics.stage('lookups'):
+            parking_space_to_ref = utils.set_parking_spaces(sf)
+            lease_owner_to_ref = utils.set_lease_owners(sf)
+
+    return True
+
+# Lease record for a new row, with the space and contract owner as Salesforce Ids
+# reconcile has already set aside rows with no monthly rate or an unknown space
+def to_insert(person):
+    record = {col: person[col] for col in person.keys()}
+    record['Monthly_Rate__c'] = float(record['Monthly_Rate__c'])
     record['Lease_Contract_Owner__c'] = lease_owner_to_ref['The Quarters on Campus']
-    parking_space = record['Parking_Space__c']
-    record['Parking_Space__c'] = parking_space_to_ref[parking_space]
-
-    return parking_space, record
-
-# Add new lease records to Salesforce
-# If any records fail to insert, they are returned in the failed list
-# Prints the results of the insert operation
-def add_records(records):
-    to_insert = []
-    parking_spaces = []
-    failed = []
-    for record in records:
-        parking_space, updated = convert_record(record)
-        if parking_space:
-            to_insert.append(updated)
-            parking_spaces.append(parking_space)
-        else:
-            failed.append(updated)
-
-    utils.insert_to_table(sf, to_insert, table='Leases__c')
-    return parking_spaces, to_insert, failed
+    record['Parking_Space__c'] = parking_space_to_ref[person.parking_space]
+    return record
 
 # Only used to update Hardin House Records monthly rate to 0
 def update_records():
-    data = utils.query_table(sf, 'lease', where="WHERE Lease_Contract_Owner__r.name = 'Hardin House'")
-
-    for record in data['records']:
-        id = record['Id']
-        sf.Leases__c.update(id, {'Monthly_Rate__c': 0.0})
-        print(f'Updated record {id}.')
-
-# If a problem record has changed end date, update it in Salesforce
-# Return changed records to use for checking overlap with new adds
-def update_changed(changed, records):
-    lookup = {f'{r['Entrata_Id__c']}{r['Start_Date__c']}':r for r in changed}
-    matched = set()
-    updated = []
-    delete = []
-    for record in records:
-        try:
-            r = lookup[f'{record['Entrata_Id__c']}{record['Start_Date__c']}']
-            matched.add(r['Entrata_Id__c'])
-            r['End_Date__c'] = record['End_Date__c']
-            sf.Leases__c.update(r['Id'], {'End_Date__c': r['End_Date__c']})
-            print(f'Updated record {r['Id']}.')
-            updated.append(record)
-        except KeyError:
-            pass
-
-    for _, record in lookup.items():
-        if record['Entrata_Id__c'] not in matched:
-            delete.append({key: val for key, val in record.items() if key in ['Entrata_Id__c', 'Start_Date__c', 'End_Date__c', 'Parking_Space__c', 'Lessee_Name__c']})
-    
-    return updated, delete
-
-# Creates a lookup for to verify that SF records match parking spaces in 'people'
-def get_people_lookup():
-    lookup = {}
-    for person in people:
-        parking_space = parking_space_to_ref[person.parking_space]
-        id = f"{person.e_id}{parking_space}{person.start}{person.end}"
-        lookup[id] = person
-
-    return lookup
-
-# Checks that none of the parking spaces have been moved around.
-# Does not find the right match, just returns all records that do not match
-def verify_sf_data(data):
-    changed = []
-    unchanged = []
-    people_lookup = get_people_lookup()
-    for record in data:
-        if record['Entrata_Id__c'] is None:
-            unchanged.append(record)
-            continue
-
-        id = f"{record['Entrata_Id__c']}{record['Parking_Space__c']}{record['Start_Date__c']}{record['End_Date__c']}"
-        if id not in people_lookup:
-            changed.append(record)
-        else:
-            unchanged.append(record)
-
-    return changed, unchanged
+    where = soql.eq('Lease_Contract_Owner__r.Name', 'Hardin House')
+    data = utils.query_table(sf, 'lease', where, cols=['Id'])
+    to_update = [{'Id': record['Id'], 'Monthly_Rate__c': 0.0} for record in data['records']]
+    utils.update_collection(sf, to_update, table='Leases__c')
+
+# Identifies the mirrored leases a plan was computed from
+def get_checksum(leases):
+    digest = hashlib.sha256()
+    for lease in sorted(leases, key=lambda l: l.id):
+        digest.update(f'{lease.id}|{lease.entrata_id}|{lease.parking_space_ref}|{lease.start}|{lease.end}|{lease.person}\n'.encode())
+    return digest.hexdigest()
+
+# Everything a run writes, as plain JSON: records to insert, Ids with their new field values and Ids to delete
+# watermark and checksum (added when it's saved) identify the mirrored leases it was computed from,
+# so it can be applied later (--apply); spaces are the space Ids it inserts on or moves an end date on
+# The report's fingerprints are saved once it's applied, leaving out spaces to retry
+def get_plan(changes):
+    retry = {row.person.parking_space for row in changes.overlaps + changes.conflicts}
+    spaces = {parking_space_to_ref[insert.person.parking_space] for insert in changes.inserts}
+    for update in changes.updates:
+        spaces.add(update.lease.parking_space_ref)
+        spaces.add(update.fields.get('Parking_Space__c', update.lease.parking_space_ref))
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'report': get_most_recent(),
+        'watermark': mirror.get_watermark('lease'),
+        'checksum': None,
+        'inserts': [to_insert(insert.person) for insert in changes.inserts],
+        'updates': [update.to_record() for update in changes.updates],
+        'deletes': [d.lease.id for d in changes.deletes],
+        'spaces': sorted(space for space in spaces if space),
+        'fingerprints': report_fingerprints,
+        'retry': sorted(retry),
+    }
+
+def save_plan(plan, plan_file):
+    plan['checksum'] = get_checksum(mirror.load('lease').values())
+    os.makedirs(os.path.dirname(plan_file) or '.', exist_ok=True)
+    with open(plan_file, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, indent=1)
+
+    print(f"Plan written to {plan_file}: {len(plan['inserts'])} inserts, {len(plan['updates'])} updates, "
+          f"{len(plan['deletes'])} deletes. Apply it with --apply {plan_file}")
+
+def load_plan(plan_file):
+    with open(plan_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# Leases changed in Salesforce since the plan's watermark that the plan writes over, or on a space
+# it inserts on or changes an end date on (a new lease there could overlap)
+# Nothing changed is the usual case, and costs one COUNT() query
+# A plan made from another mirror (checksum differs at the same watermark) counts every lease it touches as changed,
+# and one made without a watermark can't be checked, so everything it touches counts as changed
+def get_drift(plan):
+    touched = {update['Id'] for update in plan['updates']} | set(plan['deletes'])
+    spaces = set(plan.get('spaces') or ())
+    spaces |= {record['Parking_Space__c'] for record in plan['inserts']}
+    spaces |= {update['Parking_Space__c'] for update in plan['updates'] if 'Parking_Space__c' in update}
+
+    if not plan['watermark']:
+        reason = 'plan has no mirror watermark'
+        return ([{'Id': lease_id, 'Parking_Space__c': '', 'Reason': reason} for lease_id in sorted(touched)]
+                + [{'Id': '', 'Parking_Space__c': space, 'Reason': reason} for space in sorted(spaces)])
+
+    if mirror.get_watermark('lease') == plan['watermark'] and get_checksum(mirror.load('lease').values()) != plan['checksum']:
+        return [{'Id': lease_id, 'Reason': 'mirror checksum differs'} for lease_id in sorted(touched)]
+
+    # The watermark is truncated to seconds in SOQL, rows at the watermark itself are filtered out below
+    since = soql.ge('LastModifiedDate', mirror.parse_modstamp(plan['watermark']))
+    if not utils.count_table(sf, 'lease', since, cache=False, include_deleted=True):
+        return []
+
+    cols = ['Id', 'Parking_Space__c', 'LastModifiedDate', 'IsDeleted']
+    rows = utils.query_table(sf, 'lease', since, cols=cols, cache=False, include_deleted=True)['records']
+    return [
+        {'Id': row['Id'], 'Parking_Space__c': row['Parking_Space__c'], 'LastModifiedDate': row['LastModifiedDate'],
+         'Reason': 'deleted' if row['IsDeleted'] else 'modified'}
+        for row in rows
+        if row['LastModifiedDate'] > plan['watermark'] and (row['Id'] in touched or row['Parking_Space__c'] in spaces)
+    ]
+
+# Writes a plan: updates in one batched call, then inserts and deletes as bulk jobs
+# Returns whether everything went through
+def apply_plan(plan):
+    with metrics.stage('update end dates'):
+        failed = []
+        results = utils.update_collection(sf, plan['updates'], table='Leases__c')
+        for record, result in zip(plan['updates'], results):
+            if not result['success']:
+                failed.append({**record, 'Errors': '; '.join(e['message'] for e in result['errors'])})
+        utils.create_csv('update_failed', failed)
+
+    # Inserts and deletes don't depend on each other, so run both jobs at once
+    result = bulk.run(sf, [
+        bulk.BulkJob('Leases__c', 'insert', plan['inserts']),
+        bulk.BulkJob('Leases__c', 'delete', [{'Id': lease_id} for lease_id in plan['deletes']]),
+    ])
+    print(result)
+
+    # Failed writes are retried by not saving; overlapping and skipped rows are left out,
+    # so those spaces are checked again next run in case Salesforce was fixed by hand
+    ok = result.ok() and not failed
+    if ok:
+        fingerprints.save(plan['fingerprints'], skip=plan['retry'])
+
+    return ok
 
 # Authenticate salesforce
-# Set up Lookups
+# Set up Lookups, find spaces changed since the last successful run
 # Get Lease data
-# Get new potential lease records
-# Check for overlaps
-# Add valid records
+# Reconcile the report's rows with the leases (reconcile.py)
 # Create CSV logs
-# TODO: Add command line arguments for different operations
-def main():
-    if not available:
+# Write the plan to plan_file, or apply it: update end dates and link leases entered without an Entrata ID,
+# add valid records and delete removed ones, then save the report's fingerprints if everything went through
+@metrics.command('sf_add')
+def run(full=False, refresh=False, plan_file=None):
+    if not setup(full=full, refresh=refresh):
         print("No new CSV available. Exiting.")
         return
+
+    if changed is not None and not changed:
+        print("No changes since the last run.")
+        fingerprints.save(report_fingerprints)
+        return
     # Get Lease Data from Salesforce
-    data = utils.get_leases(sf)['records']
-
-    # Check that entrata id's in salesforce match parking spaces in 'people'
-    changed, _ = verify_sf_data(data)
-    id_lookup = get_id_lookup(data)
-    new_records, problems = get_new_records(id_lookup)
-    # Records with no monthly rate are not actually signed leases
-    problems = [problem for problem in problems if problem['Monthly_Rate__c'] != '']
-
-    # changed: sf data that recognizes something has changed
-    # problems: csv data that differs from sf data
-    # updated: csv data that has been updated to sf
-    updated, delete = update_changed(changed, problems)
-    new_records.extend(updated)
-    valid, overlapping = check_overlap(data, new_records)
-    parking_spaces, added, skipped = add_records(valid)
-
-    # Convert back for printing
-    for i, record in enumerate(added):
-        record['Parking_Space__c'] = parking_spaces[i]
+    with metrics.stage('pull leases'):
+        data = utils.get_leases(sf)['records']
+
+    with metrics.stage('reconcile'):
+        spaces = None if changed is None else {parking_space_to_ref.get(space) for space in changed}
+        changes = reconcile.reconcile(people, data, parking_space_to_ref, spaces)
+        print(changes)
+        plan = get_plan(changes)
 
     # Data dumps
-    utils.create_csv('overlapping', overlapping)
-    utils.create_csv('skipped', skipped)
-    utils.create_csv('added', added)
-    utils.create_csv('updated', updated)
-    utils.create_csv('delete', delete)
-    utils.advance_logs()
-
-    # Delete records that were logged for deletion
-    utils.delete_from_leases(sf, delete=False)
+    with metrics.stage('logs'):
+        added = [{**record, 'Parking_Space__c': insert.person.parking_space} for record, insert in zip(plan['inserts'], changes.inserts)]
+        utils.create_csv('overlapping', [overlap.to_row() for overlap in changes.overlaps])
+        utils.create_csv('skipped', [conflict.to_row() for conflict in changes.conflicts])
+        utils.create_csv('added', added)
+        utils.create_csv('updated', [update.to_row() for update in changes.updates if not update.match])
+        utils.create_csv('linked', [update.to_row() for update in changes.updates if update.match])
+        utils.create_csv('delete', [d.to_row() for d in changes.deletes])
+        utils.advance_logs()
+
+    if plan_file:
+        save_plan(plan, plan_file)
+        return
+
+    apply_plan(plan)
+
+# Applies a plan written by --plan, unless the leases it touches changed in Salesforce since
+@metrics.command('sf_add')
+def apply(plan_file):
+    plan = load_plan(plan_file)
+    with metrics.stage('drift check'):
+        drift = get_drift(plan)
+
+    if drift:
+        utils.create_csv('plan_drift', drift, delete=True)
+        print(f"{len(drift)} leases or spaces in {plan_file} changed since it was made, or can't be checked (see logs/plan_drift.csv). Run --plan again.")
+        return
+
+    print(f"No drift since {plan['watermark']}, applying {plan_file}.")
+    apply_plan(plan)
+
+# Daemon mode: the session, the mirror and its decoded records stay in memory between runs,
+# so each report is reconciled within seconds of landing, pulling only rows changed since the last run
+def watch_drive(full=False):
+    def on_change(names):
+        today = utils.report_name(datetime.now())
+        mirror.expire()
+        run(full=full, refresh=today in names)
+
+    watch.watch(utils.get_drive_dir(), on_change, LOCK_FILE, matches=utils.is_report)
+
+def main():
+    args = parse_args()
+    if args.watch:
+        watch_drive(full=args.full)
+        return
+
+    with watch.single_flight(LOCK_FILE) as acquired:
+        if not acquired:
+            print(f"Another sf_add run is in progress ({LOCK_FILE}). Exiting.")
+            return
+
+        if args.apply:
+            apply(args.apply)
+        else:
+            run(full=args.full, plan_file=args.plan)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,11 +1,16 @@
 import argparse
 import os
+from bisect import bisect_left, bisect_right
 # import csv
-from utils import query_table
+from utils import query_table, export_table
+from tables.pool import pool_cols, Pooled_Lease
+from tables.record import parse_date, format_date
+import soql
 from auth import sf
 from datetime import date as datetimedate
 from datetime import datetime
 from utils import create_csv
+import metrics
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -24,12 +29,20 @@ def parse_args():
         '-m',
         '--start-month',
         type=int,
-        choices=range(1,12),
+        choices=range(1,13),
         required=False,
         metavar='[1-12]',
         help='Start Month (e.g. 1 for January)',
     )
 
+    parser.add_argument(
+        '-e',
+        '--end-year',
+        type=int,
+        required=False,
+        help='End Year (e.g. 2026), reports every month from the start through December of this year',
+    )
+
     parser.add_argument(
         '-o',
         '--output-file',
@@ -45,6 +58,13 @@ def parse_args():
         help='Save individual records to CSV files'
     )
 
+    parser.add_argument(
+        '-b',
+        '--bulk',
+        action='store_true',
+        help='Pull the pool through a Bulk API export (for multi-year ranges)'
+    )
+
     return parser.parse_args()
 
 # Move back 3 months and adjust year if needed
@@ -69,23 +89,84 @@ def get_quarter_dates(args):
         month = (month - 1)// 3  * 3 + 1
         month, year = get_previous_quarter(month, year)
 
-    if args.start_year and not args.start_month:
+    if args.start_year and args.end_year:
+        if not args.start_month:
+            month, year = 1, args.start_year
+        for y in range(year, args.end_year + 1):
+            for m in range(month if y == year else 1, 13):
+                yield f"{y}-{str(m).zfill(2)}-01"
+    elif args.start_year and not args.start_month:
         for m in range(1, 13):
             yield f"{args.start_year}-{str(m).zfill(2)}-01"
     else:
         for i in range(3):
             yield f"{year}-{str(month + i).zfill(2)}-01"
 
-def query_date(d):
-    where= f"WHERE Lease_Id__r.Start_Date__c <= {d} AND Lease_Id__r.End_Date__c >= {d}"
-    return query_table(sf, 'pool', where)
+# Only what the totals need, the rest of pool_cols is pulled when records are saved
+total_cols = ['Id', 'TT15_Share_Amt__c', 'Lease_Id__r.Start_Date__c', 'Lease_Id__r.End_Date__c']
+
+# Every pooled lease active on any day from first through last, in one query
+# split by lease start quarter and fetched concurrently once it runs past a page,
+# or read from a Bulk API export as it downloads
+@metrics.timed('query pool')
+def query_range(first, last, keep_records=False, bulk=False):
+    where = soql.and_(
+        soql.le('Lease_Id__r.Start_Date__c', datetimedate.fromisoformat(last)),
+        soql.ge('Lease_Id__r.End_Date__c', datetimedate.fromisoformat(first))
+    )
+    cols = pool_cols if keep_records else total_cols
+    if bulk:
+        return list(export_table(sf, 'pool', where, cols=cols))
+
+    result = query_table(sf, 'pool', where, cols=cols, partition_by='quarter')
+    return Pooled_Lease.from_query_result(result)
+
+# Sweep over the sorted dates: each lease adds its count and share to the run of dates it covers,
+# so the whole range costs one pass over the records instead of a query per date
+# Yields the same {'totalSize', 'records'} shape per date the per-date queries returned
+def split_by_date(records, dates, keep_records=False):
+    counts = [0] * (len(dates) + 1)
+    amounts = [0] * (len(dates) + 1)
+    by_date = [[] for _ in dates] if keep_records else None
+    days = [parse_date(d) for d in dates]
+
+    for record in records:
+        if not record.lease_start or not record.lease_end:
+            continue
+
+        first = bisect_left(days, record.lease_start)
+        last = bisect_right(days, record.lease_end)
+        if first >= last:
+            continue
+
+        # Currency fields summed in cents so adding and removing shares doesn't drift
+        amount = round((record.share_amt or 0) * 100)
+        counts[first] += 1
+        counts[last] -= 1
+        amounts[first] += amount
+        amounts[last] -= amount
+        if keep_records:
+            for i in range(first, last):
+                by_date[i].append(record)
+
+    count = amount = 0
+    for i, d in enumerate(dates):
+        count += counts[i]
+        amount += amounts[i]
+        yield {
+            'totalSize': count,
+            'payment_total': amount / 100,
+            'records': by_date[i] if keep_records else []
+        }, d
 
-def query_pool(dates):
-    for d in dates:
+def query_pool(dates, keep_records=False, bulk=False):
+    print(f'Querying pooled leases from {dates[0]} through {dates[-1]}')
+    records = query_range(dates[0], dates[-1], keep_records, bulk)
+    print(f"Pooled leases in range: {len(records)}")
+    for month, d in split_by_date(records, dates, keep_records):
         print("-----")
-        print(f'Querying for date: {d}')
-        result = query_date(d)
-        yield result, d
+        print(f'Date: {d}')
+        yield month, d
 
 def output(csv_file, records):
     output_file = create_csv(csv_file, records, logs=False)
@@ -93,13 +174,12 @@ def output(csv_file, records):
         print(f'Output written to {output_file}.')
         return output_file
 
-# d is formatted as YYYY-MM-DD
+# d is a datetime.date
 def date_to_quarter(d):
-    date_split = d.split("-")
-    month = int(date_split[1])
-    quarter = (month - 1) // 3 + 1
-    return f"Q{quarter} {date_split[0]}"
+    quarter = (d.month - 1) // 3 + 1
+    return f"Q{quarter} {d.year}"
 
+@metrics.timed('save records')
 def save_records(csv_file, records, save_records_flag):
     if not save_records_flag:
         return
@@ -107,13 +187,13 @@ def save_records(csv_file, records, save_records_flag):
     to_save = []
     for record in records:
         to_save.append({
-            'Name': record['Lease_ID__r']['Lessee_Name__c'],
-            'Start Date': record['Lease_ID__r']['Start_Date__c'],
-            'End Date': record['Lease_ID__r']['End_Date__c'],
-            'Rate': record['Lease_ID__r']['Monthly_Rate__c'],
-            'TT15 Share Percent': record['TT15_Share__c'],
-            'TT15 Share Amt': record['TT15_Share_Amt__c'],
-            'Quarter Added to Pool': date_to_quarter(record['Lease_ID__r']['Start_Date__c'])
+            'Name': record.lessee_name,
+            'Start Date': format_date(record.lease_start),
+            'End Date': format_date(record.lease_end),
+            'Rate': record.lease_rate,
+            'TT15 Share Percent': record.share,
+            'TT15 Share Amt': record.share_amt,
+            'Quarter Added to Pool': date_to_quarter(record.lease_start)
         })
 
     to_save.sort(key=lambda x: x['Start Date'])
@@ -123,6 +203,7 @@ def save_records(csv_file, records, save_records_flag):
 
     return output_file
 
+@metrics.timed('zip')
 def zip_files(file_list, zip_name):
     import zipfile
     with zipfile.ZipFile(zip_name, 'w') as zipf:
@@ -131,6 +212,7 @@ def zip_files(file_list, zip_name):
             os.remove(file)
     print(f'Files zipped into {zip_name}.')
 
+@metrics.command('sf_filter')
 def main():
     args = parse_args()
     dates = list(get_quarter_dates(args))
@@ -142,7 +224,7 @@ def main():
     # retail_additional = []
     to_zip = []
     total_q = 0
-    for result, date in query_pool(dates):
+    for result, date in query_pool(dates, args.save_records, args.bulk):
         # years_added = (datetime.strptime(date, "%Y-%m-%d").date() - datetimedate(2017, 2, 1)).days // 365 // 5
         # start_extra = base_tt15_amount
         # for _ in range(years_added):
@@ -153,7 +235,7 @@ def main():
 
         # tt15_extra = start_extra * 25
         # print(f'Adding extra ${tt15_extra:,.2f}')
-        payment_total = round(sum(record['TT15_Share_Amt__c'] for record in result['records']), 2)
+        payment_total = result['payment_total']
         output_dicts.append({'Date': date, '# Leases in Pool': result['totalSize'], 'TT15 Payment': payment_total})
         total_q += payment_total
 
@@ -164,6 +246,7 @@ def main():
             to_zip.append(f)
 
     print("=====")
+    total_q = round(total_q, 2)
     print(f'Total Payment Amount for {dates[0]} through {dates[-1]}: ${total_q:,.2f}')
     print("=====")
 
@@ -1,19 +1,27 @@
 import os
+import json
 from auth import sf
 import utils
+import bulk
+import metrics
+import soql
 from datetime import datetime
-import get_available_spaces as sp
-from functools import cmp_to_key
+from datetime import date as dt_date
+import assign
+from occupancy import get_timeline
 import argparse
 
 class Task:
     def __init__(self, message):
         self.id = message['Id']
-        self.parse_body(message['Description'])
+        self.created = message.get('CreatedDate')
+        self.parse_body(message['Description'] or '')
 
     def parse_body(self, body):
         lines = body.split('\n')
         data = {}
+        self.email = None
+        self.name = None
         for line in lines:
             if ':' in line:
                 key, val = line.split(':', 1)
@@ -25,8 +33,7 @@ class Task:
                 self.email = email[:-1]
                 self.name = name.strip()
             except ValueError:
-                self.email = None
-                self.name = None
+                pass
 
         if 'Start Date' in data:
             self.start_date = data['Start Date']
@@ -60,219 +67,245 @@ class Task:
             'End_Date__c': self.date_format(self.end_date)
         }
 
-# Iterator that yields available spaces in order of buildings
-# Uses get_avialable_spaces.py's comparator to order the spaces within each building
-#
-# 1. Yields from buildings in order KN, GR, NU
-# 2. Yields 'OPEN' spaces from The Quarters on Campus first
-# 3. All rejected spaces are added to 'Last Resort' building, which always returns
-#    These spaces are in order of 1. and may or may not work.
-# 
-#
-class SpaceIterator():
-    def __init__(self, spaces, extra='Last Resort'):
-        self.extra = extra
-        self.spaces = {key: sorted(val, key=cmp_to_key(sp.space_comparator)) for key, val in spaces.items()}
-        spaces[extra] = []
-        self.buildings = iter(['KN', 'GR', 'NU', extra])
-        self.current_building = next(self.buildings)
-        self.index = 0
-
-    def advance_building(self, last_resort=True):
-        if last_resort:
-            self.spaces[self.extra].extend(self.spaces[self.current_building][self.index:])
-        self.index = 0
-        self.current_building = next(self.buildings)
-    
-    def __iter__(self):
-        return self
-    
-    # self.advance_building() will raise StopIteration when no spaces are left
-    def __next__(self):
-        while True:
-            # Go through the current building's spaces
-            # If no good options are left, add remaining spaces to 'last resort' and move to the next building
-            # If on 'Last Resort', yield the next space always
-            if self.index < len(self.spaces[self.current_building]):
-                option = self.spaces[self.current_building][self.index]
-                if (option[2] != "OPEN" or option[0] != "The Quarters on Campus") and self.current_building != self.extra:
-                    self.advance_building(last_resort=True)
-                    continue
-                self.index += 1
-                return option
-            else:
-                self.advance_building(last_resort=False)
-            
-# Prompts user to confirm task details
-def confirm_task(t):
-    print(t)
-    exited = False
-    confirm = input("Is this information correct? (y/n): ")
-    while confirm.lower() != 'y':
-        edit_str = set(c for c in input("Do you want to edit (n)ame, (e)mail, (s)tart date, en(d) date or e(x)it?\nEnter all that apply with no spaces\n> ").lower())
-        if 'x' in edit_str:
-            exited = True
-            break
-        if 'n' in edit_str:
-            t.name = input("Enter Full Name:\n> ")
-        if 'e' in edit_str:
-            t.email = input("Enter Email:\n> ")
-        if 's' in edit_str:
-            t.start_date = input("Enter Start Date (MM/DD/YYYY):\n> ")
-        if 'd' in edit_str:
-            t.end_date = input("Enter End Date (MM/DD/YYYY):\n> ")
-        
-        print(t)
-        confirm = input("Is this information correct? (y/n): ")
-
-    if not exited:
-        return t.get_obj()
-    
-    return None
-
-# Pulls all Tasks from Salesforce and returns valid ones
-def parse_tasks():
-    soql_query = "SELECT Id, Subject, ActivityDate, Description, Status FROM Task LIMIT 100"
-    results = sf.query_all(soql_query)['records']
-
-    to_add = []
-    to_delete = []
-    for result in results:
-        t = Task(result)
-        if t.is_valid():
-            if confirm_task(t):
-                to_add.append(t.get_obj())
-                to_delete.append(result)
-        else:
-            print(t)
+    # Why the task can't be imported as it is, or None
+    def get_problem(self):
+        if not self.is_valid():
+            return 'missing email, start date or end date'
 
-    return to_add, to_delete
+        try:
+            obj = self.get_obj()
+        except ValueError:
+            return 'dates are not MM/DD/YYYY'
 
-# Get Valid Tasks, add as Applicants, then delete the Tasks
-def move_from_tasks():
-    to_add, to_delete = parse_tasks()
+        if obj['End_Date__c'] < obj['Start_Date__c']:
+            return 'end date is before start date'
 
-    if to_add and to_delete:
-        print("Adding Applicants:")
-        for item in to_add:
-            print(item)
+        return None
 
-        utils.insert_to_table(sf, to_add, table='Applicant__c')
-        utils.create_id_csv(to_delete, csv_file='tasks_to_delete.csv')
-        utils.delete_from_csv(sf, csv_file='tasks_to_delete.csv', table='Task')
-    else:
-        print("No valid tasks to process.")
-
-# Raises StopIteration if no spaces left
-# Confirms with user if space is not open or it's from a different contractor
-def confirm_space(spiterator):
-    accepted = False
-
-    while not accepted:
-        contractor, space, space_status = next(spiterator)
-        if space_status != "OPEN" or contractor != "The Quarters on Campus":
-            if contractor != "2215" or contractor != "The Quarters on Campus":
-                continue
-
-            cont = input(f'Space {space} is {space_status} and contractor is {contractor}. \
-                         Do you want to add this space? (y/n/(e)xit):\n> ')
-            match cont.lower():
-                case 'e':
-                    return None
-                case 'n':
-                    continue
-                case 'y':
-                    accepted = True
-        else:
-            accepted = True
+    # Row of the batch review file, valid tasks are approved unless the reviewer says otherwise
+    def to_row(self):
+        problem = self.get_problem()
+        obj = self.get_obj() if not problem else {}
+        return {
+            'Task Id': self.id,
+            'Created': self.created,
+            'Approve': 'n' if problem else 'y',
+            'Name': self.name,
+            'Email': self.email,
+            'Start Date': obj.get('Start_Date__c', self.start_date),
+            'End Date': obj.get('End_Date__c', self.end_date),
+            'Problem': problem or '',
+        }
 
-    return space
-    
+# Every new Task is read in one run: paged through since the last CreatedDate watermark,
+# parsed up front and written to one review file, then the approved ones are imported together
+TASK_WATERMARK_FILE = 'cache/task_watermark.json'
+REVIEW_FILE = 'task_review'
+# Completed Tasks have already been dealt with by hand
+task_where = soql.ne('Status', 'Completed')
+# Most move-in requests kept to be read again, at about 21 characters an Id in the query
+MAX_PENDING = 200
+
+# {'created': newest CreatedDate read, 'ids': Tasks created at that time, 'pending': move-in requests read but not imported},
+# or None to read every Task
+def load_task_watermark(path=TASK_WATERMARK_FILE):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+# Tasks created in the same second as the watermark come back on the next run, so their Ids are kept to skip them
+# Move-in requests that parsed but weren't imported (set to n, or the insert failed) are kept as pending,
+# so the next run reads them again along with the new ones; the newest MAX_PENDING are kept, so the Id IN (...)
+# filter stays short. Tasks that can't be parsed aren't move-in requests (or need fixing in Salesforce first),
+# so they're only listed once, --rescan lists them again
+def save_task_watermark(tasks, imported, watermark=None, path=TASK_WATERMARK_FILE):
+    pending = [task.id for task in tasks if task.id not in imported and not task.get_problem()][-MAX_PENDING:]
+    created = max(task.created for task in tasks)
+    ids = [task.id for task in tasks if task.created == created and task.id not in pending]
+    # Pending Tasks are older than the watermark, a run that only read those leaves it where it was
+    if watermark and watermark['created'] > created:
+        created, ids = watermark['created'], watermark['ids']
+    elif watermark and watermark['created'] == created:
+        ids.extend(watermark['ids'])
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'created': created, 'ids': ids, 'pending': pending}, f)
+
+# Pulls every open Task created since the watermark (all pages), and the pending ones from earlier runs,
+# and parses each one
+@metrics.timed('parse tasks')
+def parse_tasks(watermark=None):
+    cols = ['Id', 'Subject', 'ActivityDate', 'Description', 'Status', 'CreatedDate']
+    since = None
+    if watermark:
+        pending = watermark.get('pending')
+        since = soql.or_(soql.ge('CreatedDate', soql.parse_datetime(watermark['created'])), soql.in_('Id', pending) if pending else None)
+    results = utils.query_table(sf, 'task', soql.and_(task_where, since), cols=cols, order_by='CreatedDate', cache=False)['records']
+
+    seen = set(watermark['ids']) if watermark else set()
+    return [Task(result) for result in results if result['Id'] not in seen]
+
+# Approved rows of the review file as (Task Id, Applicant), with any edits the reviewer made
+def read_review(review_file):
+    approved = []
+    for row in utils.read_records_from_csv(review_file):
+        if row['Approve'].strip().lower() not in ('y', 'yes'):
+            continue
 
-# Assign parking spaces to each applicant
-# Yields lists of IDs to delete and records to insert
-# Each batch is grouped by move-in date
-def assign_spaces(to_move):
-    # Move-ins grouped by start month and year
-    move_ins = {}
-    for person in to_move:
-        year, month, _ = person['Start_Date__c'].split("-")
-        start = sp.date_of_last_day_of_month(int(year), int(month))
-        if start not in move_ins:
-            move_ins[start] = []
-
-        move_ins[start].append(person)
-
-    # Gets available spaces for each move-in date and assigns to applicants in group
-    # Yields IDs to delete and records to insert
-    # Does this so that sp.get_open_spaces() will update in-between each batch
-    space_lookup = utils.set_parking_spaces(sf)
-    contractor_lookup = utils.set_lease_owners(sf)
-    for start, applicants in move_ins.items():
-        result = []
-        ids = []
-        print(f'Finding spaces for move-ins on {start}...')
-        spiterator = SpaceIterator(sp.get_open_spaces(start))
-        for applicant in applicants:
-            try:
-                if not applicant['Pass_Number__c']:
-                    print(f'No parking pass specified for {applicant["Full_Name__c"]}. Skipping.')
-                    continue
+        try:
+            start = dt_date.fromisoformat(row['Start Date'].strip())
+            end = dt_date.fromisoformat(row['End Date'].strip())
+        except ValueError:
+            print(f"Skipping {row['Task Id']} ({row['Name']}): dates must be YYYY-MM-DD.")
+            continue
 
-                space = confirm_space(spiterator)
-                if not space:
-                    continue
+        if not row['Email'] or end < start:
+            print(f"Skipping {row['Task Id']} ({row['Name']}): needs an email and an end date after the start date.")
+            continue
 
-                # Add Space, Contractor, and prepare ID for deletion
-                applicant['Parking_Space__c'] = space_lookup[space]
-                applicant['Lease_Contract_Owner__c'] = contractor_lookup["The Quarters on Campus"]
-                ids.append({'Id': applicant['Id']})
-                del applicant['Id']
-                result.append(applicant)
+        approved.append((row['Task Id'], {
+            'Email__c': row['Email'].strip(),
+            'Full_Name__c': row['Name'].strip(),
+            'Start_Date__c': start.isoformat(),
+            'End_Date__c': end.isoformat()
+        }))
+
+    return approved
+
+# Add the approved Tasks as Applicants, then delete the Tasks whose Applicant was inserted
+# Returns the Ids of the Tasks that were imported
+def import_tasks(approved):
+    if not approved:
+        print("No approved tasks to import.")
+        return set()
+
+    print(f"Adding {len(approved)} Applicants...")
+    job = bulk.run(sf, [bulk.BulkJob('Applicant__c', 'insert', [applicant for _, applicant in approved])]).jobs[0]
+    print(job)
+    if job.error or job.state != 'JobComplete':
+        print("Applicant insert failed, no Tasks deleted.")
+        return set()
+
+    failed = {(r.get('Email__c'), r.get('Start_Date__c')) for r in job.failed_records}
+    done = [task_id for task_id, applicant in approved if (applicant['Email__c'], applicant['Start_Date__c']) not in failed]
+    if done:
+        print(bulk.run(sf, [bulk.BulkJob('Task', 'delete', [{'Id': task_id} for task_id in done])]))
+
+    return set(done)
+
+# Parse every new Task into one review file, then import the approved ones
+# The reviewer can set Approve to n or fix a name, email or date in the file before continuing
+# Tasks that weren't imported stay pending in the watermark, so they're read again next run
+@metrics.timed('tasks')
+def move_from_tasks(yes=False, rescan=False):
+    watermark = None if rescan else load_task_watermark()
+    tasks = parse_tasks(watermark)
+    if not tasks:
+        print("No new tasks to process.")
+        return
 
-            except StopIteration:
-                print(f'Ran out of spaces on {applicant['Full_Name__c']} for date {start}.')
-                break
+    review_file = utils.create_csv(REVIEW_FILE, [task.to_row() for task in tasks], delete=True)
+    invalid = sum(1 for task in tasks if task.get_problem())
+    print(f"{len(tasks)} new tasks ({invalid} need fixing) written to {review_file}.")
+
+    if not yes:
+        answer = input(f"Review {review_file} (set Approve to n to skip a task, or fix its fields),\nthen press Enter to import or x to exit:\n> ")
+        if answer.strip().lower() == 'x':
+            return
+
+    save_task_watermark(tasks, import_tasks(read_review(review_file)), watermark)
+
+# Paid applicants with a monthly rate, waiting for a space
+def get_applicants():
+    cols = ['Id', 'Start_Date__c', 'End_Date__c', 'Full_Name__c', 'Email__c', 'Status__c', 'Monthly_Rate__c', 'Pass_Number__c']
+    where = soql.and_(soql.eq('Status__c', 'Paid'), soql.ne('Monthly_Rate__c', None))
+    results = utils.query_table(sf, 'applicant', where, cols=cols)['records']
+    return [r for r in results if r['Status__c'] == 'Paid' and r['Monthly_Rate__c']]
+
+# Lease record for an applicant placed on a space
+def get_lease(applicant, space_id, owner_id):
+    return {
+        'Start_Date__c': applicant['Start_Date__c'],
+        'End_Date__c': applicant['End_Date__c'],
+        'Email__c': applicant['Email__c'],
+        'Lessee_Name__c': applicant['Full_Name__c'],
+        'Monthly_Rate__c': applicant['Monthly_Rate__c'],
+        'Pass_Number__c': applicant['Pass_Number__c'],
+        'Parking_Space__c': space_id,
+        'Lease_Contract_Owner__c': owner_id,
+    }
+
+# Counts per status, and every applicant that needs a look (the plan file has the rest)
+def print_plan(plan):
+    for status in (assign.ASSIGNED, assign.REVIEW, assign.UNASSIGNED):
+        assignments = [a for a in plan if a.status == status]
+        print(f'{status.capitalize()}: {len(assignments)}')
+        if status == assign.ASSIGNED:
+            continue
 
-        yield ids, result
+        for assignment in assignments:
+            print(f'  {assignment}')
 
 # Move Applicants to Leases in Salesforce
-# Queries Applicants with 'Paid' status and a monthly rate set
-# Assigns a parking space to valid applicants and inserts as Leases
-# Deletes moved Applicants from Salesforce
-def move_from_applicants():
-    soql_query = "SELECT Id, Start_Date__c, End_Date__c, Full_Name__c, Email__c, Status__c, Monthly_Rate__c, Pass_Number__c FROM Applicant__c LIMIT 100"
-    results = sf.query_all(soql_query)['records']
-    valid = [r for r in results if r['Status__c'] == 'Paid' and r['Monthly_Rate__c']]
-    if not valid:
+# Queries Applicants with 'Paid' status and a monthly rate set, and places all of them in one pass (see assign.py)
+# The plan is written to logs/move_plan.csv, and only assigned spaces are moved in unless include_review is set
+# A plan file (an edited move_plan.csv) is re-checked against the current leases and applied as written
+# Moved Applicants are deleted from Salesforce
+@metrics.timed('applicants')
+def move_from_applicants(dry_run=False, include_review=False, plan_file=None):
+    applicants = get_applicants()
+    if not applicants:
         print('No applicants to move.')
         return
 
-    # Prepare records for lease insertion
-    for applicant in valid:
-        applicant['Lessee_Name__c'] = applicant['Full_Name__c']
-        del applicant['Status__c']
-        del applicant['Full_Name__c']
-        del applicant['attributes']
+    timeline = get_timeline(sf)
+    if plan_file:
+        plan = assign.from_rows(utils.read_records_from_csv(plan_file), applicants, timeline)
+    else:
+        plan = assign.plan(applicants, timeline)
+        plan_csv = utils.create_csv('move_plan', [a.to_row() for a in plan], delete=True)
+        print(f'Plan written to {plan_csv}.')
 
-    file = 'applicants_to_delete.csv'
-    remove_ids = []
-    for ids, move_in_list in assign_spaces(valid):
-        if not move_in_list:
-            continue
+    print_plan(plan)
+    if dry_run:
+        return
+
+    moving = [a for a in plan if a.status == assign.ASSIGNED or (include_review and a.status == assign.REVIEW)]
+    if not moving:
+        print('No applicants to move in.')
+        return
 
-        date_val = datetime.strptime(move_in_list[0]['Start_Date__c'], "%Y-%m-%d").strftime("%B %Y")
-        print(f'Moving in {len(move_in_list)} applicants for {date_val}...')
-        result = utils.insert_to_table(sf, move_in_list, table='Leases__c', save_success=True)
-        if not result:
-            print('Error inserting leases. Aborting move-in.')
+    # One insert job per move-in month, all submitted together
+    owner_id = utils.set_lease_owners(sf)[assign.QUARTERS]
+    months = {}
+    for assignment in moving:
+        months.setdefault(assignment.start().strftime("%B %Y"), []).append(assignment)
+
+    jobs = []
+    month_ids = []
+    for month, assignments in months.items():
+        print(f'Moving in {len(assignments)} applicants for {month}...')
+        leases = [get_lease(a.applicant, a.space.id, owner_id) for a in assignments]
+        jobs.append(bulk.BulkJob('Leases__c', 'insert', leases, name=f'Move-ins {month}'))
+        month_ids.append([{'Id': a.applicant['Id']} for a in assignments])
+
+    result = bulk.run(sf, jobs, save_success=True)
+    print(result)
+
+    # Only remove Applicants whose month was inserted cleanly
+    remove_ids = []
+    for job, ids in zip(jobs, month_ids):
+        if not job.ok():
+            print(f'Error inserting leases for {job.name}. Aborting move-in.')
             continue
 
         remove_ids.extend(ids)
 
     if remove_ids:
-        utils.create_id_csv(csv_file=file, id_list=remove_ids)
-        utils.delete_from_csv(sf, csv_file=file, table='Applicant__c')
+        utils.delete_from_table(sf, remove_ids, table='Applicant__c')
         print(f'{len(remove_ids)} Applicant{"s" if len(remove_ids) != 1 else ""} deleted.')
 
 def parse_args():
@@ -287,6 +320,19 @@ def parse_args():
         help='Tasks to Applicants',
     )
 
+    parser.add_argument(
+        '-y',
+        '--yes',
+        action='store_true',
+        help='Import every valid task without stopping to review the file',
+    )
+
+    parser.add_argument(
+        '--rescan',
+        action='store_true',
+        help='Read every open task, not just the ones created since the last run',
+    )
+
     parser.add_argument(
         '-a',
         '--applicants',
@@ -294,15 +340,38 @@ def parse_args():
         help='Applicants to Leases'
     )
 
+    parser.add_argument(
+        '-n',
+        '--dry-run',
+        action='store_true',
+        help='Only write the space assignment plan (logs/move_plan.csv)'
+    )
+
+    parser.add_argument(
+        '-r',
+        '--include-review',
+        action='store_true',
+        help='Also move in applicants whose space is marked for review'
+    )
+
+    parser.add_argument(
+        '-p',
+        '--plan-file',
+        type=str,
+        required=False,
+        help='Apply a reviewed plan file instead of planning again'
+    )
+
     return parser.parse_args()
 
 # Get Valid Tasks, add as Applicants, then delete the Tasks
+@metrics.command('sf_move')
 def main():
     args = parse_args()
     if args.tasks:
-        move_from_tasks()
+        move_from_tasks(yes=args.yes, rescan=args.rescan)
     if args.applicants:
-        move_from_applicants()
+        move_from_applicants(dry_run=args.dry_run, include_review=args.include_review, plan_file=args.plan_file)
 
     if not args.tasks and not args.applicants:
         print("No action specified. Use -t to move from Tasks to Applicants or -a to move from Applicants to Leases.")
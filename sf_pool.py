@@ -1,8 +1,11 @@
 import utils
-from tables.pool import pool_cols
-from tables.lease import lease_cols
+import mirror
+import metrics
+import soql
+from tables.pool import Pooled_Lease
 from auth import sf
 import argparse
+import datetime as dt
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Manage leases and pooled leases.')
@@ -12,37 +15,54 @@ def parse_args():
     return parser.parse_args()
 
 def get_dates_from_quarter(quarter, year):
-    begin_date = f"{year}-{'%02d' % ((quarter - 1) * 3 + 1)}-01"
-    last_date = f"{year}-{'%02d' % ((quarter - 1) * 3 + 3)}-02"
+    begin_date = dt.date(year, (quarter - 1) * 3 + 1, 1)
+    last_date = dt.date(year, (quarter - 1) * 3 + 3, 2)
     return begin_date, last_date
+
+# Pooled leases whose lease started in the quarter
+def pool_where(quarter, year):
+    begin_date, last_date = get_dates_from_quarter(quarter, year)
+    return soql.between('Lease_Id__r.Start_Date__c', begin_date, last_date)
     
+@metrics.timed('pull leases')
 def get_leases_from_quarter(quarter, year):
     begin_date, last_date = get_dates_from_quarter(quarter, year)
-    where = f"WHERE Start_Date__c <= {last_date} AND Start_Date__c >= {begin_date} AND Lease_Contract_Owner__r.name = 'The Quarters on Campus'"
 
+    where = soql.and_(
+        soql.between('Start_Date__c', begin_date, last_date),
+        soql.eq('Lease_Contract_Owner__r.Name', 'The Quarters on Campus')
+    )
 
-    return utils.query_table(sf, 'lease', where)['records']
+    return mirror.select(sf, 'lease', where)['records']
 
+@metrics.timed('pull pool')
 def get_pool_from_quarter(quarter, year):
-    begin_date, last_date = get_dates_from_quarter(quarter, year)
-    print(begin_date, last_date)
-    where = f"WHERE Lease_Id__r.Start_Date__c <= {last_date} AND Lease_Id__r.Start_Date__c >= {begin_date}"
+    print(*get_dates_from_quarter(quarter, year))
+    result = utils.query_table(sf, 'pool', pool_where(quarter, year), cols=['Id', 'TT15_Share__c', 'Lease_ID__c'])
+    return Pooled_Lease.from_query_result(result)
 
-    return utils.query_table(sf, 'pool', where)['records']
+# Size of the pool and its share percent, without pulling the pool itself
+@metrics.timed('pull pool')
+def get_pool_summary(quarter, year):
+    summary = utils.aggregate_table(sf, 'pool', {'leases': 'COUNT(Id)', 'share': 'MAX(TT15_Share__c)'}, pool_where(quarter, year))
+    return summary[0] if summary else {'leases': 0, 'share': None}
 
 # Choose lease Ids to add to the pool based on amount needed
 def choose_to_add(leases, pool, amount):
-    pool_lease_ids = set(r['Lease_ID__r']['Id'] for r in pool)
-    lease_ids = set(r['Id'] for r in leases)
+    pool_lease_ids = set(pooled.lease_ref for pooled in pool)
+    lease_ids = set(lease.id for lease in leases)
     available_to_add = lease_ids - pool_lease_ids
 
     if not len(available_to_add):
         print('No available leases to add to the pool.')
         return []
 
-    where = f"WHERE Contractor_Name__r.name = 'The Quarters on Campus' AND Building__c = 'KN'"
-    spaces = set(s['Name'] for s in utils.query_table(sf, 'parking', where)['records'])
-    lease_lookup = {r['Id']: r for r in leases if r['Id'] in available_to_add and r['Parking_Space__r']['Name'] in spaces}
+    where = soql.and_(
+        soql.eq('Contractor_Name__r.Name', 'The Quarters on Campus'),
+        soql.eq('Building__c', 'KN')
+    )
+    spaces = set(space.name for space in mirror.select(sf, 'parking', where)['records'])
+    lease_lookup = {lease.id: lease for lease in leases if lease.id in available_to_add and lease.parking_space in spaces}
     result = []
     for space in available_to_add:
         if space in lease_lookup:
@@ -57,18 +77,19 @@ def update_lease_pool_date(leases_to_add, pool_quarter, pool_year):
     to_update = []
     for lease in leases_to_add:
         record = {
-            'Id': lease['Id'],
+            'Id': lease.id,
             'Pool_Quarter__c': f'Q{pool_quarter} {pool_year}'
         }
         to_update.append(record)
 
     return utils.update_table(sf, to_update, table='Leases__c')
 
+@metrics.timed('write pool')
 def add_to_pool(leases_to_add, share_percent, quarter, year):
     to_insert = []
     for lease in leases_to_add:
         record = {
-            'Lease_ID__c': lease['Id'],
+            'Lease_ID__c': lease.id,
             'TT15_Share__c': share_percent,
         }
         to_insert.append(record)
@@ -86,7 +107,7 @@ def add_from_target(pool, target, quarter, year):
     leases_to_add = choose_to_add(leases, pool, target - len(pool))
     
     print(f'Adding {len(leases_to_add)} leases to the pool for Q{quarter} {year}.')
-    share_percent = pool[0]['TT15_Share__c']
+    share_percent = pool[0].share
 
     cont = input(f'Proceed to add leases with TT15 Share Amount of {share_percent*100}%? (y/n): ')
     if cont.lower() != 'y':
@@ -96,6 +117,7 @@ def add_from_target(pool, target, quarter, year):
     return add_to_pool(leases_to_add, share_percent, quarter, year)
 
 
+@metrics.command('sf_pool')
 def main():
     args = parse_args()
     if args.quarter and args.quarter not in [1, 2, 3, 4]:
@@ -113,18 +135,23 @@ def main():
         quarter = 3
         year = 2025
 
-    pool = get_pool_from_quarter(quarter, year)
-
-    if not pool:
-        print(f'No leases found in the pool for Q{quarter} {year}.')
-        return
-    
     if args.target:
+        pool = get_pool_from_quarter(quarter, year)
+        if not pool:
+            print(f'No leases found in the pool for Q{quarter} {year}.')
+            return
+
         add_from_target(pool, args.target, quarter, year)
         return
-    
-    print(f'Leases in the pool for Q{quarter} {year}: {len(pool)}')
-    print(f'Percentage for each lease: {pool[0]["TT15_Share__c"]*100}%')
+
+    # Only the size and share are printed, so let Salesforce count
+    summary = get_pool_summary(quarter, year)
+    if not summary['leases']:
+        print(f'No leases found in the pool for Q{quarter} {year}.')
+        return
+
+    print(f'Leases in the pool for Q{quarter} {year}: {summary["leases"]}')
+    print(f'Percentage for each lease: {summary["share"]*100}%')
     
 if __name__ == '__main__':
     main()
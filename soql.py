@@ -0,0 +1,246 @@
+import datetime as dt
+from functools import lru_cache
+
+# SOQL query builder
+# WHERE clauses are built from predicates instead of f-strings, so literals are always
+# quoted and escaped the same way, and the same predicate can filter mirror records locally
+#
+# Usage:
+#   where = soql.and_(soql.ge('End_Date__c', today), soql.eq('Lease_Contract_Owner__r.Name', 'Hardin House'))
+#   soql.build('Leases__c', ['Id', 'End_Date__c'], where)   # for sf.query_all
+#   mirror.select(sf, 'lease', where)                        # same filter on the local copy
+
+# Record date/datetime formats, as returned by Salesforce
+DATE_FORMAT = '%Y-%m-%d'
+DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z')
+
+# Python value -> SOQL literal
+# Dates and datetimes are unquoted in SOQL, strings are quoted with \ and ' escaped
+def literal(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, dt.datetime):
+        if value.tzinfo:
+            value = value.astimezone(dt.timezone.utc)
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    if isinstance(value, dt.date):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, (int, float)):
+        return repr(value)
+
+    escaped = str(value).replace('\\', '\\\\').replace("'", "\\'")
+    return f"'{escaped}'"
+
+@lru_cache(maxsize=None)
+def parse_datetime(value):
+    for fmt in DATETIME_FORMATS:
+        try:
+            return dt.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+
+    return None
+
+# Value at a dotted path (Parking_Space__r.Name) in a record from query_all or the mirror
+# Salesforce returns fields in their defined case whatever case the query used
+def get_value(record, path):
+    value = record
+    for name in path.split('.'):
+        if value is None:
+            return None
+        if name not in value:
+            name = next((key for key in value if key.lower() == name.lower()), name)
+        value = value.get(name)
+
+    return value
+
+# Predicate value as it compares against record values
+# Record dates are YYYY-MM-DD strings, which already sort as dates
+def local_value(value):
+    if isinstance(value, dt.datetime):
+        return value
+    if isinstance(value, dt.date):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, str):
+        # Text comparisons in SOQL ignore case
+        return value.casefold()
+
+    return value
+
+# Record value in a form comparable with a local_value()
+def comparable(value, other):
+    if isinstance(value, str):
+        if isinstance(other, dt.datetime):
+            return parse_datetime(value)
+        return value.casefold()
+
+    return value
+
+OPERATORS = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+# Predicates are callable on a record, so they can be passed straight to mirror.select
+class Predicate():
+    def __call__(self, record):
+        return self.matches(record)
+
+    def __and__(self, other):
+        return and_(self, other)
+
+    def __or__(self, other):
+        return or_(self, other)
+
+    def __str__(self):
+        return self.to_soql()
+
+class Condition(Predicate):
+    def __init__(self, field, op, value):
+        if op not in OPERATORS:
+            raise ValueError(f'Unsupported operator {op}')
+        self.field = field
+        self.op = op
+        self.value = value
+        self.local = local_value(value)
+
+    def to_soql(self):
+        return f'{self.field} {self.op} {literal(self.value)}'
+
+    # Comparisons against null only match = / !=, same as SOQL
+    def matches(self, record):
+        value = comparable(get_value(record, self.field), self.local)
+        if value is None or self.value is None:
+            if self.op == '=':
+                return value is None and self.value is None
+            if self.op == '!=':
+                return (value is None) != (self.value is None)
+            return False
+
+        return OPERATORS[self.op](value, self.local)
+
+class In(Predicate):
+    def __init__(self, field, values, negate=False):
+        self.field = field
+        self.values = list(values)
+        self.local = {local_value(v) for v in self.values}
+        self.negate = negate
+
+    def to_soql(self):
+        op = 'NOT IN' if self.negate else 'IN'
+        return f"{self.field} {op} ({', '.join(literal(v) for v in self.values)})"
+
+    def matches(self, record):
+        value = get_value(record, self.field)
+        found = value is not None and comparable(value, None) in self.local
+        return found != self.negate
+
+# Nested predicates with the same operator are flattened, so a AND (b AND c) is written a AND b AND c
+class Combined(Predicate):
+    def __init__(self, op, predicates):
+        self.op = op
+        self.predicates = []
+        for p in predicates:
+            if isinstance(p, Combined) and p.op == op:
+                self.predicates.extend(p.predicates)
+            elif p is not None:
+                self.predicates.append(p)
+
+    def to_soql(self):
+        if len(self.predicates) == 1:
+            return self.predicates[0].to_soql()
+        return f' {self.op} '.join(f'({p.to_soql()})' if isinstance(p, Combined) else p.to_soql() for p in self.predicates)
+
+    def matches(self, record):
+        check = all if self.op == 'AND' else any
+        return check(p.matches(record) for p in self.predicates)
+
+class Not(Predicate):
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def to_soql(self):
+        return f'NOT ({self.predicate.to_soql()})'
+
+    def matches(self, record):
+        return not self.predicate.matches(record)
+
+def eq(field, value):
+    return Condition(field, '=', value)
+
+def ne(field, value):
+    return Condition(field, '!=', value)
+
+def lt(field, value):
+    return Condition(field, '<', value)
+
+def le(field, value):
+    return Condition(field, '<=', value)
+
+def gt(field, value):
+    return Condition(field, '>', value)
+
+def ge(field, value):
+    return Condition(field, '>=', value)
+
+def in_(field, values):
+    return In(field, values)
+
+def not_in(field, values):
+    return In(field, values, negate=True)
+
+# field between low and high, inclusive
+def between(field, low, high):
+    return and_(ge(field, low), le(field, high))
+
+# None predicates are dropped, so optional filters can be passed in directly
+def and_(*predicates):
+    return Combined('AND', predicates)
+
+def or_(*predicates):
+    return Combined('OR', predicates)
+
+def not_(predicate):
+    return Not(predicate)
+
+# 'a, b' or ['a', 'b'] -> 'a, b'
+def columns(cols):
+    if isinstance(cols, str):
+        return cols
+    return ', '.join(cols)
+
+# SELECT statement for query_all
+# where is a predicate (a raw 'WHERE ...' string is passed through as-is)
+def build(table, cols, where=None, order_by=None, limit=None, group_by=None):
+    parts = [f'SELECT {columns(cols)} FROM {table}']
+    if isinstance(where, str):
+        if where:
+            parts.append(where)
+    elif where is not None and (not isinstance(where, Combined) or where.predicates):
+        parts.append(f'WHERE {where.to_soql()}')
+    if group_by:
+        parts.append(f'GROUP BY {columns(group_by)}')
+    if order_by:
+        parts.append(f'ORDER BY {columns(order_by)}')
+    if limit is not None:
+        parts.append(f'LIMIT {int(limit)}')
+
+    return ' '.join(parts)
+
+# SELECT COUNT() ..., only totalSize comes back, no records
+def count(table, where=None):
+    return build(table, 'COUNT()', where)
+
+# Aggregate projection, e.g. aggregate('Pooled_Lease__c', {'n': 'COUNT(Id)', 'share': 'MAX(TT15_Share__c)'})
+# Each result row has the aliases as keys
+def aggregate(table, aggregates, where=None, group_by=None):
+    cols = [f'{expression} {alias}' for alias, expression in aggregates.items()]
+    if group_by:
+        cols = [columns(group_by)] + cols
+    return build(table, cols, where, group_by=group_by)
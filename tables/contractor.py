@@ -1,9 +1,14 @@
+from tables.record import Record
+
 contractor_cols = ", ".join(['Id', 'Name'])
 
-class Contractor():
-    def __init__(self, oDict):
-        self.id = oDict['Id']
-        self.name = oDict['Name']
+class Contractor(Record):
+    __slots__ = ('id', 'name')
+
+    fields = {
+        'Id': 'id',
+        'Name': 'name',
+    }
 
     def __str__(self):
-        return f"Contractor: {self.name}"
\ No newline at end of file
+        return f"Contractor: {self.name}"
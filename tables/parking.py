@@ -1,10 +1,20 @@
+from tables.record import Record
+
 parking_cols = ', '.join(['Id', 'Name', 'Contractor_Name__c', 'Building__c', 'Contractor_Name__r.name'])
 
-class Parking_Space():
-    def __init__(self, oDict):
-        self.id = oDict['Id']
-        self.name = oDict['Name']
-        self.contractor_ref = oDict['Contractor_Name__c']
+class Parking_Space(Record):
+    __slots__ = ('id', 'name', 'contractor_ref', 'building', 'contractor')
+
+    fields = {
+        'Id': 'id',
+        'Name': 'name',
+        'Contractor_Name__c': 'contractor_ref',
+        'Building__c': 'building',
+    }
+
+    relationships = {
+        'Contractor_Name__r': {'Name': 'contractor'},
+    }
 
     def __str__(self):
-        return f'{self.name} - Contractor Reference: {self.contractor_ref}'
\ No newline at end of file
+        return f'{self.name} - Contractor Reference: {self.contractor_ref}'
@@ -1,14 +1,34 @@
+from tables.record import Record
+
 pool_cols = ', '.join(['Id', 'TT15_Share__c', 'TT15_Share_Amt__c', 'Lease_Id__r.Monthly_Rate__c', 'Lease_Id__r.Id', 'Lease_Id__r.Lessee_Name__c', 'Lease_Id__r.Start_Date__c', 'Lease_Id__r.End_Date__c', 'Lease_Id__r.Pool_Quarter__c'])
 
-class Pooled_Lease():
-    def __init__(self, oDict):
-        self.id = oDict['Id']
-        self.share = oDict['TT15_Share__c']
-        self.share_amt = oDict['TT15_Share_Amt__c']
-        self.lease_rate = oDict['Lease_Id__r.Monthly_Rate__c']
-        self.lease_start = oDict['Lease_Id__r.Start_Date__c']
-        self.lease_end = oDict['Lease_Id__r.End_Date__c']
-        self.pool_quarter = oDict['Lease_Id__r.Pool_Quarter__c']
+class Pooled_Lease(Record):
+    __slots__ = (
+        'id', 'share', 'share_amt', 'lease_ref', 'lease_rate', 'lessee_name',
+        'lease_start', 'lease_end', 'pool_quarter'
+    )
+
+    fields = {
+        'Id': 'id',
+        'TT15_Share__c': 'share',
+        'TT15_Share_Amt__c': 'share_amt',
+        'Lease_ID__c': 'lease_ref',
+    }
+
+    # Lease_ID__c is only set when it is queried directly, Lease_ID__r.Id fills it otherwise
+    relationships = {
+        'Lease_ID__r': {
+            'Id': 'lease_ref',
+            'Monthly_Rate__c': 'lease_rate',
+            'Lessee_Name__c': 'lessee_name',
+            'Start_Date__c': 'lease_start',
+            'End_Date__c': 'lease_end',
+            'Pool_Quarter__c': 'pool_quarter',
+        },
+    }
+
+    dates = ('lease_start', 'lease_end')
+    numbers = ('share', 'share_amt', 'lease_rate')
 
     def __str__(self):
-        return f'Pooled Lease ID: {self.id} - Share: {self.share} ({self.share_amt}), Lease Rate: {self.lease_rate} from {self.lease_start} to {self.lease_end}'
\ No newline at end of file
+        return f'Pooled Lease ID: {self.id} - Share: {self.share} ({self.share_amt}), Lease Rate: {self.lease_rate} from {self.lease_start} to {self.lease_end}'
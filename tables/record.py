@@ -0,0 +1,138 @@
+import datetime as dt
+from functools import lru_cache
+
+# Base for the typed table records
+# Fields are kept in __slots__ attributes instead of the nested dicts query_all returns,
+# and dates are parsed once into datetime.date
+# Records can still be read like the query result (record['Start_Date__c'], record['Parking_Space__r']['Name'])
+# so code that expects dicts keeps working, but hot loops should use the attributes
+
+# The same few hundred dates repeat across every lease, so each string is parsed once
+# and all records on that date share one date object
+@lru_cache(maxsize=None)
+def parse_date(d):
+    if not d:
+        return None
+    if isinstance(d, dt.date):
+        return d
+    return dt.date.fromisoformat(d[:10])
+
+def format_date(d):
+    return d.isoformat() if d else None
+
+def parse_flag(value):
+    return value.lower() == 'true'
+
+class Record():
+    __slots__ = ()
+
+    # Salesforce field -> attribute
+    fields = {}
+    # Relationship -> {field on the related record -> attribute}
+    relationships = {}
+    # Attributes holding dates
+    dates = ()
+    # Attributes holding numbers and checkboxes, Bulk API csv rows have them as text
+    numbers = ()
+    flags = ()
+
+    # (field, attr, is date) per field and relationship, and the csv conversions, worked out once per class
+    # so building a record is a straight run of setattrs
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._related = [
+            (relationship, [(field, attr, attr in cls.dates) for field, attr in related_fields.items()])
+            for relationship, related_fields in cls.relationships.items()
+        ]
+        cls._fields = [(field, attr, attr in cls.dates) for field, attr in cls.fields.items()]
+        related_attrs = {attr for related_fields in cls.relationships.values() for attr in related_fields.values()}
+        cls._shared = {attr for attr in cls.fields.values() if attr in related_attrs}
+
+        types = {attr: float for attr in cls.numbers}
+        types.update({attr: parse_flag for attr in cls.flags})
+        cls._types = [(None, field, types[attr]) for field, attr in cls.fields.items() if attr in types] + [
+            (relationship, field, types[attr])
+            for relationship, related_fields in cls.relationships.items()
+            for field, attr in related_fields.items() if attr in types
+        ]
+
+    # Fields missing from oDict (not queried) are None
+    # A field that is also read through a relationship (Lease_ID__c / Lease_ID__r.Id) takes whichever was queried
+    def __init__(self, oDict):
+        setattr = object.__setattr__
+        for relationship, related_fields in self._related:
+            related = oDict.get(relationship) or {}
+            for field, attr, is_date in related_fields:
+                value = related.get(field)
+                setattr(self, attr, parse_date(value) if is_date and value else value)
+
+        shared = self._shared
+        for field, attr, is_date in self._fields:
+            if attr in shared and field not in oDict:
+                continue
+            value = oDict.get(field)
+            setattr(self, attr, parse_date(value) if is_date and value else value)
+
+    # Bulk API csv values ('150.0', 'true') -> the types query_all returns, in place
+    # Takes a row already nested like query_all's (see bulk.parse_row)
+    @classmethod
+    def convert(cls, row):
+        for relationship, field, to_type in cls._types:
+            target = row.get(relationship) if relationship else row
+            if target and target.get(field) is not None:
+                target[field] = to_type(target[field])
+
+        return row
+
+    # Records for every row of a query_all result (or a list of rows)
+    @classmethod
+    def from_query_result(cls, result):
+        records = result['records'] if isinstance(result, dict) else result
+        return [cls(record) for record in records]
+
+    def set(self, attr, value):
+        object.__setattr__(self, attr, parse_date(value) if attr in self.dates else value)
+
+    def get_attr(self, attr):
+        value = object.__getattribute__(self, attr)
+        return format_date(value) if attr in self.dates else value
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            return self.get_attr(self.fields[key])
+
+        if key in self.relationships:
+            related = {field: self.get_attr(attr) for field, attr in self.relationships[key].items()}
+            return related if any(value is not None for value in related.values()) else None
+
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError(key)
+        self.set(self.fields[key], value)
+
+    def __contains__(self, key):
+        return key in self.fields or key in self.relationships
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def keys(self):
+        return self.fields.keys()
+
+    def items(self):
+        return ((key, self[key]) for key in self.fields)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    # Same shape as a query_all row, without attributes
+    def to_dict(self):
+        result = dict(self.items())
+        for relationship in self.relationships:
+            result[relationship] = self[relationship]
+        return result
@@ -2,11 +2,17 @@ import csv
 import os
 import shutil
 import datetime as dt
+import bulk
+import diff
+import metrics
+import governor
+import soql
+import query_cache
+import partition
 import tables.lease as lease
 import tables.parking as parking
 import tables.contractor as contractor
 import tables.pool as pool
-from dotenv import load_dotenv
 
 # Ease for queries
 tables = {
@@ -38,30 +44,80 @@ tables = {
     }
 }
 
-# Generic function to query any table with any where clause       
-def query_table(sf, table, where=""):
-    name = tables[table]['name']
-    cols = tables[table]['columns']
+# Generic function to query any table
+# where is a soql predicate, e.g. soql.eq('Building__c', 'KN')
+# cols narrows the table's default columns to what the caller needs, kwargs go to sf.query_all (e.g. include_deleted)
+# Results are served from query_cache until they expire or the table is written, cache=False always queries
+# partition_by ('quarter', 'building' or 'id') fetches disjoint ranges concurrently, see partition.py
+def query_table(sf, table, where=None, cols=None, order_by=None, limit=None, cache=True, partition_by=None, **kwargs):
+    if partition_by and limit is None:
+        return partition.query(sf, table, partition_by, where, cols=cols, order_by=order_by, cache=cache, **kwargs)
+
+    if not cols:
+        cols = tables[table]['columns']
+
+    query = soql.build(tables[table]['name'], cols, where, order_by=order_by, limit=limit)
+    return run_query(sf, query, cache=cache, **kwargs)
+
+# Number of rows matching where, without pulling any of them
+def count_table(sf, table, where=None, **kwargs):
+    return run_query(sf, soql.count(tables[table]['name'], where), **kwargs)['totalSize']
+
+# Aggregate rows, e.g. aggregate_table(sf, 'pool', {'total': 'SUM(TT15_Share_Amt__c)'})
+# Returns one row per group (or a single row), keyed by alias
+def aggregate_table(sf, table, aggregates, where=None, group_by=None):
+    result = run_query(sf, soql.aggregate(tables[table]['name'], aggregates, where, group_by=group_by))
+    return [{key: val for key, val in row.items() if key != 'attributes'} for row in result['records']]
+
+def run_query(sf, query, cache=True, **kwargs):
+    if cache:
+        result = query_cache.get(query, grace=governor.cache_grace(), **kwargs)
+        if result is not None:
+            metrics.count('soql_cache_hits')
+            return result
+
+    with metrics.stage('soql'):
+        result = sf.query_all(query, **kwargs)
+
+    metrics.count('soql_queries')
+    metrics.count('records_read', len(result['records']))
+    if cache:
+        query_cache.put(query, result, **kwargs)
+    return result
 
-    return sf.query_all(f"SELECT {cols} FROM {name} {where}")
+# Every row of a table through a Bulk API 2.0 query job, for full-history pulls (audits, backfills)
+# Rows are yielded as the result csv downloads instead of collected like query_all,
+# as typed records for tables that have one (raw=True gives query_all shaped dicts)
+# Never cached, and the job has to finish on Salesforce's side before the first row comes back
+def export_table(sf, table, where=None, cols=None, include_deleted=False, raw=False):
+    if not cols:
+        cols = tables[table]['columns']
+
+    query = soql.build(tables[table]['name'], cols, where)
+    record_type = tables[table].get('object')
+    for row in bulk.query(sf, query, include_deleted=include_deleted):
+        if record_type:
+            record_type.convert(row)
+        yield row if raw or not record_type else record_type(row)
 
 # Get all leases from Salesforce
 # Quarters clause can be added to filter to only The Quarters on Campus leases
+# Served from the local mirror, which only pulls rows changed since the last run
 def get_leases(sf, quarters=False):
-    if not quarters:
-        return query_table(
-            sf, 
-            'lease',
-            f"WHERE End_Date__c >= {dt.datetime.today().strftime('%Y-%m-%d')}"
-        )
-    
-    return query_table(
-        sf,
-        'lease', 
-        f"WHERE Lease_Contract_Owner__r.name = 'The Quarters on Campus'\
-        AND End_Date__c >= {dt.datetime.now().strftime('%Y-%m-%d')}"
+    import mirror
+    today = dt.date.today()
+    where = soql.and_(
+        soql.ge('End_Date__c', today),
+        soql.eq('Lease_Contract_Owner__r.Name', 'The Quarters on Campus') if quarters else None
     )
 
+    return mirror.select(sf, 'lease', where)
+
+# Name of a related record, e.g. get_name(lease, 'Parking_Space__r')
+def get_name(record, relationship):
+    related = record.get(relationship)
+    return related['Name'] if related else None
+
 # Create a CSV file from a list of dictionaries
 def create_csv(name, data, delete=False, logs=True):
     if not data or not len(data) or not name:
@@ -115,22 +171,49 @@ def create_id_csv(data=None, csv_file='to_delete.csv', id_list=None):
 def delete_from_csv(sf, csv_file="to_delete.csv", table=None, remove=True):
     if not table:
         print("No table specified for deletion.")
-        return
+        return False
     
     try:
-        job_id = sf.bulk2.__getattr__(table).delete(csv_file=csv_file)
-        print(f'{table} Delete Job ID: {job_id}')
-        if remove:
-            os.remove(csv_file)
+        id_list = [{'Id': record['Id']} for record in read_records_from_csv(csv_file)]
     except FileNotFoundError:
         print("Nothing to delete.")
-    except AttributeError:
+        return False
+
+    result = delete_from_table(sf, id_list, table=table)
+    if remove:
+        os.remove(csv_file)
+
+    return result
+
+# Delete a list of {'Id': ...} from a table, without writing them to disk first
+def delete_from_table(sf, id_list, table=None):
+    if not table:
+        print("No table specified for deletion.")
+        return False
+
+    if table not in [t['name'] for t in tables.values()]:
         print(f"Table {table} does not exist.")
+        return False
+
+    if not id_list:
+        print("Nothing to delete.")
+        return False
+
+    result = bulk.run(sf, [bulk.BulkJob(table, 'delete', id_list)])
+    print(result)
+    return result.ok()
+
+# Written tables have to be re-pulled from Salesforce on the next mirror read,
+# and cached query results for them are dropped
+def invalidate_table(table):
+    import mirror
+    mirror.invalidate(table)
+    query_cache.invalidate(tables[table]['name'] if table in tables else table)
 
 # Matches records to lease IDs and returns list of IDs
 def get_lease_ids(sf, records):
     leases = get_leases(sf)['records']
-    lookup = {f'{lease['Parking_Space__c']}{lease['Start_Date__c']}':lease['Id']for lease in leases}
+    lookup = {f'{lease.parking_space_ref}{lease.start}': lease.id for lease in leases}
     id_list = []
     for record in records:
         try:
@@ -142,7 +225,7 @@ def get_lease_ids(sf, records):
     return id_list
 
 # Deletes records from lease table
-# Assumes records does not contain salesforce IDs
+# Records without a Salesforce Id (older delete logs) are matched to one by space and start date
 def delete_from_records(sf, records, table=None):
     if not table:
         print("No table specified for deletion.")
@@ -152,14 +235,15 @@ def delete_from_records(sf, records, table=None):
         print("No records provided for deletion.")
         return False
     
-    id_list = get_lease_ids(sf, records)
+    if all(record.get('Id') for record in records):
+        id_list = [{'Id': record['Id']} for record in records]
+    else:
+        id_list = get_lease_ids(sf, records)
     if not id_list:
         print("No matching records found for deletion.")
         return False
     
-    create_id_csv(id_list=id_list, csv_file='to_delete.csv')
-    delete_from_csv(sf, csv_file='to_delete.csv', table=table)
-    return True
+    return delete_from_table(sf, id_list, table=table)
 
 def insert_to_table(sf, to_insert, table=None, save_success=False):
     if not table:
@@ -170,21 +254,15 @@ def insert_to_table(sf, to_insert, table=None, save_success=False):
         print(f'Table {table} not recognized for insertion.')
         return False
     
-    if to_insert:
-        insert_results = sf.bulk2.__getattr__(table).insert(records=to_insert)
-        print(insert_results)
-        job_id = insert_results[0]['job_id']
-        if insert_results[0]['numberRecordsFailed'] == 0:
-            if save_success:
-                sf.bulk2.__getattr__(table).get_successful_records(job_id, file=f'{job_id}_success.csv')
-            return True
-        else:
-            # If failed records, get failed records -> csv
-            sf.bulk2.__getattr__(table).get_failed_records(job_id, file=f'{job_id}_failed.csv')
-    else:
+    if not to_insert:
         print(f'No records to insert into {table}.')
+        return False
 
-    return False
+    # Small batches go through sObject Collections, failed records are written to {job_id}_failed.csv
+    # ({table}_insert_<time>_<n>_failed.csv for collections)
+    result = bulk.run(sf, [bulk.BulkJob(table, 'insert', to_insert)], save_success=save_success)
+    print(result)
+    return result.ok()
 
 def update_table(sf, to_update, table=None):
     if not table:
@@ -195,19 +273,41 @@ def update_table(sf, to_update, table=None):
         print(f'Table {table} not recognized for update.')
         return False
     
-    if to_update:
-        update_results = sf.bulk2.__getattr__(table).update(records=to_update)
-        print(update_results)
-        job_id = update_results[0]['job_id']
-        if update_results[0]['numberRecordsFailed'] == 0:
-            return True
-        else:
-            # If failed records, get failed records -> csv
-            sf.bulk2.__getattr__(table).get_failed_records(job_id, file=f'{job_id}_failed_update.csv')
-    else:
+    if not to_update:
         print(f'No records to update in {table}.')
+        return False
+
+    # Small batches go through sObject Collections, failed records are written to {job_id}_failed.csv
+    # ({table}_update_<time>_<n>_failed.csv for collections)
+    result = bulk.run(sf, [bulk.BulkJob(table, 'update', to_update)])
+    print(result)
+    return result.ok()
+
+# Update records through the sObject Collections API instead of one call per record
+# Much cheaper than a bulk job for small batches, and results come back per record
+# Returns a list of {'id', 'success', 'errors'}, in the same order as to_update
+def update_collection(sf, to_update, table=None):
+    if not table:
+        print('No table specified for update.')
+        return []
+    
+    if table not in [t['name'] for t in tables.values()]:
+        print(f'Table {table} not recognized for update.')
+        return []
+
+    results = bulk.write_collection(sf, table, 'update', to_update)
+    metrics.count('records_written', len(results))
+
+    if results:
+        invalidate_table(table)
+
+    for record, result in zip(to_update, results):
+        if result['success']:
+            print(f'Updated record {record["Id"]}.')
+        else:
+            print(f'Failed to update record {record["Id"]}: {result["errors"]}')
 
-    return False
+    return results
 
 def update_where(sf, where, update_col, update_val, table=None):
     if not table:
@@ -249,58 +349,33 @@ def get_quarter(date):
 # Set parking space lookup
 # Used for converting parking space names to Salesforce IDs
 def set_parking_spaces(sf):
+    import mirror
     result = {}
-    data = query_table(sf, 'parking')['records']
+    data = mirror.select(sf, 'parking')['records']
 
-    for record in data:
-        result[record['Name']] = record['Id']
+    for space in data:
+        result[space.name] = space.id
 
     return result
 
 # Set lease owners lookup
 # Used for converting names to Salesforce IDs
 def set_lease_owners(sf):
+    import mirror
     result = {}
-    data = query_table(sf, 'contractor')['records']
+    data = mirror.select(sf, 'contractor')['records']
 
-    for record in data:
-        result[record['Name']] = record['Id']
+    for contractor in data:
+        result[contractor.name] = contractor.id
 
     return result
 
-# Finds difference in entries between 2 csv files
+# Finds new, removed and changed entries between 2 csv files
 # Outputs to logs/diffs/{diff_file.csv}
 def log_csv_diff(old_file, new_file, diff_file):
-    entries = {}
-    entries_reverse = {}
-    diffs = []
-    with open(old_file, 'r', encoding='utf-8-sig') as f_old, open(new_file, 'r', encoding='utf-8-sig') as f_new:
-        old_csv = csv.reader(f_old)
-        new_csv = csv.reader(f_new)
-        old_lines = iter(old_csv)
-        new_lines = iter(new_csv)
-        headerLine = next(old_lines)
-        next(new_lines)
-
-        for line in old_lines:
-            line_dict = {header:val for header, val in zip(headerLine, line)}
-            entries[line_dict['Entrata_Id__c']] = line_dict
-
-        for line in new_lines:
-            line_dict = {header:val for header, val in zip(headerLine, line)}
-            entries_reverse[line_dict['Entrata_Id__c']] = line_dict
-
-            if line_dict['Entrata_Id__c'] not in entries:
-                line_dict['Change_Type'] = 'New Entry'
-                diffs.append(line_dict)
-
-        for key, value in entries.items():
-            if key not in entries_reverse:
-                value['Change_Type'] = 'Removed Entry'
-                diffs.append(value)
-
-    print(f'{diff_file}: Found {len(diffs)} new/removed entries between {old_file} and {new_file}')
-    create_csv(diff_file, diffs, delete=True)
+    counts = diff.write_diff(diff.diff_files(old_file, new_file), f'logs/{diff_file}.csv')
+    print(f'{diff_file}: Found {counts[diff.NEW]} new, {counts[diff.REMOVED]} removed and '
+          f'{counts[diff.CHANGED]} changed entries between {old_file} and {new_file}')
 
 # Helper for create_diffs
 def get_matching_files(dir = "./logs"):
@@ -329,53 +404,43 @@ def advance_logs():
             old_file = new_file.replace('(1).csv', '.csv')
             os.rename(new_file, old_file)
 
-# Generic comparison between 2 csv files
+# Generic comparison between 2 csv files, file1 is the newer one
 def compare_csvs(file1, file2):
-    diffs = []
-    with open(file1, 'r', encoding='utf-8-sig') as f1, open(file2, 'r', encoding='utf-8-sig') as f2:
-        csv1 = csv.reader(f1)
-        csv2 = csv.reader(f2)
-        lines1 = iter(csv1)
-        lines2 = iter(csv2)
-        headerLine = next(lines1)
-        headerLine2 = next(lines2)
-        if not all(headerLine[i] == headerLine2[i] for i in range(len(headerLine))):
-            print('CSV files have different headers, cannot compare.')
-            return []
-
-        entries1 = {line[0]: line for line in lines1}
-        entries2 = {line[0]: line for line in lines2}
-
-        # Verify that nothing has changed
-        for space, line in entries1.items():
-            if space in entries2:
-                if not all(line[i] == entries2[space][i] for i in range(len(line))):
-                    d = {headerLine[i]: line[i] for i in range(len(line))}
-                    diffs.append(d)
-            else:
-                d = {headerLine[i]: line[i] for i in range(len(line))}
-                diffs.append(d)
-                
-    return diffs
+    return list(diff.diff_files(file2, file1))
 
 def drive_csv_diff(new_file, old_file):
     diff_file = 'csvs/changed.csv'
-    diffs = compare_csvs(new_file, old_file)
-    create_csv(diff_file, diffs, delete=True, logs=False)
+    counts = diff.write_diff(diff.diff_files(old_file, new_file), diff_file)
+    print(f'{diff_file}: {counts[diff.NEW]} new, {counts[diff.REMOVED]} removed and '
+          f'{counts[diff.CHANGED]} changed spaces since {old_file}')
+
+REPORT_SUFFIX = '_Rentable Items Availability.csv'
+
+# Report file name for a date, e.g. 2025-10-17_Rentable Items Availability.csv
+def report_name(d):
+    return d.strftime("%Y-%m-%d") + REPORT_SUFFIX
+
+def is_report(name):
+    return name.endswith(REPORT_SUFFIX)
+
+def get_drive_dir():
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.getenv("DRIVE_DIR")
 
 # Gets most recent file from google drive folder
 # "Most Recent" determined by filename date prefix YYYY-MM-DD
-def download_from_drive():
-    tgt_name = dt.datetime.now().strftime("%Y-%m-%d") + "_Rentable Items Availability.csv"
-    if os.path.exists(f'csvs/{tgt_name}'):
+# refresh copies today's file again even if it was already downloaded (it was re-uploaded)
+def download_from_drive(refresh=False):
+    tgt_name = report_name(dt.datetime.now())
+    if os.path.exists(f'csvs/{tgt_name}') and not refresh:
         print("Most recent file already downloaded.")
         return True
     
-    load_dotenv()
-    drive_dir = os.getenv("DRIVE_DIR")
-    file_list = os.listdir(drive_dir)
+    drive_dir = get_drive_dir()
+    file_list = [name for name in os.listdir(drive_dir) if is_report(name)]
     file_list.sort(key=lambda x: x.split("_")[0])
-    most_recent = file_list[-1]
+    most_recent = file_list[-1] if file_list else None
     if most_recent != tgt_name:
         print(f"Most recent file '{most_recent}' does not match today's date '{tgt_name}'")
         return False
@@ -383,8 +448,8 @@ def download_from_drive():
     previous = file_list[-2] if len(file_list) > 1 else None
     print(f'Added {most_recent}')
     shutil.copyfile(f'{drive_dir}/{most_recent}', f'csvs/{most_recent}')
-    yesterday = tgt_name.replace(str(dt.datetime.now().day), str(dt.datetime.now().day - 1)) \
-                + '_Rentable Items Availability.csv'
+    # Date arithmetic, so the 1st of the month finds the last day of the previous one
+    yesterday = report_name(dt.date.today() - dt.timedelta(days=1))
 
     if previous == yesterday:
         try:
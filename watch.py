@@ -0,0 +1,137 @@
+import os
+import time
+import threading
+import contextlib
+
+# Runs a command as soon as new files land in a folder, for long-running daemons (sf_add --watch)
+# Uses inotify (pip install inotify_simple) when it's available, otherwise polls the folder
+#
+# Events are debounced: the command runs once the folder has been quiet for WATCH_DEBOUNCE seconds,
+# so a report that is still syncing (or lands with a few temp files) only triggers one run
+# Runs are single-flight, guarded by a lock file, so the daemon and a cron run never overlap
+
+# Seconds without a new event before running, override with WATCH_DEBOUNCE
+DEFAULT_DEBOUNCE = 5
+# Seconds between folder scans when polling
+POLL_INTERVAL = 10
+# A run that crashed without removing its lock doesn't block the next one forever
+LOCK_TTL = 60 * 60
+# A live run touches its lock this often, so a run longer than LOCK_TTL doesn't lose it
+LOCK_HEARTBEAT = 60
+
+# Names of files created, rewritten or moved into a folder, read with inotify
+class InotifyWatcher():
+    name = 'inotify'
+
+    def __init__(self, path):
+        from inotify_simple import INotify, flags
+        self.inotify = INotify()
+        self.inotify.add_watch(path, flags.CLOSE_WRITE | flags.MOVED_TO)
+
+    # Blocks until something changes or timeout (seconds) runs out
+    def wait(self, timeout):
+        return {event.name for event in self.inotify.read(timeout=int(timeout * 1000))}
+
+# Same as InotifyWatcher, by comparing the folder's file sizes and modified times every interval
+# Works on any platform and on network or synced drives where inotify sees nothing
+class PollingWatcher():
+    name = 'polling'
+
+    def __init__(self, path, interval=POLL_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.files = self.scan()
+
+    def scan(self):
+        with os.scandir(self.path) as entries:
+            return {entry.name: (entry.stat().st_mtime_ns, entry.stat().st_size) for entry in entries if entry.is_file()}
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        files = self.scan()
+        changed = {name for name, stat in files.items() if self.files.get(name) != stat}
+        self.files = files
+        return changed
+
+# Read when the watch starts, after .env is loaded
+def get_debounce():
+    from dotenv import load_dotenv
+    load_dotenv()
+    return float(os.getenv('WATCH_DEBOUNCE', DEFAULT_DEBOUNCE))
+
+def get_watcher(path, poll_interval=POLL_INTERVAL):
+    try:
+        return InotifyWatcher(path)
+    except (ImportError, OSError) as e:
+        print(f"inotify not available ({e}), polling {path} every {poll_interval}s")
+        return PollingWatcher(path, poll_interval)
+
+# Keeps the lock's modified time fresh until stop is set
+def heartbeat(path, stop, interval=LOCK_HEARTBEAT):
+    while not stop.wait(interval):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return
+
+# Yields whether this process holds the lock, a second run at the same time gets False
+# The lock only goes stale LOCK_TTL after its holder stopped touching it
+@contextlib.contextmanager
+def single_flight(path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+        if time.time() - os.path.getmtime(path) > LOCK_TTL:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        yield False
+        return
+
+    stop = threading.Event()
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(os.getpid()))
+        threading.Thread(target=heartbeat, args=(path, stop), daemon=True).start()
+        yield True
+    finally:
+        stop.set()
+        os.remove(path)
+
+# Calls run(names) with the files that changed since the last run, once they've settled
+# Only names that pass matches (all, if it isn't given) count as changes
+# Also runs once on start, to catch up on anything that landed while the daemon was down
+# A failed run is printed and waits for the next change; a run blocked by the lock is retried
+def watch(path, run, lock, matches=None, debounce=None, poll_interval=POLL_INTERVAL):
+    debounce = get_debounce() if debounce is None else debounce
+    watcher = get_watcher(path, poll_interval)
+    print(f"Watching {path} ({watcher.name}), Ctrl+C to stop")
+    changed = set()
+    due = time.monotonic()
+    try:
+        while True:
+            timeout = poll_interval if due is None else max(0, due - time.monotonic())
+            names = {name for name in watcher.wait(timeout) if matches is None or matches(name)}
+            if names:
+                changed |= names
+                due = time.monotonic() + debounce
+
+            if due is None or time.monotonic() < due:
+                continue
+
+            with single_flight(lock) as acquired:
+                if not acquired:
+                    print(f"Another run holds {lock}, retrying in {debounce}s")
+                    due = time.monotonic() + debounce
+                    continue
+
+                names, changed, due = changed, set(), None
+                try:
+                    run(names)
+                except Exception as e:
+                    print(f"Run failed: {e}")
+    except KeyboardInterrupt:
+        print("Stopped watching.")